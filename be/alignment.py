@@ -0,0 +1,131 @@
+"""
+Banded onset alignment of a performance against a reference
+
+Edit-distance DP where pairing a played note with a reference note costs
+its pitch mismatch plus its onset deviation, an unplayed reference note is
+a deletion (missing) and an unexpected played note an insertion (extra).
+Only cells within `band` of the scaled diagonal are computed, so the work
+is O(m * band) instead of O(m * n). Each DP row is updated with a handful
+of NumPy operations; insertions along a row are resolved with a running
+minimum instead of a per-cell loop.
+"""
+import math
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+MATCH = "match"            # Same pitch
+SUBSTITUTE = "substitute"  # Paired with a different pitch (wrong note)
+DELETE = "delete"          # Reference note not played (missing note)
+INSERT = "insert"          # Played note not in the reference (extra note)
+
+SUBSTITUTE_COST = 1.0
+DELETE_COST = 1.0
+INSERT_COST = 1.0
+TIMING_COST = 0.5  # Added to a pairing whose onset is off by >= tolerance
+
+_EPSILON = 1e-6
+
+# (op, reference index, performance index)
+AlignmentStep = Tuple[str, Optional[int], Optional[int]]
+
+
+def _pair_cost(ref_note: int, ref_onset: float, perf_note: int, perf_onset: float, tolerance_ms: float) -> float:
+    pitch = 0.0 if ref_note == perf_note else SUBSTITUTE_COST
+    return pitch + min(abs(perf_onset - ref_onset) / tolerance_ms, 1.0) * TIMING_COST
+
+
+def align(ref_onsets: Sequence[int], ref_notes: Sequence[int],
+          perf_onsets: Sequence[int], perf_notes: Sequence[int],
+          tolerance_ms: float, band: int = 32) -> List[AlignmentStep]:
+    """
+    Align two onset-sorted note sequences
+
+    Args:
+        ref_onsets / ref_notes: Reference onsets (ms) and pitches
+        perf_onsets / perf_notes: Performance onsets (ms) and pitches
+        tolerance_ms: Deviation at which a pairing gets the full timing cost
+        band: Half-width of the diagonal band, in performance notes
+
+    Returns:
+        List[AlignmentStep]: Alignment path in sequence order
+    """
+    m, n = len(ref_onsets), len(perf_onsets)
+    if m == 0:
+        return [(INSERT, None, j) for j in range(n)]
+    if n == 0:
+        return [(DELETE, i, None) for i in range(m)]
+
+    ref_on = np.asarray(ref_onsets, dtype=np.float64)
+    ref_nt = np.asarray(ref_notes, dtype=np.int16)
+    perf_on = np.asarray(perf_onsets, dtype=np.float64)
+    perf_nt = np.asarray(perf_notes, dtype=np.int16)
+
+    # The band must cover the diagonal's per-row step so rows stay connected
+    w = max(band, math.ceil(n / m) + 1)
+    width = 2 * w + 1
+    offsets = np.arange(width)
+    ramp = offsets * INSERT_COST
+    # First column of each row's band, centred on the scaled diagonal
+    lo = np.rint(np.arange(m + 1) * (n / m)).astype(np.int64) - w
+
+    # Column j of row i lives at D[i, width + j - lo[i]]; a band of inf on
+    # each side lets neighbouring rows be read with plain slices
+    D = np.full((m + 1, 3 * width), np.inf)
+
+    cols = lo[:, None] + offsets                       # (m + 1, width)
+    outside = (cols < 0) | (cols > n)
+
+    # Pairing cost of reference note i - 1 with performance note j - 1
+    perf_idx = np.clip(cols[1:] - 1, 0, n - 1)
+    pair_cost = np.where(perf_nt[perf_idx] == ref_nt[:, None], 0.0, SUBSTITUTE_COST)
+    pair_cost += np.minimum(np.abs(perf_on[perf_idx] - ref_on[:, None]) / tolerance_ms, 1.0) * TIMING_COST
+    pair_cost[(cols[1:] < 1) | (cols[1:] > n)] = np.inf
+
+    row = cols[0] * INSERT_COST
+    row[outside[0]] = np.inf
+    D[0, width:2 * width] = row
+
+    for i in range(1, m + 1):
+        shift = int(lo[i] - lo[i - 1])
+        prev = D[i - 1]
+        up = prev[width + shift:2 * width + shift] + DELETE_COST
+        diag = prev[width + shift - 1:2 * width + shift - 1] + pair_cost[i - 1]
+        row = np.minimum(up, diag)
+        # Chains of insertions: D[k] = min over k' <= k of row[k'] + (k - k') * INSERT_COST
+        row -= ramp
+        np.minimum.accumulate(row, out=row)
+        row += ramp
+        row[outside[i]] = np.inf
+        D[i, width:2 * width] = row
+
+    # Walk back from the end, preferring pairings, then deletions
+    band_rows = D[:, width:2 * width].tolist()
+    lo = lo.tolist()
+    ref_on, ref_nt = ref_on.tolist(), ref_nt.tolist()
+    perf_on, perf_nt = perf_on.tolist(), perf_nt.tolist()
+
+    def value(i: int, j: int) -> float:
+        k = j - lo[i]
+        return band_rows[i][k] if 0 <= k < width else math.inf
+
+    steps = []
+    i, j = m, n
+    while i > 0 or j > 0:
+        current = value(i, j)
+        if i > 0 and j > 0:
+            cost = _pair_cost(ref_nt[i - 1], ref_on[i - 1], perf_nt[j - 1], perf_on[j - 1], tolerance_ms)
+            if abs(value(i - 1, j - 1) + cost - current) <= _EPSILON:
+                steps.append((MATCH if ref_nt[i - 1] == perf_nt[j - 1] else SUBSTITUTE, i - 1, j - 1))
+                i -= 1
+                j -= 1
+                continue
+        if i > 0 and abs(value(i - 1, j) + DELETE_COST - current) <= _EPSILON:
+            steps.append((DELETE, i - 1, None))
+            i -= 1
+            continue
+        steps.append((INSERT, None, j - 1))
+        j -= 1
+
+    steps.reverse()
+    return steps
@@ -0,0 +1,174 @@
+"""
+Audio rendering of harmonized output
+
+Renders the note spans MidiGenerator would write to 16-bit mono WAV, for
+clients without a MIDI synthesizer. Each General MIDI program the
+generator uses maps to a timbre:
+
+- Piano (program 0, melody): a few decaying partials, percussive envelope
+- String Ensemble (program 48, harmony): saw-like partials, slow attack
+
+Every (timbre, note) tone is synthesized once as an exactly periodic loop
+and cached for all requests. Rendering walks the output in fixed blocks:
+each sounding note adds a slice of its loop times its envelope, computed
+with NumPy over the whole slice. Blocks are converted to PCM and yielded
+as they are done, so memory does not grow with the duration.
+"""
+import struct
+from functools import lru_cache
+from typing import Iterator, List, NamedTuple, Sequence, Tuple
+
+import numpy as np
+
+from midi_utils import NoteSpan
+
+MEDIA_TYPE = "audio/wav"
+WAV_HEADER_SIZE = 44
+SAMPLE_WIDTH = 2  # 16-bit PCM
+
+# Seconds per cached tone loop. The fundamental is rounded to whole cycles
+# per loop, so the pitch error is at most 1 / (2 * LOOP_SEC) Hz
+LOOP_SEC = 2
+
+
+class Timbre(NamedTuple):
+    partials: Tuple[float, ...]  # Amplitude of harmonics 1, 2, 3, ...
+    attack_sec: float
+    decay_sec: float             # Exponential decay time constant (0 = sustain)
+    release_sec: float
+    level: float                 # Peak amplitude at velocity 127
+
+
+PIANO = Timbre(partials=(1.0, 0.5, 0.3, 0.15, 0.08, 0.04), attack_sec=0.005,
+               decay_sec=0.9, release_sec=0.08, level=0.3)
+STRINGS = Timbre(partials=tuple(1.0 / k for k in range(1, 9)), attack_sec=0.08,
+                 decay_sec=0.0, release_sec=0.25, level=0.12)
+
+# General MIDI program -> timbre
+PROGRAM_TIMBRES = {
+    0: PIANO,
+    48: STRINGS,
+}
+
+MAX_RELEASE_SEC = max(timbre.release_sec for timbre in PROGRAM_TIMBRES.values())
+
+
+def _total_samples(duration_sec: int, sample_rate: int) -> int:
+    # Notes ending at duration_sec still get their release
+    return int(round((duration_sec + MAX_RELEASE_SEC) * sample_rate))
+
+
+def wav_header(sample_count: int, sample_rate: int) -> bytes:
+    data_size = sample_count * SAMPLE_WIDTH
+    return b"".join((
+        b"RIFF", struct.pack("<I", 36 + data_size), b"WAVE",
+        b"fmt ", struct.pack("<IHHIIHH", 16, 1, 1, sample_rate, sample_rate * SAMPLE_WIDTH, SAMPLE_WIDTH, 16),
+        b"data", struct.pack("<I", data_size),
+    ))
+
+
+@lru_cache(maxsize=512)
+def tone_loop(timbre: Timbre, note: int, sample_rate: int) -> np.ndarray:
+    """
+    One LOOP_SEC loop of a note's waveform, repeated twice
+    Twice so any LOOP_SEC-long slice starting inside the first copy is contiguous.
+    """
+    length = LOOP_SEC * sample_rate
+    frequency = 440.0 * 2.0 ** ((note - 69) / 12.0)
+    fundamental_cycles = max(1, round(frequency * LOOP_SEC))
+    phase = np.arange(length) * (2.0 * np.pi / length)
+    wave = np.zeros(length)
+    for harmonic, amplitude in enumerate(timbre.partials, start=1):
+        cycles = fundamental_cycles * harmonic
+        if cycles >= length // 2:
+            break  # At or above Nyquist
+        wave += amplitude * np.sin(phase * cycles)
+    wave /= np.abs(wave).max()
+    loop = np.concatenate((wave, wave)).astype(np.float32)
+    loop.setflags(write=False)
+    return loop
+
+
+def _envelope(timbre: Timbre, offsets: np.ndarray, held: int, sample_rate: int) -> np.ndarray:
+    """Envelope at sample offsets from note on, for a note held `held` samples"""
+    t = offsets / sample_rate
+    env = np.minimum(t / timbre.attack_sec, 1.0)
+    if timbre.decay_sec:
+        env *= np.exp(-t / timbre.decay_sec)
+    release = offsets >= held
+    if release.any():
+        # Fade out linearly from note off
+        env[release] *= np.maximum(1.0 - (t[release] - held / sample_rate) / timbre.release_sec, 0.0)
+    return env
+
+
+class _Voice:
+    __slots__ = ("start", "held", "stop", "loop", "timbre", "gain")
+
+    def __init__(self, start: int, held: int, timbre: Timbre, loop: np.ndarray, gain: float, sample_rate: int):
+        self.start = start
+        self.held = held
+        self.stop = start + held + int(round(timbre.release_sec * sample_rate))
+        self.timbre = timbre
+        self.loop = loop
+        self.gain = gain
+
+
+def render_wav(spans: Sequence[NoteSpan], channel_programs: dict, ticks_per_beat: int, duration_sec: int,
+               sample_rate: int = 22050, block_samples: int = 8192) -> Tuple[int, Iterator[bytes]]:
+    """
+    Render note spans (one beat per second) to a WAV file, lazily
+
+    Args:
+        spans: (channel, note, velocity, start tick, end tick), sorted by start tick
+        channel_programs: Channel -> General MIDI program
+        ticks_per_beat: Tick resolution of the spans
+
+    Returns:
+        tuple: (total_size, chunk iterator); the first chunk is the header
+    """
+    total = _total_samples(duration_sec, sample_rate)
+    # A block never needs more than one loop length of a tone
+    block_samples = max(1, min(block_samples, LOOP_SEC * sample_rate))
+    return WAV_HEADER_SIZE + total * SAMPLE_WIDTH, _render_chunks(
+        spans, channel_programs, ticks_per_beat, total, sample_rate, block_samples)
+
+
+def _render_chunks(spans: Sequence[NoteSpan], channel_programs: dict, ticks_per_beat: int, total: int,
+                   sample_rate: int, block_samples: int) -> Iterator[bytes]:
+    yield wav_header(total, sample_rate)
+
+    loop_length = LOOP_SEC * sample_rate
+    to_samples = sample_rate / ticks_per_beat
+    next_span = 0
+    active: List[_Voice] = []
+
+    for block_start in range(0, total, block_samples):
+        block_end = min(block_start + block_samples, total)
+        mix = np.zeros(block_end - block_start, dtype=np.float32)
+
+        while next_span < len(spans):
+            channel, note, velocity, start_tick, end_tick = spans[next_span]
+            start = int(round(start_tick * to_samples))
+            if start >= block_end:
+                break
+            next_span += 1
+            timbre = PROGRAM_TIMBRES[channel_programs[channel]]
+            held = max(int(round(end_tick * to_samples)) - start, 1)
+            active.append(_Voice(start, held, timbre, tone_loop(timbre, note, sample_rate),
+                                 timbre.level * velocity / 127.0, sample_rate))
+
+        for voice in active:
+            begin = max(voice.start, block_start)
+            end = min(voice.stop, block_end)
+            if begin >= end:
+                continue
+            offset = begin - voice.start
+            phase = offset % loop_length
+            offsets = np.arange(offset, end - voice.start, dtype=np.float64)
+            env = _envelope(voice.timbre, offsets, voice.held, sample_rate)
+            mix[begin - block_start:end - block_start] += voice.loop[phase:phase + end - begin] * (env * voice.gain)
+
+        active = [voice for voice in active if voice.stop > block_end]
+        np.clip(mix, -1.0, 1.0, out=mix)
+        yield (mix * 32767.0).astype("<i2").tobytes()
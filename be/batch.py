@@ -0,0 +1,187 @@
+"""
+Batch harmonization
+
+Validated items are split into chunks and generated on a process pool.
+Results are streamed back as they complete, either as NDJSON lines
+(base64 MIDI + chord details) or as a ZIP archive written on the fly.
+"""
+import asyncio
+import base64
+import io
+import json
+import logging
+import multiprocessing
+import zipfile
+from concurrent.futures import BrokenExecutor, Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+import config
+from midi_utils import MidiGenerator
+from models import HarmonyModeEnum, KeyEnum
+from note_sequence import NoteSequence
+
+logger = logging.getLogger(__name__)
+
+# (index, notes, duration_sec, key, harmony_mode); notes pickle as flat arrays
+BatchJob = Tuple[int, NoteSequence, int, KeyEnum, HarmonyModeEnum]
+
+# Per-process generator; pool workers never persist files locally
+_generator = None
+
+
+def _get_generator() -> MidiGenerator:
+    global _generator
+    if _generator is None:
+        _generator = MidiGenerator(encoder=config.MIDI_ENCODER)
+    return _generator
+
+
+def generate_chunk(jobs: List[BatchJob]) -> List[Dict]:
+    """Run in a pool worker: harmonize every job, capturing failures per item"""
+    generator = _get_generator()
+    results = []
+    for index, notes, duration_sec, key, harmony_mode in jobs:
+        try:
+            midi_bytes, chord_names_info = generator.create_harmonized_midi(
+                events=notes,
+                duration_sec=duration_sec,
+                key=key,
+                harmony_mode=harmony_mode
+            )
+        except Exception as e:
+            results.append(item_error(index, "generation_error", str(e)))
+            continue
+        results.append({
+            "index": index,
+            "status": "ok",
+            "midi_bytes": midi_bytes,
+            "chord_names_info": chord_names_info
+        })
+    return results
+
+
+def item_error(index: int, error_code: str, message: str) -> Dict:
+    return {"index": index, "status": "error", "error_code": error_code, "message": message}
+
+
+class BatchRunner:
+    """Fans batch jobs out over a lazily created executor"""
+
+    def __init__(self, workers: int = 0, chunk_size: int = 16):
+        """
+        Args:
+            workers: Process pool size; 0 runs jobs on a single thread instead
+            chunk_size: Jobs sent to a worker per task
+        """
+        self.workers = workers
+        self.chunk_size = max(1, chunk_size)
+        self._executor: Optional[Executor] = None
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            if self.workers > 0:
+                # spawn keeps workers clean of the server's threads and sockets
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn")
+                )
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="batch")
+        return self._executor
+
+    async def _run_chunk(self, executor: Executor, chunk: List[BatchJob]) -> List[Dict]:
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(executor, generate_chunk, chunk)
+        except Exception as e:
+            # A crashed worker fails its whole chunk; report it per item
+            logger.error(f"Batch chunk failed: {str(e)}")
+            if isinstance(e, BrokenExecutor) and self._executor is executor:
+                # Start a fresh pool for the next batch
+                executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+            return [item_error(index, "generation_error", str(e)) for index, *_ in chunk]
+
+    async def run(self, jobs: List[BatchJob]) -> AsyncIterator[Dict]:
+        """Yield per-item results in completion order"""
+        if not jobs:
+            return
+        executor = self._get_executor()
+        tasks = [
+            asyncio.ensure_future(self._run_chunk(executor, jobs[i:i + self.chunk_size]))
+            for i in range(0, len(jobs), self.chunk_size)
+        ]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                for result in await next_done:
+                    yield result
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+async def ndjson_stream(errors: List[Dict], results: AsyncIterator[Dict]) -> AsyncIterator[bytes]:
+    """One JSON object per line; MIDI bytes are base64 encoded"""
+    for error in errors:
+        yield (json.dumps(error) + "\n").encode()
+    async for result in results:
+        if result["status"] == "ok":
+            chord_names_info = result["chord_names_info"]
+            line = {
+                "index": result["index"],
+                "status": "ok",
+                "midi_base64": base64.b64encode(result["midi_bytes"]).decode("ascii"),
+                "chord_names": [chord['chord_name'] for chord in chord_names_info],
+                "chord_details": chord_names_info
+            }
+        else:
+            line = result
+        yield (json.dumps(line) + "\n").encode()
+
+
+class _StreamBuffer(io.RawIOBase):
+    """Unseekable sink that lets zipfile write straight into the response"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+async def zip_stream(errors: List[Dict], results: AsyncIterator[Dict]) -> AsyncIterator[bytes]:
+    """
+    ZIP archive with NNNN.mid and NNNN.json (chord details) per item,
+    followed by manifest.json listing every item's status
+    """
+    sink = _StreamBuffer()
+    manifest = list(errors)
+    with zipfile.ZipFile(sink, mode="w", compression=zipfile.ZIP_STORED) as archive:
+        async for result in results:
+            index = result["index"]
+            if result["status"] == "ok":
+                archive.writestr(f"{index:04d}.mid", result["midi_bytes"])
+                archive.writestr(f"{index:04d}.json", json.dumps(result["chord_names_info"]))
+                manifest.append({"index": index, "status": "ok", "file": f"{index:04d}.mid"})
+            else:
+                manifest.append(result)
+            data = sink.drain()
+            if data:
+                yield data
+        manifest.sort(key=lambda item: item["index"])
+        archive.writestr("manifest.json", json.dumps(manifest))
+    yield sink.drain()
@@ -0,0 +1,440 @@
+"""
+Microbenchmarks for the generator and evaluator hot paths
+
+Usage:
+    python bench.py run [--output baseline.json]
+    python bench.py compare baseline.json [--current current.json] [--threshold 0.25]
+
+Each benchmark runs for every (event count, duration) pair. `run` prints the
+results and optionally saves them as a JSON baseline; `compare` runs the
+suite (or loads --current) and exits with status 1 when any benchmark's
+median is slower than the baseline by more than the threshold.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+# Keep the in-process app quiet and side-effect free
+os.environ.setdefault("HARMONY_MIDI_OUTPUT_ENABLED", "false")
+os.environ.setdefault("HARMONY_HISTORY_ENABLED", "false")
+os.environ.setdefault("HARMONY_REFERENCE_RELOAD_SEC", "0")
+os.environ.setdefault("HARMONY_BATCH_WORKERS", "0")
+
+import numpy as np
+
+import audio_render
+from live_accompaniment import LiveAccompanimentSession
+from midi_storage import MidiStorage
+from midi_utils import MidiGenerator, MusicEvaluator
+from models import QUANTIZE_MS, EvaluateRequest, QuantizeEnum, HarmonizeRequest, HarmonyModeEnum, KeyEnum, MusicEvent
+from note_sequence import NoteSequence
+from smf_writer import ENCODER_DIRECT, ENCODER_MIDO, create_writer
+
+REFERENCE_ID = "exercise_c_major_01"
+WHITE_KEYS = [60, 62, 64, 65, 67, 69, 71]
+BATCH_SUBMISSIONS = 100
+
+# name -> setup(events payload, duration) returning the callable to time
+BENCHMARKS: Dict[str, Callable] = {}
+
+
+def benchmark(name: str):
+    def register(setup):
+        BENCHMARKS[name] = setup
+        return setup
+    return register
+
+
+def make_payload(event_count: int, duration_sec: int, seed: int = 0) -> Tuple[List[Dict], str]:
+    """Evenly spaced events over the duration, on the coarsest grid that keeps them unique"""
+    rng = random.Random(seed)
+    step_ms = duration_sec * 1000 // event_count
+    quantize = max((q for q, ms in QUANTIZE_MS.items() if ms <= step_ms), key=QUANTIZE_MS.get)
+    events = [{"t_ms": i * step_ms, "note": rng.choice(WHITE_KEYS)} for i in range(event_count)]
+    return events, quantize.value
+
+
+def request_body(mode: str, events: List[Dict], duration_sec: int, quantize: str) -> Dict:
+    body = {
+        "version": "1.0",
+        "mode": mode,
+        "duration_sec": duration_sec,
+        "quantize": quantize,
+        "octave_base": "C4",
+        "key": "C major",
+        "events": events,
+    }
+    if mode == "evaluate":
+        body["reference_id"] = REFERENCE_ID
+    return body
+
+
+def parse_events(events: List[Dict]) -> List[MusicEvent]:
+    return [MusicEvent(**event) for event in events]
+
+
+# Generator
+
+@benchmark("generator.end_to_end")
+def _generator_end_to_end(payload, duration_sec):
+    generator, events = MidiGenerator(), parse_events(payload[0])
+    return lambda: generator.create_harmonized_midi(events, duration_sec)
+
+
+@benchmark("generator.end_to_end_mido")
+def _generator_end_to_end_mido(payload, duration_sec):
+    generator, events = MidiGenerator(encoder=ENCODER_MIDO), parse_events(payload[0])
+    return lambda: generator.create_harmonized_midi(events, duration_sec)
+
+
+@benchmark("generator.melody")
+def _generator_melody(payload, duration_sec):
+    generator, notes = MidiGenerator(), NoteSequence.from_events(parse_events(payload[0]))
+
+    def run():
+        writer = create_writer(ENCODER_DIRECT, generator.ticks_per_beat, len(notes))
+        writer.start_track()
+        generator._add_melody_events(writer, notes, duration_sec)
+    return run
+
+
+@benchmark("generator.harmony")
+def _generator_harmony(payload, duration_sec):
+    generator, notes = MidiGenerator(), NoteSequence.from_events(parse_events(payload[0]))
+
+    def run():
+        writer = create_writer(ENCODER_DIRECT, generator.ticks_per_beat, len(notes))
+        writer.start_track()
+        generator._add_harmony_events(writer, notes, duration_sec)
+    return run
+
+
+@benchmark("generator.harmony_major_triad")
+def _generator_harmony_major_triad(payload, duration_sec):
+    generator, notes = MidiGenerator(), NoteSequence.from_events(parse_events(payload[0]))
+
+    def run():
+        writer = create_writer(ENCODER_DIRECT, generator.ticks_per_beat, len(notes))
+        writer.start_track()
+        generator._add_harmony_events(writer, notes, duration_sec, KeyEnum.C_MAJOR, HarmonyModeEnum.MAJOR_TRIAD)
+    return run
+
+
+@benchmark("generator.live_accompaniment")
+def _generator_live_accompaniment(payload, duration_sec):
+    # A whole take note by note, as the WebSocket loop runs it: validation plus chord message
+    generator, quantize = MidiGenerator(), QuantizeEnum(payload[1])
+
+    def run():
+        session = LiveAccompanimentSession(generator, quantize=quantize)
+        for item in payload[0]:
+            session.add_note(MusicEvent.model_validate(item))
+        session.finish()
+    return run
+
+
+@benchmark("generator.to_bytes")
+def _generator_to_bytes(payload, duration_sec):
+    generator, notes = MidiGenerator(), NoteSequence.from_events(parse_events(payload[0]))
+    writer = create_writer(ENCODER_DIRECT, generator.ticks_per_beat, len(notes))
+    writer.start_track()
+    generator._add_melody_events(writer, notes, duration_sec)
+    writer.end_track()
+    writer.start_track()
+    generator._add_harmony_events(writer, notes, duration_sec)
+    writer.end_track()
+    return lambda: generator._midi_to_bytes(writer)
+
+
+@benchmark("generator.save")
+def _generator_save(payload, duration_sec):
+    # Only the request-path cost (enqueueing); the writes happen on the storage thread
+    output_dir = tempfile.mkdtemp(prefix="harmony_bench_")
+    storage = MidiStorage(output_dir=output_dir, queue_size=1 << 20, fsync=False, max_files=64)
+    generator = MidiGenerator(storage=storage)
+    midi_bytes, _ = generator.create_harmonized_midi(parse_events(payload[0]), duration_sec)
+    run = lambda: generator._save_midi_file(midi_bytes, "bench.mid")
+
+    def teardown():
+        storage.close()
+        shutil.rmtree(output_dir, ignore_errors=True)
+    run.after_repeat = storage.flush
+    run.teardown = teardown
+    return run
+
+
+@benchmark("generator.stream")
+def _generator_stream(payload, duration_sec):
+    generator, events = MidiGenerator(), parse_events(payload[0])
+
+    def run():
+        _, chunks = generator.stream_harmonized_midi(events, duration_sec)
+        for _ in chunks:
+            pass
+    return run
+
+
+@benchmark("audio.render_wav")
+def _audio_render_wav(payload, duration_sec):
+    generator, events = MidiGenerator(), parse_events(payload[0])
+    spans = generator.note_spans(events, duration_sec)
+    programs = {0: generator.melody_program, 1: generator.harmony_program}
+
+    def run():
+        _, chunks = audio_render.render_wav(spans, programs, generator.ticks_per_beat, duration_sec)
+        for _ in chunks:
+            pass
+    return run
+
+
+@benchmark("generator.note_sequence")
+def _generator_note_sequence(payload, duration_sec):
+    events = parse_events(payload[0])
+    return lambda: NoteSequence.from_events(events)
+
+
+# Evaluator
+
+@benchmark("evaluator.slot")
+def _evaluator_slot(payload, duration_sec):
+    evaluator, events = MusicEvaluator(), parse_events(payload[0])
+    return lambda: evaluator.evaluate_performance(events, REFERENCE_ID, duration_sec)
+
+
+@benchmark("evaluator.aligned")
+def _evaluator_aligned(payload, duration_sec):
+    evaluator, events = MusicEvaluator(), parse_events(payload[0])
+    return lambda: evaluator.evaluate_aligned(events, REFERENCE_ID, duration_sec)
+
+
+@benchmark("evaluator.polyphonic")
+def _evaluator_polyphonic(payload, duration_sec):
+    # Each event becomes a held triad, three notes per onset
+    evaluator = MusicEvaluator()
+    events = [MusicEvent(t_sec=item["t_ms"] // 1000, t_ms=item["t_ms"], note=note, dur_ms=500)
+              for item in payload[0] for note in (item["note"], item["note"] + 4, item["note"] + 7)
+              if note in WHITE_KEYS]
+    return lambda: evaluator.evaluate_polyphonic(events, REFERENCE_ID, duration_sec)
+
+
+@benchmark(f"evaluator.batch_x{BATCH_SUBMISSIONS}")
+def _evaluator_batch(payload, duration_sec):
+    evaluator, events = MusicEvaluator(), parse_events(payload[0])
+    submissions = [events] * BATCH_SUBMISSIONS
+    return lambda: evaluator.evaluate_batch(submissions, REFERENCE_ID, duration_sec)
+
+
+# Validation
+
+@benchmark("validation.harmonize_request")
+def _validation_harmonize(payload, duration_sec):
+    body = request_body("harmonize", payload[0], duration_sec, payload[1])
+    return lambda: HarmonizeRequest.model_validate(body)
+
+
+@benchmark("validation.evaluate_request")
+def _validation_evaluate(payload, duration_sec):
+    body = request_body("evaluate", payload[0], duration_sec, payload[1])
+    return lambda: EvaluateRequest.model_validate(body)
+
+
+# Full in-process ASGI calls
+
+async def asgi_request(app, method: str, path: str, body: bytes = b"",
+                       headers: Optional[List[Tuple[bytes, bytes]]] = None) -> Tuple[int, bytes]:
+    """Drive one HTTP request through an ASGI app without a server or client library"""
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1",
+        "method": method, "scheme": "http", "path": path, "raw_path": path.encode(),
+        "query_string": b"", "root_path": "", "server": ("bench", 80), "client": ("bench", 1),
+        "headers": [(b"host", b"bench"), (b"content-length", str(len(body)).encode())] + (headers or []),
+    }
+    sent = False
+    status, chunks = 0, []
+
+    async def receive():
+        nonlocal sent
+        if not sent:
+            sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+        elif message["type"] == "http.response.body":
+            chunks.append(message.get("body", b""))
+
+    await app(scope, receive, send)
+    return status, b"".join(chunks)
+
+
+def _asgi_benchmark(mode: str, path: str, before: Callable = None):
+    def setup(payload, duration_sec):
+        import main
+        body = json.dumps(request_body(mode, payload[0], duration_sec, payload[1])).encode()
+        headers = [(b"content-type", b"application/json")]
+        loop = asyncio.new_event_loop()
+        status, response = loop.run_until_complete(asgi_request(main.app, "POST", path, body, headers))
+        if status != 200:
+            raise RuntimeError(f"{path} returned {status}: {response[:200]!r}")
+
+        def run():
+            if before is not None:
+                before(main)
+            loop.run_until_complete(asgi_request(main.app, "POST", path, body, headers))
+        run.teardown = loop.close
+        return run
+    return setup
+
+
+benchmark("asgi.harmonize_cached")(_asgi_benchmark("harmonize", "/api/v1/harmonize"))
+benchmark("asgi.harmonize_uncached")(
+    _asgi_benchmark("harmonize", "/api/v1/harmonize", before=lambda main: main.harmonize_cache.clear()))
+benchmark("asgi.evaluate")(_asgi_benchmark("evaluate", "/api/v1/evaluate"))
+
+
+# Runner
+
+def time_callable(func: Callable, repeat: int, min_time: float) -> List[float]:
+    """Seconds per call for each repeat; loops per repeat are sized to last min_time"""
+    loops = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(loops):
+            func()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time / 4 or loops >= 1 << 20:
+            break
+        loops *= 2
+    loops = max(1, int(loops * min_time / max(elapsed, 1e-9)))
+
+    timings = []
+    after_repeat = getattr(func, "after_repeat", None)
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(loops):
+            func()
+        timings.append((time.perf_counter() - start) / loops)
+        if after_repeat is not None:
+            after_repeat()
+    return timings
+
+
+def run_suite(event_counts: List[int], durations: List[int], repeat: int, min_time: float,
+              name_filter: Optional[str] = None) -> Dict:
+    results = {}
+    for name, setup in BENCHMARKS.items():
+        if name_filter and name_filter not in name:
+            continue
+        for duration_sec in durations:
+            for event_count in event_counts:
+                if event_count > duration_sec * 1000:
+                    continue  # Not representable even on the 1 ms grid
+                key = f"{name}[events={event_count},duration={duration_sec}]"
+                func = setup(make_payload(event_count, duration_sec), duration_sec)
+                try:
+                    timings = time_callable(func, repeat, min_time)
+                finally:
+                    teardown = getattr(func, "teardown", None)
+                    if teardown is not None:
+                        teardown()
+                results[key] = {
+                    "median_us": round(statistics.median(timings) * 1e6, 3),
+                    "min_us": round(min(timings) * 1e6, 3),
+                    "repeat": repeat,
+                }
+                print(f"{key:70s} {results[key]['median_us']:12.1f} us", flush=True)
+    return {
+        "meta": {
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+            "platform": platform.platform(),
+        },
+        "results": results,
+    }
+
+
+def compare(baseline: Dict, current: Dict, threshold: float, name_filter: Optional[str] = None) -> bool:
+    """Print a comparison table; True when no benchmark regressed past threshold"""
+    ok = True
+    base_results, current_results = baseline["results"], current["results"]
+    for key in sorted(set(base_results) & set(current_results)):
+        before = base_results[key]["median_us"]
+        after = current_results[key]["median_us"]
+        change = after / before - 1 if before else 0.0
+        status = "ok"
+        if change > threshold:
+            status = "REGRESSION"
+            ok = False
+        elif change < -threshold:
+            status = "faster"
+        print(f"{key:70s} {before:12.1f} -> {after:12.1f} us {change:+8.1%}  {status}")
+    for key in sorted(set(base_results) - set(current_results)):
+        if name_filter and name_filter not in key:
+            continue
+        print(f"{key:70s} missing from current run")
+    return ok
+
+
+def _int_list(value: str) -> List[int]:
+    return [int(item) for item in value.split(",") if item]
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", type=_int_list, default=[10, 60, 600], help="Event counts (comma separated)")
+    parser.add_argument("--durations", type=_int_list, default=[10, 60], help="Durations in seconds (comma separated)")
+    parser.add_argument("--repeat", type=int, default=5, help="Timed repeats per benchmark")
+    parser.add_argument("--min-time", type=float, default=0.05, help="Seconds per repeat")
+    parser.add_argument("--filter", help="Only run benchmarks whose name contains this")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="Run the suite")
+    run_parser.add_argument("--output", help="Save results as a JSON baseline")
+
+    compare_parser = subparsers.add_parser("compare", help="Compare against a baseline")
+    compare_parser.add_argument("baseline", help="Baseline JSON file")
+    compare_parser.add_argument("--current", help="Compare this results file instead of running the suite")
+    compare_parser.add_argument("--threshold", type=float, default=0.25,
+                                help="Allowed slowdown of the median, as a fraction (0.25 = 25%%)")
+    compare_parser.add_argument("--output", help="Also save the current results")
+
+    args = parser.parse_args(argv)
+    logging.disable(logging.INFO)
+
+    if args.command == "compare" and args.current:
+        with open(args.current, "r", encoding="utf-8") as f:
+            current = json.load(f)
+    else:
+        current = run_suite(args.events, args.durations, args.repeat, args.min_time, args.filter)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(current, f, indent=2)
+        print(f"Saved results to {args.output}")
+
+    if args.command == "compare":
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        if not compare(baseline, current, args.threshold, args.filter):
+            print(f"Benchmarks regressed by more than {args.threshold:.0%}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,180 @@
+"""
+Content-addressed blob store for URL return mode
+
+Generated MIDI files are stored once under their SHA-256 and served by
+GET /api/v1/midi/{blob_id}. Because a blob id names immutable content,
+responses can be cached forever by clients and proxies, and downloads
+never re-run the generator.
+
+The directory is bounded by the same retention policy as midi_output
+(max files, max bytes, max age; see midi_storage.RetentionIndex). Storing
+a blob again refreshes its age, so URLs still being handed out are the
+last to go; an evicted blob's URL answers 404.
+"""
+import hashlib
+import os
+import re
+import threading
+import time
+import uuid
+from typing import Optional, Tuple
+
+import anyio
+from starlette.responses import Response
+from starlette.types import Receive, Scope, Send
+
+from midi_storage import RetentionIndex
+
+_BLOB_ID = re.compile(r"^[0-9a-f]{64}$")
+_RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+# Marker for a Range header that cannot be satisfied (416)
+UNSATISFIABLE = (-1, -1)
+
+
+class BlobStore:
+    """Write-once MIDI file store laid out as <root>/<id[:2]>/<id>.mid"""
+
+    def __init__(self, root_dir: str = "midi_blobs", max_files: int = 0, max_bytes: int = 0,
+                 max_age_sec: float = 0):
+        """max_files / max_bytes / max_age_sec: Retention limits, 0 disables a limit"""
+        self.root_dir = root_dir
+        self._retention = RetentionIndex(max_files, max_bytes, max_age_sec)
+        self._lock = threading.Lock()
+        self._loaded = False
+
+    @staticmethod
+    def is_valid_id(blob_id: str) -> bool:
+        return bool(_BLOB_ID.match(blob_id))
+
+    def path_for(self, blob_id: str) -> str:
+        if not self.is_valid_id(blob_id):
+            raise ValueError("Invalid blob id")
+        return os.path.join(self.root_dir, blob_id[:2], f"{blob_id}.mid")
+
+    def put(self, data: bytes, blob_id: Optional[str] = None) -> str:
+        """
+        Store data if it is not on disk (anymore) and return its blob id
+        Pass blob_id when the data's id is already known to skip hashing
+        """
+        if blob_id is None:
+            blob_id = hashlib.sha256(data).hexdigest()
+        path = self.path_for(blob_id)
+
+        with self._lock:
+            self._load_index()
+            if os.path.exists(path):
+                os.utime(path)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                # Write to a private temp name so readers never see partial files
+                tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+                with open(tmp_path, "wb") as f:
+                    f.write(data)
+                os.replace(tmp_path, path)
+            self._retention.add(path, len(data), time.time())
+            self._retention.apply()
+        return blob_id
+
+    def _load_index(self):
+        """Index the blobs of earlier runs on first use"""
+        if self._loaded:
+            return
+        os.makedirs(self.root_dir, exist_ok=True)
+        with os.scandir(self.root_dir) as it:
+            shards = [entry.path for entry in it if entry.is_dir()]
+        self._retention.load(shards)
+        self._loaded = True
+
+
+def parse_range(range_header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    Parse a single-range "Range: bytes=..." header
+
+    Returns:
+        None to serve the whole file, UNSATISFIABLE for a 416, or (start, end) inclusive
+    """
+    if not range_header:
+        return None
+    match = _RANGE.match(range_header.strip())
+    if match is None:
+        # Multiple or malformed ranges: serving the full body is always allowed
+        return None
+
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0:
+            return UNSATISFIABLE
+        return max(0, size - length), size - 1
+
+    start = int(first)
+    end = int(last) if last else size - 1
+    if start >= size or end < start:
+        return UNSATISFIABLE
+    return start, min(end, size - 1)
+
+
+class RangeFileResponse(Response):
+    """
+    Sends `count` bytes of a file starting at `offset`
+
+    Uses the ASGI zero-copy extension (sendfile) when the server offers it,
+    otherwise streams the range in fixed-size chunks.
+    """
+
+    chunk_size = 64 * 1024
+
+    def __init__(self, path: str, offset: int, count: int, status_code: int = 200,
+                 headers: Optional[dict] = None, media_type: str = "audio/midi",
+                 method: Optional[str] = None):
+        self.path = path
+        self.offset = offset
+        self.count = count
+        self.status_code = status_code
+        self.media_type = media_type
+        self.background = None
+        self.send_header_only = method is not None and method.upper() == "HEAD"
+        self.init_headers(headers)
+        self.headers["content-length"] = str(count)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await send({
+            "type": "http.response.start",
+            "status": self.status_code,
+            "headers": self.raw_headers,
+        })
+        if self.send_header_only or self.count == 0:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+
+        if "http.response.zerocopy" in scope.get("extensions", {}):
+            with open(self.path, "rb") as file:
+                await send({
+                    "type": "http.response.zerocopy",
+                    "file": file,
+                    "offset": self.offset,
+                    "count": self.count,
+                    "more_body": False,
+                })
+            return
+
+        async with await anyio.open_file(self.path, mode="rb") as file:
+            await file.seek(self.offset)
+            remaining = self.count
+            while remaining > 0:
+                chunk = await file.read(min(self.chunk_size, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                await send({
+                    "type": "http.response.body",
+                    "body": chunk,
+                    "more_body": remaining > 0,
+                })
+            if remaining > 0:
+                # File shrank underneath us; close the body cleanly
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
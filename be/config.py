@@ -0,0 +1,110 @@
+"""
+Runtime configuration
+
+All settings come from environment variables so the same code can run
+under `python run.py`, uvicorn workers or the benchmark tools.
+"""
+import os
+
+
+def _env_str(name: str, default: str) -> str:
+    return os.environ.get(name, default)
+
+
+def _env_int(name: str, default: int) -> int:
+    value = os.environ.get(name)
+    return int(value) if value not in (None, "") else default
+
+
+def _env_float(name: str, default: float) -> float:
+    value = os.environ.get(name)
+    return float(value) if value not in (None, "") else default
+
+
+def _env_bool(name: str, default: bool) -> bool:
+    value = os.environ.get(name)
+    if value in (None, ""):
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+# MIDI encoder used by MidiGenerator: "direct" (byte writer) or "mido"
+MIDI_ENCODER = _env_str("HARMONY_MIDI_ENCODER", "direct")
+
+# Background persistence of generated files (0 disables a retention limit)
+MIDI_OUTPUT_ENABLED = _env_bool("HARMONY_MIDI_OUTPUT_ENABLED", True)
+MIDI_OUTPUT_DIR = _env_str("HARMONY_MIDI_OUTPUT_DIR", "midi_output")
+MIDI_OUTPUT_QUEUE_SIZE = _env_int("HARMONY_MIDI_OUTPUT_QUEUE_SIZE", 256)
+MIDI_OUTPUT_BATCH_SIZE = _env_int("HARMONY_MIDI_OUTPUT_BATCH_SIZE", 32)
+MIDI_OUTPUT_FSYNC = _env_bool("HARMONY_MIDI_OUTPUT_FSYNC", True)
+MIDI_OUTPUT_MAX_FILES = _env_int("HARMONY_MIDI_OUTPUT_MAX_FILES", 1000)
+MIDI_OUTPUT_MAX_BYTES = _env_int("HARMONY_MIDI_OUTPUT_MAX_BYTES", 100 * 1024 * 1024)
+MIDI_OUTPUT_MAX_AGE_SEC = _env_float("HARMONY_MIDI_OUTPUT_MAX_AGE_SEC", 7 * 24 * 3600)
+
+# Practice history: evaluation results recorded to SQLite by a batched
+# background writer (results beyond the queue are dropped and logged)
+HISTORY_ENABLED = _env_bool("HARMONY_HISTORY_ENABLED", True)
+HISTORY_DB = _env_str("HARMONY_HISTORY_DB", "practice_history.sqlite3")
+HISTORY_QUEUE_SIZE = _env_int("HARMONY_HISTORY_QUEUE_SIZE", 4096)
+HISTORY_BATCH_SIZE = _env_int("HARMONY_HISTORY_BATCH_SIZE", 256)
+
+# Compression of JSON responses (evaluate, harmonize URL mode) when the
+# client's Accept-Encoding allows it: bodies below COMPRESS_MIN_BYTES are
+# sent as they are; brotli needs the optional brotli package
+COMPRESS_MIN_BYTES = _env_int("HARMONY_COMPRESS_MIN_BYTES", 1024)
+GZIP_LEVEL = _env_int("HARMONY_GZIP_LEVEL", 6)
+BROTLI_QUALITY = _env_int("HARMONY_BROTLI_QUALITY", 4)
+
+# Harmonize result cache budget in bytes (0 disables caching)
+HARMONIZE_CACHE_MAX_BYTES = _env_int("HARMONY_CACHE_MAX_BYTES", 32 * 1024 * 1024)
+
+# Batch harmonize: process pool size (0 = single background thread),
+# jobs per pool task and maximum items per request
+BATCH_WORKERS = _env_int("HARMONY_BATCH_WORKERS", os.cpu_count() or 1)
+BATCH_CHUNK_SIZE = _env_int("HARMONY_BATCH_CHUNK_SIZE", 16)
+BATCH_MAX_ITEMS = _env_int("HARMONY_BATCH_MAX_ITEMS", 5000)
+
+# Evaluation from uploaded MIDI files: largest file and most note-ons read
+UPLOAD_MAX_BYTES = _env_int("HARMONY_UPLOAD_MAX_BYTES", 8 * 1024 * 1024)
+UPLOAD_MAX_NOTES = _env_int("HARMONY_UPLOAD_MAX_NOTES", 100000)
+
+# Executor for generation and scoring: "thread", "process" or "inline"
+# (on the event loop). Calls beyond OFFLOAD_WORKERS wait in a queue of
+# OFFLOAD_QUEUE_SIZE; a full queue is answered with 429, a wait longer
+# than OFFLOAD_QUEUE_TIMEOUT_SEC with 503
+OFFLOAD_POOL = _env_str("HARMONY_OFFLOAD_POOL", "thread")
+OFFLOAD_WORKERS = _env_int("HARMONY_OFFLOAD_WORKERS", os.cpu_count() or 1)
+OFFLOAD_QUEUE_SIZE = _env_int("HARMONY_OFFLOAD_QUEUE_SIZE", 64)
+OFFLOAD_QUEUE_TIMEOUT_SEC = _env_float("HARMONY_OFFLOAD_QUEUE_TIMEOUT_SEC", 5.0)
+
+# Token for admin endpoints (X-Admin-Token header); empty disables them
+ADMIN_TOKEN = _env_str("HARMONY_ADMIN_TOKEN", "")
+
+# Audio rendering (return_mode "wav"): sample rate and samples per streamed block
+AUDIO_SAMPLE_RATE = _env_int("HARMONY_AUDIO_SAMPLE_RATE", 22050)
+AUDIO_BLOCK_SAMPLES = _env_int("HARMONY_AUDIO_BLOCK_SAMPLES", 8192)
+
+# Content-addressed store backing URL return mode, with the same kind of
+# retention limits as midi_output (0 disables a limit)
+BLOB_DIR = _env_str("HARMONY_BLOB_DIR", "midi_blobs")
+BLOB_MAX_FILES = _env_int("HARMONY_BLOB_MAX_FILES", 10000)
+BLOB_MAX_BYTES = _env_int("HARMONY_BLOB_MAX_BYTES", 256 * 1024 * 1024)
+BLOB_MAX_AGE_SEC = _env_float("HARMONY_BLOB_MAX_AGE_SEC", 7 * 24 * 3600)
+
+# Exercise files compiled into the reference index, and how often (seconds)
+# the directory is checked for changes (0 disables hot reload)
+REFERENCE_DIR = _env_str(
+    "HARMONY_REFERENCE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "references")
+)
+REFERENCE_RELOAD_SEC = _env_float("HARMONY_REFERENCE_RELOAD_SEC", 2.0)
+
+# Aligned evaluation: half-width of the alignment band, in notes
+ALIGN_BAND = _env_int("HARMONY_ALIGN_BAND", 32)
+
+# Streaming harmonize: most events per request and bytes per response chunk
+STREAM_MAX_EVENTS = _env_int("HARMONY_STREAM_MAX_EVENTS", 100000)
+STREAM_CHUNK_BYTES = _env_int("HARMONY_STREAM_CHUNK_BYTES", 64 * 1024)
+
+# Per-endpoint and per-stage latency metrics served on /metrics
+METRICS_ENABLED = _env_bool("HARMONY_METRICS_ENABLED", True)
@@ -0,0 +1,206 @@
+"""
+Key-aware harmonization
+
+Each melody note gets one diatonic triad of the request's key, voiced in
+close position below the melody. The chord sequence is chosen by a
+Viterbi pass over (chord, inversion) states:
+
+    cost = sum of   fit(melody note, state)          chord tone or not, voicing under the melody
+                  + move(previous state, state)      root progression + voice-leading distance
+           plus a tonic preference on the first and last chord
+
+Everything that depends only on the key (states, voicings, the k x k
+transition table and one k x k step table per melody note) is built once
+per key and memoized, so a request costs O(n * k^2) with k = 21 states,
+done as a few NumPy operations per note.
+
+Live accompaniment cannot wait for the rest of the melody: LiveHarmonizer
+commits to each chord as its note arrives, taking the cheapest move from
+the chord already played (no end cost). Those choices are memoized per
+(previous state, note), so a live note costs one dict lookup.
+"""
+from functools import lru_cache
+from typing import Dict, List, NamedTuple, Sequence, Tuple
+
+import numpy as np
+
+from models import KeyEnum
+
+PITCH_NAMES = ('C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B')
+
+MAJOR_SCALE = (0, 2, 4, 5, 7, 9, 11)
+NATURAL_MINOR_SCALE = (0, 2, 3, 5, 7, 8, 10)
+
+# Key -> (tonic pitch class, scale)
+KEY_SCALES = {
+    KeyEnum.C_MAJOR: (0, MAJOR_SCALE),
+    KeyEnum.A_MINOR: (9, NATURAL_MINOR_SCALE),
+}
+
+QUALITY_NAMES = {(4, 7): 'Major', (3, 7): 'Minor', (3, 6): 'Diminished'}
+
+# Voicings keep their lowest note in C3..B3, under the C4..B4 melody
+BASS_LOW = 48
+
+# Fit costs
+NON_CHORD_TONE_COST = 4.0
+CHORD_TONE_COST = (0.0, 0.3, 0.5)   # Melody on the root, third or fifth
+DIMINISHED_COST = 1.5
+INVERSION_COST = (0.0, 0.2, 0.6)    # Root position, first, second inversion
+CROSSING_COST = 2.0                 # Top voice at or above the melody note
+# Per scale degree of the chord root: tonic, dominant and subdominant are preferred
+DEGREE_COST = (0.0, 0.4, 0.8, 0.2, 0.2, 0.4, 0.4)
+
+# Move costs, by root motion in scale steps (0 = same chord, 3 = up a fourth, ...)
+ROOT_MOTION_COST = (0.4, 0.3, 0.7, 0.0, 0.5, 0.4, 0.8)
+VOICE_MOTION_COST = 0.1             # Per semitone, summed over the three voices
+NON_TONIC_START_COST = 1.0
+NON_TONIC_END_COST = 1.0
+
+
+class Chord(NamedTuple):
+    """One harmonized chord: its root pitch, display name and voicing"""
+    root_note: int
+    name: str
+    notes: Tuple[int, ...]
+
+
+def note_name(note: int) -> str:
+    return PITCH_NAMES[note % 12]
+
+
+@lru_cache(maxsize=1024)
+def note_names(notes: Tuple[int, ...]) -> Tuple[str, ...]:
+    """Names of a voicing's notes, shared by every chord with that voicing"""
+    return tuple(note_name(note) for note in notes)
+
+
+class ChordTable:
+    """Candidate states and cost tables for one key"""
+
+    def __init__(self, key: KeyEnum):
+        tonic, scale = KEY_SCALES[key]
+        self.key = key
+
+        chords: List[Chord] = []
+        degrees: List[int] = []
+        inversions: List[int] = []
+        pitch_classes: List[Tuple[int, int, int]] = []
+        for degree in range(7):
+            # Stack diatonic thirds on the degree
+            root, third, fifth = ((tonic + scale[(degree + step) % 7]) % 12 for step in (0, 2, 4))
+            quality = QUALITY_NAMES[((third - root) % 12, (fifth - root) % 12)]
+            for inversion in range(3):
+                order = (root, third, fifth)[inversion:] + (root, third, fifth)[:inversion]
+                voicing = [BASS_LOW + (order[0] - BASS_LOW) % 12]
+                for pc in order[1:]:
+                    voicing.append(voicing[-1] + (pc - voicing[-1]) % 12)
+                root_note = voicing[(3 - inversion) % 3]
+                chords.append(Chord(root_note, f'{PITCH_NAMES[root]} {quality}', tuple(sorted(voicing))))
+                degrees.append(degree)
+                inversions.append(inversion)
+                pitch_classes.append((root, third, fifth))
+
+        self.chords = chords
+        size = len(chords)
+        degree = np.array(degrees)
+        voicings = np.array([chord.notes for chord in chords])
+
+        motion = ROOT_MOTION_COST
+        root_motion = np.array([[motion[(b - a) % 7] for b in degrees] for a in degrees])
+        voice_motion = np.abs(voicings[:, None, :] - voicings[None, :, :]).sum(axis=2) * VOICE_MOTION_COST
+        self.move = root_motion + voice_motion                               # (from, to)
+
+        base = np.array([DEGREE_COST[d] + INVERSION_COST[i] for d, i in zip(degrees, inversions)])
+        base += np.array([DIMINISHED_COST if c.name.endswith('Diminished') else 0.0 for c in chords])
+        self.fit = np.empty((128, size))                                     # (melody note, state)
+        for note in range(128):
+            pc = note % 12
+            tone = np.array([
+                CHORD_TONE_COST[pcs.index(pc)] if pc in pcs else NON_CHORD_TONE_COST
+                for pcs in pitch_classes
+            ])
+            crossing = np.where(voicings[:, -1] >= note, CROSSING_COST, 0.0)
+            self.fit[note] = base + tone + crossing
+
+        self.start = np.where(degree == 0, 0.0, NON_TONIC_START_COST)
+        self.end = np.where(degree == 0, 0.0, NON_TONIC_END_COST)
+        self._steps: Dict[int, np.ndarray] = {}
+        self._next: Dict[Tuple[int, int], int] = {}
+
+    def step(self, note: int) -> np.ndarray:
+        """move + fit of the next melody note, as one (to, from) table"""
+        table = self._steps.get(note)
+        if table is None:
+            # Rows are reduced over; keeping them contiguous makes argmin cheaper
+            table = self._steps[note] = np.ascontiguousarray((self.move + self.fit[note]).T)
+        return table
+
+    def next_state(self, state: int, note: int) -> int:
+        """Cheapest state for the next melody note after state (-1 = first note)"""
+        best = self._next.get((state, note))
+        if best is None:
+            costs = (self.start if state < 0 else self.move[state]) + self.fit[note]
+            best = self._next[(state, note)] = int(costs.argmin())
+        return best
+
+
+@lru_cache(maxsize=None)
+def chord_table(key: KeyEnum) -> ChordTable:
+    return ChordTable(key)
+
+
+def harmonize(notes: Sequence[int], key: KeyEnum = KeyEnum.C_MAJOR) -> List[Chord]:
+    """
+    Cheapest chord sequence for a melody
+
+    Args:
+        notes: Melody MIDI notes in onset order
+        key: Key whose diatonic triads are used
+
+    Returns:
+        List[Chord]: One chord per melody note
+    """
+    if not notes:
+        return []
+    table = chord_table(key)
+    size = len(table.chords)
+    row_offsets = np.arange(size) * size
+    step = table.step
+    add = np.add
+
+    # total[to, from] = score[from] + move[from, to] + fit[note, to]
+    score = table.start + table.fit[notes[0]]
+    back = np.empty((len(notes), size), dtype=np.int8)
+    total = np.empty((size, size))
+    flat_total = total.reshape(-1)
+    for i in range(1, len(notes)):
+        add(step(notes[i]), score, out=total)
+        best = total.argmin(axis=1)
+        back[i] = best
+        score = flat_total[row_offsets + best]
+    score = score + table.end
+
+    state = int(score.argmin())
+    path = [state] * len(notes)
+    back_rows = back.tolist()
+    for i in range(len(notes) - 1, 0, -1):
+        state = back_rows[i][state]
+        path[i - 1] = state
+    chords = table.chords
+    return [chords[state] for state in path]
+
+
+class LiveHarmonizer:
+    """Chords chosen one melody note at a time; a chosen chord is never revised"""
+
+    __slots__ = ("table", "state")
+
+    def __init__(self, key: KeyEnum = KeyEnum.C_MAJOR):
+        self.table = chord_table(key)
+        self.state = -1
+
+    def add(self, note: int) -> Chord:
+        """Chord for the next melody note"""
+        self.state = self.table.next_state(self.state, note)
+        return self.table.chords[self.state]
@@ -0,0 +1,110 @@
+"""
+Interval index for polyphonic evaluation
+
+Notes are [start, end) intervals in milliseconds with a pitch. IntervalIndex
+keeps them sorted by start, plus one sorted start list per pitch, so the
+notes starting within a tolerance window of a time (of any pitch, or of one
+pitch) are found with two bisections instead of a scan.
+
+match_notes() pairs a played take with a reference through the index:
+1. Each played note's same-pitch reference notes within the window are
+   candidates; pairs are taken closest onset first, every note at most
+   once (correct notes).
+2. The notes left over are paired the same way with reference notes of any
+   pitch in the window (wrong notes).
+3. Unpaired reference notes are missing, unpaired played notes extra.
+A played note only looks at the reference notes inside its window, so the
+work is O(n log m + c log c) for c candidate pairs: near-linear for dense
+chords, where comparing every played note with every reference note would
+be quadratic.
+"""
+from bisect import bisect_left, bisect_right
+from typing import Dict, List, Sequence, Tuple
+
+from alignment import DELETE, INSERT, MATCH, SUBSTITUTE, AlignmentStep
+
+
+class IntervalIndex:
+    """Notes as [start, end) intervals (ms) sorted by start, with a per-pitch start index"""
+
+    __slots__ = ("starts", "ends", "pitches", "_by_pitch")
+
+    def __init__(self, starts: Sequence[int], ends: Sequence[int], pitches: Sequence[int]):
+        """Columns must already be sorted by start; end == start marks an unknown length"""
+        self.starts = starts
+        self.ends = ends
+        self.pitches = pitches
+        # pitch -> (starts, indices into the columns), both ascending
+        by_pitch: Dict[int, Tuple[List[int], List[int]]] = {}
+        for i, (start, pitch) in enumerate(zip(starts, pitches)):
+            entry = by_pitch.get(pitch)
+            if entry is None:
+                entry = by_pitch[pitch] = ([], [])
+            entry[0].append(start)
+            entry[1].append(i)
+        self._by_pitch = by_pitch
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def count_before(self, limit_ms: int) -> int:
+        """Number of notes starting before limit_ms (they are the first ones)"""
+        return bisect_left(self.starts, limit_ms)
+
+    def starting_within(self, time_ms: int, tolerance_ms: int) -> range:
+        """Indices of the notes starting within tolerance_ms of time_ms"""
+        return range(bisect_left(self.starts, time_ms - tolerance_ms),
+                     bisect_right(self.starts, time_ms + tolerance_ms))
+
+    def pitch_starting_within(self, pitch: int, time_ms: int, tolerance_ms: int) -> List[int]:
+        """Indices of the notes of one pitch starting within tolerance_ms of time_ms"""
+        entry = self._by_pitch.get(pitch)
+        if entry is None:
+            return []
+        starts, indices = entry
+        return indices[bisect_left(starts, time_ms - tolerance_ms):bisect_right(starts, time_ms + tolerance_ms)]
+
+
+def match_notes(reference: IntervalIndex, ref_count: int, perf_onsets: Sequence[int],
+                perf_notes: Sequence[int], tolerance_ms: int) -> List[AlignmentStep]:
+    """
+    Pair played notes with the first ref_count reference notes
+
+    Returns:
+        List[AlignmentStep]: (op, reference index, performance index) with the
+        alignment ops; MATCH and SUBSTITUTE pairs first, then DELETE, then INSERT
+    """
+    ref_starts = reference.starts
+    ref_used = bytearray(ref_count)
+    perf_used = bytearray(len(perf_onsets))
+    steps: List[AlignmentStep] = []
+
+    def take(candidates: List[Tuple[int, int, int]], op: str):
+        # Closest pairs first; ties go to the earlier notes
+        candidates.sort()
+        for _, i, j in candidates:
+            if not ref_used[i] and not perf_used[j]:
+                ref_used[i] = perf_used[j] = 1
+                steps.append((op, i, j))
+
+    candidates = []
+    for j, (onset, note) in enumerate(zip(perf_onsets, perf_notes)):
+        for i in reference.pitch_starting_within(note, onset, tolerance_ms):
+            if i >= ref_count:
+                break
+            candidates.append((abs(onset - ref_starts[i]), i, j))
+    take(candidates, MATCH)
+
+    candidates = []
+    for j, onset in enumerate(perf_onsets):
+        if perf_used[j]:
+            continue
+        window = reference.starting_within(onset, tolerance_ms)
+        for i in range(window.start, min(window.stop, ref_count)):
+            if not ref_used[i]:
+                candidates.append((abs(onset - ref_starts[i]), i, j))
+    take(candidates, SUBSTITUTE)
+
+    steps.extend((DELETE, i, None) for i in range(ref_count) if not ref_used[i])
+    steps.extend((INSERT, None, j) for j in range(len(perf_onsets)) if not perf_used[j])
+    return steps
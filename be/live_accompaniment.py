@@ -0,0 +1,93 @@
+"""
+Live accompaniment sessions
+
+A LiveAccompanimentSession harmonizes a melody while it is played: each
+note gets its chord back immediately, as the note-offs of the previous
+chord and the note-ons of the new one (channel 1, the harmony track of
+harmonize files). Diatonic chords come from harmony_engine.LiveHarmonizer,
+which commits to each chord instead of waiting for the whole melody, so
+a live take can differ from /api/v1/harmonize on the same notes; the
+major_triad mode gives the same chords. A note costs a validation, a dict
+lookup and one small message, so a worker holds many sessions at once.
+"""
+from functools import lru_cache
+from typing import Dict, Optional, Tuple, Union
+
+import harmony_engine
+from harmony_engine import Chord
+from midi_utils import MidiGenerator
+from models import QUANTIZE_MS, HarmonyModeEnum, KeyEnum, MusicEvent, QuantizeEnum
+
+# Status bytes of the harmony channel (channel 1)
+NOTE_OFF = 0x81
+NOTE_ON = 0x91
+
+# A JSON chord message, or raw MIDI bytes
+ChordMessage = Union[Dict, bytes]
+
+
+@lru_cache(maxsize=1024)
+def _midi_off(notes: Tuple[int, ...]) -> bytes:
+    return b''.join(bytes((NOTE_OFF, note, 0)) for note in notes)
+
+
+@lru_cache(maxsize=1024)
+def _midi_on(notes: Tuple[int, ...], velocity: int) -> bytes:
+    return b''.join(bytes((NOTE_ON, note, velocity)) for note in notes)
+
+
+class LiveAccompanimentSession:
+    """Chord state for one live take"""
+
+    def __init__(self, generator: MidiGenerator, key: KeyEnum = KeyEnum.C_MAJOR,
+                 harmony_mode: HarmonyModeEnum = HarmonyModeEnum.DIATONIC,
+                 quantize: QuantizeEnum = QuantizeEnum.ONE_SECOND, midi: bool = False):
+        if harmony_mode == HarmonyModeEnum.DIATONIC:
+            self.next_chord = harmony_engine.LiveHarmonizer(key).add
+        else:
+            self.next_chord = generator.major_triad
+        self.velocity = generator.harmony_velocity
+        self.grid_ms = QUANTIZE_MS[quantize]
+        self.midi = midi  # Raw MIDI bytes instead of JSON messages
+
+        self.chord: Optional[Chord] = None
+        self.last_slot = -1
+        self.chord_count = 0
+
+    def add_note(self, event: MusicEvent) -> ChordMessage:
+        """
+        Chord for one melody note
+
+        Raises:
+            ValueError: "Duplicate timeslot" if the note's quantize slot was already played,
+                "Out of order" if it lies before the previous note's
+        """
+        onset_ms = event.onset_ms
+        slot = onset_ms // self.grid_ms
+        if slot <= self.last_slot:
+            raise ValueError("Duplicate timeslot" if slot == self.last_slot else "Out of order")
+        self.last_slot = slot
+
+        previous = self.chord.notes if self.chord is not None else ()
+        chord = self.chord = self.next_chord(event.note)
+        self.chord_count += 1
+
+        if self.midi:
+            return _midi_off(previous) + _midi_on(chord.notes, self.velocity)
+        return {
+            "type": "chord",
+            "t_ms": onset_ms,
+            "chord": chord.name,
+            "root_note": chord.root_note,
+            "off": previous,
+            "on": chord.notes,
+            "vel": self.velocity
+        }
+
+    def finish(self) -> ChordMessage:
+        """Note-offs for the chord still sounding"""
+        notes = self.chord.notes if self.chord is not None else ()
+        self.chord = None
+        if self.midi:
+            return _midi_off(notes)
+        return {"type": "end", "off": notes, "chords": self.chord_count}
@@ -0,0 +1,96 @@
+"""
+Incremental evaluation for live sessions
+
+A LiveEvaluationSession receives notes one at a time while the student
+plays. Each note costs a dict lookup plus a bisect over the compiled
+reference times and yields an immediate verdict with running subscores.
+The final result is produced by MusicEvaluator.evaluate_performance over
+the collected notes, so it is identical to the regular /api/v1/evaluate
+response for the same take.
+"""
+from typing import Dict, List
+
+from midi_utils import MusicEvaluator
+from models import MusicEvent
+
+
+class LiveEvaluationSession:
+    """Running score state for one live take"""
+
+    def __init__(self, evaluator: MusicEvaluator, reference_id: str, duration_sec: int):
+        # Raises ValueError("Reference not found") before the session starts
+        self.reference = evaluator.reference_templates.get_compiled_reference(reference_id)
+        self.evaluator = evaluator
+        self.reference_id = reference_id
+        self.duration_sec = duration_sec
+
+        self.events: List[MusicEvent] = []
+        self.played_slots = set()
+        self.correct = 0
+        self.wrong = 0
+        self.extra = 0
+        self.latest_sec = -1
+
+    def add_note(self, event: MusicEvent) -> Dict:
+        """
+        Score one note
+
+        Raises:
+            ValueError: "Duplicate timeslot" if the second was already played
+        """
+        sec = event.t_sec
+        if sec in self.played_slots:
+            raise ValueError("Duplicate timeslot")
+        self.played_slots.add(sec)
+        self.events.append(event)
+
+        expected_note = None
+        if sec >= self.duration_sec:
+            # Outside the take; evaluate_performance ignores it as well
+            verdict = "ignored"
+        else:
+            expected_note = self.reference.template.get(sec)
+            if expected_note is None:
+                verdict = "extra"
+                self.extra += 1
+            elif expected_note == event.note:
+                verdict = "correct"
+                self.correct += 1
+            else:
+                verdict = "wrong"
+                self.wrong += 1
+            self.latest_sec = max(self.latest_sec, sec)
+
+        return {
+            "type": "verdict",
+            "t_sec": sec,
+            "note": event.note,
+            "expected_note": expected_note,
+            "verdict": verdict,
+            **self.running_scores()
+        }
+
+    def running_scores(self) -> Dict:
+        """Scores over the reference notes due up to the latest played second; always floats"""
+        due = self.reference.count_before(self.latest_sec + 1)
+        missing = due - self.correct - self.wrong
+
+        accuracy_score = (self.correct / due) * 100 if due else 100.0
+        timing_score = max(0.0, 100.0 - (missing + self.extra) * 10)
+        return {
+            "score": round(accuracy_score * 0.7 + timing_score * 0.3, 1),
+            "subscores": {
+                "accuracy": round(accuracy_score, 1),
+                "timing": round(timing_score, 1)
+            }
+        }
+
+    def finish(self) -> Dict:
+        """Final result, same shape and values as /api/v1/evaluate"""
+        if not self.events:
+            raise ValueError("Empty sequence")
+        return self.evaluator.evaluate_performance(
+            events=self.events,
+            reference_id=self.reference_id,
+            duration_sec=self.duration_sec
+        )
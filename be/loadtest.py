@@ -0,0 +1,377 @@
+"""
+Load generator replaying the Flutter client's traffic
+
+Usage:
+    python loadtest.py [--requests 2000] [--concurrency 16] [--mix harmonize=0.5,evaluate=0.5]
+                       [--events 1-10] [--error-rate 0.05] [--url http://127.0.0.1:8000] [--output report.json]
+
+Each virtual client sends the payloads ApiService builds (10-second takes,
+one {t_sec, note, vel} per second, default settings) back to back, with the
+client's 10 s timeout. --error-rate makes that share of requests invalid in
+one of the ways a client can get wrong (duplicate second, black key, empty
+take, old version, unknown reference); the report lists the codes each
+kind got back, and counts an injected error as unexpected only if it was
+accepted or failed on the server side.
+
+Without --url the requests go straight through the ASGI app in this
+process (no server, no sockets); with --url they go to a running server
+over HTTP/1.1, a new connection per request like the client unless
+--keep-alive is given. The report is JSON: throughput, p50/p95/p99 latency
+overall and per endpoint, status and error-code counts.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import random
+import sys
+import time
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+from bench import REFERENCE_ID, WHITE_KEYS, asgi_request
+
+ENDPOINTS = {
+    "harmonize": "/api/v1/harmonize",
+    "evaluate": "/api/v1/evaluate",
+}
+# Kinds of invalid requests, named by the error code they are meant to
+# trigger; reference_not_found only applies to evaluate
+ERROR_CASES = ("duplicate_timeslot", "invalid_note", "empty_sequence", "unsupported_version", "reference_not_found")
+BLACK_KEYS = [61, 63, 66, 68, 70]
+CLIENT_TIMEOUT_SEC = 10.0
+CLIENT_DURATION_SEC = 10
+
+
+def make_request(rng: random.Random, mode: str, event_range: Tuple[int, int],
+                 error_case: Optional[str] = None) -> Dict:
+    """A request body shaped like ApiService's, broken as error_case says"""
+    count = rng.randint(*event_range)
+    seconds = sorted(rng.sample(range(CLIENT_DURATION_SEC), min(count, CLIENT_DURATION_SEC)))
+    events = [{"t_sec": sec, "note": rng.choice(WHITE_KEYS), "vel": 96} for sec in seconds]
+    body = {
+        "version": "1.0",
+        "mode": mode,
+        "duration_sec": CLIENT_DURATION_SEC,
+        "quantize": "1s",
+        "octave_base": "C4",
+        "key": "C major",
+    }
+    if mode == "harmonize":
+        body["return_mode"] = "bytes"
+    else:
+        body["reference_id"] = REFERENCE_ID
+    body["events"] = events
+
+    if error_case == "duplicate_timeslot":
+        events.append(dict(events[-1], note=rng.choice(WHITE_KEYS)))
+    elif error_case == "invalid_note":
+        rng.choice(events)["note"] = rng.choice(BLACK_KEYS)
+    elif error_case == "empty_sequence":
+        body["events"] = []
+    elif error_case == "unsupported_version":
+        body["version"] = "0.9"
+    elif error_case == "reference_not_found":
+        body["reference_id"] = "missing_reference"
+    return body
+
+
+def _parse_event_range(value: str) -> Tuple[int, int]:
+    low, _, high = value.partition("-")
+    low, high = int(low), int(high or low)
+    if not 1 <= low <= high:
+        raise argparse.ArgumentTypeError("expected N or LOW-HIGH with 1 <= LOW <= HIGH")
+    return low, high
+
+
+def _parse_mix(value: str) -> Dict[str, float]:
+    mix = {}
+    for item in value.split(","):
+        name, _, weight = item.partition("=")
+        if name not in ENDPOINTS:
+            raise argparse.ArgumentTypeError(f"unknown endpoint {name!r} (choose from {', '.join(ENDPOINTS)})")
+        mix[name] = float(weight or 1)
+    if not any(mix.values()):
+        raise argparse.ArgumentTypeError("all weights are zero")
+    return mix
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    """Nearest-rank percentile of an ascending list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, min(len(sorted_values), round(fraction * len(sorted_values) + 0.5)))
+    return sorted_values[rank - 1]
+
+
+def latency_summary(latencies: List[float]) -> Dict:
+    values = sorted(latencies)
+    ms = lambda seconds: round(seconds * 1000, 2)
+    return {
+        "count": len(values),
+        "mean_ms": ms(sum(values) / len(values)) if values else 0.0,
+        "p50_ms": ms(percentile(values, 0.50)),
+        "p95_ms": ms(percentile(values, 0.95)),
+        "p99_ms": ms(percentile(values, 0.99)),
+        "max_ms": ms(values[-1]) if values else 0.0,
+    }
+
+
+# Transports: send(path, body) -> (status, response body)
+
+class InProcessTransport:
+    """Requests through the ASGI app imported into this process"""
+
+    def __init__(self):
+        # Same side-effect free defaults as bench.py; set them in the environment to override
+        os.environ.setdefault("HARMONY_MIDI_OUTPUT_ENABLED", "false")
+        os.environ.setdefault("HARMONY_HISTORY_ENABLED", "false")
+        os.environ.setdefault("HARMONY_REFERENCE_RELOAD_SEC", "0")
+        import main
+        self.app = main.app
+        self.target = "in-process"
+
+    async def send(self, path: str, body: bytes) -> Tuple[int, bytes]:
+        return await asgi_request(self.app, "POST", path, body, [(b"content-type", b"application/json")])
+
+    async def close(self):
+        pass
+
+
+class HttpTransport:
+    """Minimal HTTP/1.1 client over asyncio streams (only the standard library is needed)"""
+
+    def __init__(self, url: str, keep_alive: bool):
+        parts = urlsplit(url)
+        if parts.scheme != "http":
+            raise ValueError("Only http:// URLs are supported")
+        self.host = parts.hostname or "127.0.0.1"
+        self.port = parts.port or 80
+        self.prefix = parts.path.rstrip("/")
+        self.keep_alive = keep_alive
+        self.target = url
+        # Idle keep-alive connections; each virtual client takes one at a time
+        self._idle: List[Tuple[asyncio.StreamReader, asyncio.StreamWriter]] = []
+
+    async def send(self, path: str, body: bytes) -> Tuple[int, bytes]:
+        if self._idle:
+            reader, writer = self._idle.pop()
+        else:
+            reader, writer = await asyncio.open_connection(self.host, self.port)
+        reusable = False
+        try:
+            writer.write(
+                f"POST {self.prefix}{path} HTTP/1.1\r\n"
+                f"Host: {self.host}:{self.port}\r\n"
+                "Content-Type: application/json\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                f"Connection: {'keep-alive' if self.keep_alive else 'close'}\r\n\r\n".encode() + body
+            )
+            await writer.drain()
+            status, headers, response = await self._read_response(reader)
+            reusable = self.keep_alive and headers.get("connection", "").lower() != "close"
+            return status, response
+        finally:
+            if reusable:
+                self._idle.append((reader, writer))
+            else:
+                writer.close()
+
+    @staticmethod
+    async def _read_response(reader: asyncio.StreamReader) -> Tuple[int, Dict[str, str], bytes]:
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionError("connection closed before the response")
+        status = int(status_line.split()[1])
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            chunks = []
+            while True:
+                size = int((await reader.readline()).split(b";")[0], 16)
+                if size == 0:
+                    await reader.readline()
+                    break
+                chunks.append(await reader.readexactly(size))
+                await reader.readexactly(2)
+            return status, headers, b"".join(chunks)
+        if "content-length" in headers:
+            return status, headers, await reader.readexactly(int(headers["content-length"]))
+        headers["connection"] = "close"
+        return status, headers, await reader.read()
+
+    async def close(self):
+        for _, writer in self._idle:
+            writer.close()
+        self._idle.clear()
+
+
+# Runner
+
+class LoadResults:
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.statuses: Counter = Counter()
+        self.error_codes: Counter = Counter()
+        # Injected error -> codes it was answered with
+        self.injected: Dict[str, Counter] = defaultdict(Counter)
+        # Valid requests that failed, invalid ones that were accepted or broke the server
+        self.unexpected: Counter = Counter()
+
+    def add(self, endpoint: str, latency: float, status: Optional[int], error_code: Optional[str],
+            expected: Optional[str]):
+        self.latencies[endpoint].append(latency)
+        self.statuses[str(status) if status is not None else "none"] += 1
+        if error_code is not None:
+            self.error_codes[error_code] += 1
+        if expected is None:
+            if error_code is not None:
+                self.unexpected[f"ok -> {error_code}"] += 1
+            return
+        self.injected[expected][error_code or "ok"] += 1
+        if status is None or status < 400 or status >= 500:
+            self.unexpected[f"{expected} -> {error_code or 'ok'}"] += 1
+
+
+def _error_code(status: int, response: bytes) -> Optional[str]:
+    if status == 200:
+        return None
+    try:
+        return json.loads(response).get("error_code") or f"http_{status}"
+    except (ValueError, AttributeError):
+        return f"http_{status}"
+
+
+async def run_load(transport, total: int, concurrency: int, mix: Dict[str, float], event_range: Tuple[int, int],
+                   error_rate: float, timeout: float, seed: int, deadline: Optional[float] = None) -> Tuple[LoadResults, float]:
+    """Send `total` requests (or until `deadline`) from `concurrency` virtual clients"""
+    rng = random.Random(seed)
+    endpoints = list(mix)
+    weights = [mix[name] for name in endpoints]
+    results = LoadResults()
+    issued = 0
+
+    def next_request() -> Optional[Tuple[str, bytes, Optional[str]]]:
+        # Bodies are built by the clients as they go, from one seeded generator
+        nonlocal issued
+        if issued >= total or (deadline is not None and time.perf_counter() >= deadline):
+            return None
+        issued += 1
+        endpoint = rng.choices(endpoints, weights)[0]
+        error_case = None
+        if rng.random() < error_rate:
+            cases = ERROR_CASES if endpoint == "evaluate" else ERROR_CASES[:-1]
+            error_case = rng.choice(cases)
+        body = json.dumps(make_request(rng, endpoint, event_range, error_case)).encode()
+        return endpoint, body, error_case
+
+    async def client():
+        while True:
+            request = next_request()
+            if request is None:
+                return
+            endpoint, body, expected = request
+            status = None
+            start = time.perf_counter()
+            try:
+                status, response = await asyncio.wait_for(transport.send(ENDPOINTS[endpoint], body), timeout)
+                error_code = _error_code(status, response)
+            except asyncio.TimeoutError:
+                error_code = "timeout"
+            except (OSError, ConnectionError, asyncio.IncompleteReadError, ValueError):
+                error_code = "network_error"
+            results.add(endpoint, time.perf_counter() - start, status, error_code, expected)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return results, time.perf_counter() - start
+
+
+def build_report(results: LoadResults, elapsed: float, args: argparse.Namespace, target: str) -> Dict:
+    all_latencies = [latency for latencies in results.latencies.values() for latency in latencies]
+    count = len(all_latencies)
+    return {
+        "meta": {
+            "target": target,
+            "concurrency": args.concurrency,
+            "mix": args.mix,
+            "events": list(args.events),
+            "error_rate": args.error_rate,
+            "timeout_sec": args.timeout,
+            "keep_alive": args.keep_alive,
+            "seed": args.seed,
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+        },
+        "requests": count,
+        "elapsed_sec": round(elapsed, 3),
+        "throughput_rps": round(count / elapsed, 1) if elapsed else 0.0,
+        "latency": latency_summary(all_latencies),
+        "endpoints": {name: latency_summary(latencies) for name, latencies in sorted(results.latencies.items())},
+        "status_codes": dict(sorted(results.statuses.items())),
+        "error_codes": dict(results.error_codes.most_common()),
+        "injected_errors": {case: dict(codes.most_common()) for case, codes in sorted(results.injected.items())},
+        "unexpected": dict(results.unexpected.most_common()),
+    }
+
+
+async def _main_async(args: argparse.Namespace) -> Dict:
+    transport = HttpTransport(args.url, args.keep_alive) if args.url else InProcessTransport()
+    try:
+        if args.warmup:
+            await run_load(transport, args.warmup, args.concurrency, args.mix, args.events, 0.0,
+                           args.timeout, args.seed + 1)
+        deadline = time.perf_counter() + args.duration if args.duration else None
+        total = args.requests if args.requests else sys.maxsize
+        results, elapsed = await run_load(transport, total, args.concurrency, args.mix, args.events,
+                                          args.error_rate, args.timeout, args.seed, deadline)
+    finally:
+        await transport.close()
+    return build_report(results, elapsed, args, transport.target)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="Server base URL (default: drive the app in this process)")
+    parser.add_argument("--requests", type=int, default=2000, help="Requests to send (0 = until --duration ends)")
+    parser.add_argument("--duration", type=float, default=0, help="Stop after this many seconds (0 = no limit)")
+    parser.add_argument("--concurrency", type=int, default=16, help="Virtual clients sending at once")
+    parser.add_argument("--mix", type=_parse_mix, default={"harmonize": 0.5, "evaluate": 0.5},
+                        help="Endpoint weights, e.g. harmonize=0.7,evaluate=0.3")
+    parser.add_argument("--events", type=_parse_event_range, default=(1, 10),
+                        help="Events per request, N or LOW-HIGH (at most one per second of the 10 s take)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of deliberately invalid requests (0-1)")
+    parser.add_argument("--timeout", type=float, default=CLIENT_TIMEOUT_SEC, help="Per-request timeout in seconds")
+    parser.add_argument("--keep-alive", action="store_true", help="Reuse connections (--url only)")
+    parser.add_argument("--warmup", type=int, default=0, help="Valid requests sent first and left out of the report")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the request mix and payloads")
+    parser.add_argument("--output", help="Write the JSON report here instead of stdout")
+    args = parser.parse_args(argv)
+    if not args.requests and not args.duration:
+        parser.error("--requests 0 needs --duration")
+    if not 0 <= args.error_rate <= 1:
+        parser.error("--error-rate must be between 0 and 1")
+    logging.disable(logging.INFO)
+
+    report = asyncio.run(_main_async(args))
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+        print(f"Saved report to {args.output}")
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,34 +1,108 @@
-from fastapi import FastAPI, HTTPException, Response
-from fastapi.responses import JSONResponse
+from fastapi import Depends, FastAPI, File, Form, HTTPException, Query, Request, Response, UploadFile, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from pydantic import ValidationError
+import hmac
+import json
 import logging
-from typing import Union
+import os
+from contextlib import asynccontextmanager
+from typing import Dict, Optional, Union
 
 from models import (
-    HarmonizeRequest, EvaluateRequest, EvaluateResponse, 
-    ErrorResponse, ModeEnum
+    HarmonizeRequest, HarmonizeBatchRequest, HarmonizeStreamRequest, EvaluateRequest, EvaluateResponse, 
+    EvaluateBatchRequest, EvaluateBatchResponse, ErrorResponse, ModeEnum, BatchFormatEnum,
+    LiveEvaluateStart, LiveHarmonizeStart, AccompanimentFormatEnum, MusicEvent, EvaluationModeEnum, HarmonizeSettings, HarmonizeStreamSettings,
+    EvaluateSettings, ChordFormatEnum, HarmonizeUrlResponse, CompactHarmonizeUrlResponse, LongMusicEvent, MAX_DURATION_MS, MAX_STREAM_ONSET_MS, ReturnModeEnum, MidiTimeBaseEnum, ProfileRequest,
+    check_user_id
 )
 from midi_utils import MidiGenerator, MusicEvaluator
+from note_sequence import NoteSequence
+from midi_storage import MidiStorage
+from practice_history import ALL_USERS, PracticeHistory
+from reference_index import ReferenceIndex
+from live_evaluation import LiveEvaluationSession
+from live_accompaniment import LiveAccompanimentSession
+from result_cache import HarmonizeCache, etag_matches
+from blob_store import UNSATISFIABLE, BlobStore, RangeFileResponse, parse_range
+from batch import BatchRunner, item_error, ndjson_stream, zip_stream
+import packed_events
+import response_bundle
+import response_encoding
+import smf_reader
+import audio_render
+import metrics
+import offload
+import profiler
+import config
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Initialize services
+midi_storage = MidiStorage(
+    output_dir=config.MIDI_OUTPUT_DIR,
+    enabled=config.MIDI_OUTPUT_ENABLED,
+    queue_size=config.MIDI_OUTPUT_QUEUE_SIZE,
+    batch_size=config.MIDI_OUTPUT_BATCH_SIZE,
+    fsync=config.MIDI_OUTPUT_FSYNC,
+    max_files=config.MIDI_OUTPUT_MAX_FILES,
+    max_bytes=config.MIDI_OUTPUT_MAX_BYTES,
+    max_age_sec=config.MIDI_OUTPUT_MAX_AGE_SEC
+)
+practice_history = PracticeHistory(
+    path=config.HISTORY_DB,
+    enabled=config.HISTORY_ENABLED,
+    queue_size=config.HISTORY_QUEUE_SIZE,
+    batch_size=config.HISTORY_BATCH_SIZE
+)
+midi_generator = MidiGenerator(encoder=config.MIDI_ENCODER, storage=midi_storage)
+reference_index = ReferenceIndex(config.REFERENCE_DIR, reload_interval=config.REFERENCE_RELOAD_SEC)
+music_evaluator = MusicEvaluator(reference_index=reference_index)
+harmonize_cache = HarmonizeCache(max_bytes=config.HARMONIZE_CACHE_MAX_BYTES)
+blob_store = BlobStore(
+    root_dir=config.BLOB_DIR,
+    max_files=config.BLOB_MAX_FILES,
+    max_bytes=config.BLOB_MAX_BYTES,
+    max_age_sec=config.BLOB_MAX_AGE_SEC
+)
+batch_runner = BatchRunner(workers=config.BATCH_WORKERS, chunk_size=config.BATCH_CHUNK_SIZE)
+work_pool = offload.WorkPool(
+    kind=config.OFFLOAD_POOL,
+    workers=config.OFFLOAD_WORKERS,
+    queue_size=config.OFFLOAD_QUEUE_SIZE,
+    queue_timeout=config.OFFLOAD_QUEUE_TIMEOUT_SEC
+)
+offload.bind(midi_generator, music_evaluator)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    reference_index.start_watching()
+    yield
+    reference_index.stop_watching()
+    # Write out queued MIDI files before the worker exits
+    midi_storage.close()
+    practice_history.close()
+    batch_runner.close()
+    work_pool.close()
+
+
 app = FastAPI(
     title="Music Harmony API",
     description="FastAPI backend for Flutter + Python music demo",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
-
-# Initialize services
-midi_generator = MidiGenerator()
-music_evaluator = MusicEvaluator()
+# Record request parsing/validation time as a stage of every endpoint
+app.router.route_class = metrics.TimedRoute
+app.add_middleware(metrics.MetricsMiddleware)
+app.add_middleware(profiler.ProfilerMiddleware)
 
 
-@app.exception_handler(ValidationError)
-async def validation_exception_handler(request, exc):
-    """Handle Pydantic validation errors"""
-    error_details = exc.errors()[0] if exc.errors() else {}
+def validation_error_code(error_details: Dict) -> str:
+    """Map a single Pydantic error entry to an API error code"""
     error_msg = error_details.get('msg', 'Validation error')
     
     # Map to a specific error code
@@ -37,6 +111,8 @@ async def validation_exception_handler(request, exc):
         error_code = "unsupported_version"
     elif "Invalid mode" in error_msg:
         error_code = "invalid_mode"
+    elif "Invalid user_id" in error_msg:
+        error_code = "invalid_user_id"
     elif "duration_sec" in str(error_details):
         error_code = "invalid_duration"
     elif "quantize" in str(error_details):
@@ -48,35 +124,69 @@ async def validation_exception_handler(request, exc):
     elif "Note must be one of" in error_msg:
         error_code = "invalid_note"
     
+    return error_code
+
+
+@app.exception_handler(ValidationError)
+async def validation_exception_handler(request, exc):
+    """Handle Pydantic validation errors"""
+    error_details = exc.errors()[0] if exc.errors() else {}
+    error_msg = error_details.get('msg', 'Validation error')
+    error_code = validation_error_code(error_details)
+    metrics.count_error(error_code, request.scope)
+    
     return JSONResponse(
         status_code=400,
         content=ErrorResponse(
             error_code=error_code,
             message=error_msg,
-            details={"validation_errors": exc.errors()}
+            # ctx can hold the raised exception object, which is not JSON serializable
+            details={"validation_errors": exc.errors(include_context=False)}
         ).model_dump()
     )
 
 
-@app.exception_handler(ValueError)
-async def value_error_handler(request, exc):
-    """Handle ValueError instances"""
-    error_msg = str(exc)
+def value_error_code(error_msg: str) -> str:
+    """Map a ValueError message to an API error code"""
     error_code = "validation_error"
     
     if "Reference not found" in error_msg:
         error_code = "reference_not_found"
+    elif "Batch too large" in error_msg:
+        error_code = "batch_too_large"
+    elif "Too many events" in error_msg:
+        error_code = "too_many_events"
+    elif "Invalid MIDI file" in error_msg:
+        error_code = "invalid_midi"
+    elif "MIDI file too large" in error_msg:
+        error_code = "file_too_large"
     elif "Unsupported version" in error_msg:
         error_code = "unsupported_version"
     elif "Invalid mode" in error_msg:
         error_code = "invalid_mode"
+    elif "Invalid user_id" in error_msg:
+        error_code = "invalid_user_id"
     elif "Empty sequence" in error_msg:
         error_code = "empty_sequence"
     elif "Duplicate timeslot" in error_msg:
         error_code = "duplicate_timeslot"
+    elif "Out of order" in error_msg:
+        error_code = "out_of_order"
+    elif "Invalid message" in error_msg:
+        error_code = "invalid_message"
     elif "invalid_note" in error_msg.lower():
         error_code = "invalid_note"
     
+    return error_code
+
+
+@app.exception_handler(ValueError)
+async def value_error_handler(request, exc):
+    """Handle ValueError instances"""
+    error_msg = str(exc)
+    error_code = value_error_code(error_msg)
+    metrics.count_error(error_code, request.scope)
+    
     return JSONResponse(
         status_code=400,
         content=ErrorResponse(
@@ -86,10 +196,58 @@ async def value_error_handler(request, exc):
     )
 
 
-@app.post("/api/v1/harmonize")
-async def harmonize(request: HarmonizeRequest):
+@app.exception_handler(offload.Overloaded)
+async def overloaded_handler(request, exc):
+    """Admission control rejections (429 queue full, 503 queue timeout)"""
+    metrics.count_error(exc.error_code, request.scope)
+    
+    return JSONResponse(
+        status_code=exc.status_code,
+        content=ErrorResponse(
+            error_code=exc.error_code,
+            message=str(exc)
+        ).model_dump(),
+        headers={"Retry-After": str(exc.retry_after)}
+    )
+
+
+async def read_packed_request(http_request: Request, request_cls, settings_cls, **kwargs):
+    """Decode a packed-events body (see packed_events.py) into a request model"""
+    content_type = http_request.headers.get("content-type", "").split(";")[0].strip()
+    if content_type != packed_events.CONTENT_TYPE:
+        raise HTTPException(status_code=415, detail=f"Content-Type must be {packed_events.CONTENT_TYPE}")
+    body = await http_request.body()
+    request = await run_in_threadpool(packed_events.decode, body, request_cls, settings_cls, **kwargs)
+    metrics.validation_done()
+    return request
+
+
+def read_midi_request(stream, settings_json: str, time_base: MidiTimeBaseEnum) -> EvaluateRequest:
+    """Build an EvaluateRequest from JSON settings and the note-ons of an uploaded MIDI file"""
+    try:
+        header = json.loads(settings_json)
+    except ValueError:
+        raise ValueError("Invalid settings: not JSON")
+    settings = EvaluateSettings.model_validate(header)
+    # Held lengths are only graded in polyphonic evaluation
+    polyphonic = settings.evaluation_mode == EvaluationModeEnum.POLYPHONIC
+    notes = smf_reader.read_notes(stream, max_notes=config.UPLOAD_MAX_NOTES, max_bytes=config.UPLOAD_MAX_BYTES,
+                                  durations=polyphonic)
+    durations = notes.durations_ms(time_base.value).clip(0, MAX_DURATION_MS) if polyphonic else None
+    return packed_events.build_request(
+        EvaluateRequest, settings, notes.onsets_ms(time_base.value), notes.notes, notes.velocities,
+        durations=durations
+    )
+
+
+@app.post("/api/v1/harmonize", responses={200: {
+    "model": Union[HarmonizeUrlResponse, CompactHarmonizeUrlResponse],
+    "description": "MIDI file (bytes), bundle, WAV, or in URL mode the download link and chord information"
+}})
+async def harmonize(request: HarmonizeRequest, http_request: Request):
     """
     Generate a harmonized MIDI file
+    Identical requests are served from the result cache; If-None-Match is honored
     """
     try:
         logger.info(f"Processing harmonize request with {len(request.events)} events")
@@ -98,43 +256,296 @@ async def harmonize(request: HarmonizeRequest):
         if request.mode != ModeEnum.HARMONIZE:
             raise ValueError("Invalid mode")
         
-    # Generate the MIDI data and harmony information
-        midi_bytes, chord_names_info = midi_generator.create_harmonized_midi(
-            events=request.events,
-            duration_sec=request.duration_sec
-        )
+        if request.return_mode == ReturnModeEnum.WAV:
+            return await harmonize_audio(request)
         
-        logger.info(f"Generated MIDI file with {len(midi_bytes)} bytes")
-        logger.info(f"Generated chords: {[chord['chord_name'] for chord in chord_names_info]}")
+    # Sort the notes once; the cache key and the generator share them
+        notes = NoteSequence.from_events(request.events)
+        
+    # Look up the result cache before generating
+        cache_key = harmonize_cache.make_key(request, notes)
+        entry = harmonize_cache.get(cache_key)
+        if entry is None:
+            # Generate the MIDI data and harmony information
+            midi_bytes, chord_names_info = await work_pool.run(
+                offload.harmonize_task, notes, request.duration_sec, request.key, request.harmony_mode
+            )
+            if work_pool.isolated:
+                # Pool processes do not share the storage writer; keep the local copy here
+                midi_storage.submit(midi_bytes, "harmony_output.mid")
+            entry = harmonize_cache.put(cache_key, midi_bytes, chord_names_info)
+            cache_status = "MISS"
+            
+            logger.info(f"Generated MIDI file with {len(midi_bytes)} bytes")
+            logger.info(f"Generated chords: {[chord['chord_name'] for chord in chord_names_info]}")
+        else:
+            cache_status = "HIT"
+            logger.info(f"Serving cached MIDI file with {len(entry.midi_bytes)} bytes")
+        
+        midi_bytes, chord_names_info = entry.midi_bytes, entry.chord_names_info
+        cache_headers = {"ETag": entry.etag, "X-Cache": cache_status}
+        compact = request.chord_format == ChordFormatEnum.COMPACT
+        
+        not_modified = etag_matches(http_request.headers.get("if-none-match"), entry.etag)
+        if not_modified and request.return_mode != ReturnModeEnum.URL:
+            return Response(status_code=304, headers=cache_headers)
         
     # Return the result based on the requested mode
-        if request.return_mode == "bytes":
+        if request.return_mode == ReturnModeEnum.BYTES:
             return Response(
                 content=midi_bytes,
                 media_type="application/octet-stream",
                 headers={
                     "Content-Disposition": "attachment; filename=harmony.mid",
-                    "X-Chord-Info": str(chord_names_info)  # Pass chord info via header
+                    **cache_headers
                 }
             )
+        elif request.return_mode == ReturnModeEnum.BUNDLE:
+            # MIDI and chord information in one body
+            return Response(
+                content=response_bundle.encode(midi_bytes, chord_names_info, compact),
+                media_type=response_bundle.CONTENT_TYPE,
+                headers=cache_headers
+            )
         else:
-            # URL mode - return JSON including chord information
-            return JSONResponse(content={
-                "url": "https://example.com/generated/harmony.mid",
-                "message": "URL mode not fully implemented in demo",
-                "chord_names": [chord['chord_name'] for chord in chord_names_info],
-                "chord_details": chord_names_info
-            })
+            # URL mode - store the file once and return a download link with chord information
+            # Rewrites the blob if it was evicted or deleted since it was first stored
+            # (also on a 304: the URL the client revalidates must still resolve)
+            entry.blob_id = await run_in_threadpool(blob_store.put, midi_bytes, entry.blob_id)
+            content = {
+                "url": str(http_request.url_for("get_midi_blob", blob_id=entry.blob_id)),
+                **response_bundle.chord_info(chord_names_info, compact)
+            }
+            if not_modified:
+                # Same Vary and ETag form as the 200 being revalidated
+                return response_encoding.not_modified(content, http_request, headers=cache_headers)
+            return response_encoding.json_response(content, http_request, headers=cache_headers)
             
+    except offload.Overloaded:
+        raise
     except Exception as e:
         logger.error(f"Error in harmonize endpoint: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
+async def harmonize_audio(request: HarmonizeRequest) -> StreamingResponse:
+    """Render the harmonized notes to WAV, streamed block by block"""
+    spans = await work_pool.run(
+        offload.note_spans_task, NoteSequence.from_events(request.events), request.duration_sec,
+        request.key, request.harmony_mode
+    )
+    size, chunks = audio_render.render_wav(
+        spans,
+        {0: midi_generator.melody_program, 1: midi_generator.harmony_program},
+        midi_generator.ticks_per_beat,
+        request.duration_sec,
+        sample_rate=config.AUDIO_SAMPLE_RATE,
+        block_samples=config.AUDIO_BLOCK_SAMPLES
+    )
+    return StreamingResponse(
+        chunks,
+        media_type=audio_render.MEDIA_TYPE,
+        headers={
+            "Content-Disposition": "attachment; filename=harmony.wav",
+            "Content-Length": str(size)
+        }
+    )
+
+
+@app.post("/api/v1/harmonize/packed")
+@metrics.inline_validation
+async def harmonize_packed(http_request: Request):
+    """Harmonize with the events sent as packed columns instead of JSON"""
+    request = await read_packed_request(http_request, HarmonizeRequest, HarmonizeSettings)
+    return await harmonize(request, http_request)
+
+
+@app.get("/api/v1/harmonize/cache")
+async def get_harmonize_cache_stats():
+    """Result cache counters (hits, misses, evictions, size)"""
+    return harmonize_cache.stats()
+
+
+@app.get("/api/v1/offload")
+async def get_offload_stats():
+    """Offload pool counters (running, queued, rejections, wait times)"""
+    return work_pool.stats()
+
+
+def check_admin(http_request: Request):
+    """
+    Admin endpoints need X-Admin-Token; without HARMONY_ADMIN_TOKEN they do not exist
+    Attached as a route dependency, so it runs before the body is validated
+    """
+    if not config.ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    token = http_request.headers.get("x-admin-token", "")
+    if not hmac.compare_digest(token.encode(), config.ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+
+@app.post("/api/v1/admin/profile", dependencies=[Depends(check_admin)])
+async def start_profile(request: ProfileRequest):
+    """
+    Profile the next harmonize/evaluate requests
+    Sampling runs for `requests` requests or `duration_sec` seconds, whichever ends first
+    """
+    try:
+        session = profiler.start(request.duration_sec, request.requests, request.interval_ms)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return session.status()
+
+
+@app.get("/api/v1/admin/profile", dependencies=[Depends(check_admin)])
+async def get_profile_status():
+    """State of the current or last profiling session"""
+    if profiler.session is None:
+        raise HTTPException(status_code=404, detail="No profiling session")
+    return profiler.session.status()
+
+
+@app.get("/api/v1/admin/profile/stacks", dependencies=[Depends(check_admin)])
+async def get_profile_stacks():
+    """Collapsed stacks of the current or last session, ready for flamegraph tools"""
+    if profiler.session is None:
+        raise HTTPException(status_code=404, detail="No profiling session")
+    return PlainTextResponse(profiler.session.collapsed())
+
+
+@app.delete("/api/v1/admin/profile", dependencies=[Depends(check_admin)])
+async def stop_profile():
+    """End the running session early; its stacks stay available"""
+    session = profiler.stop()
+    if session is None:
+        raise HTTPException(status_code=404, detail="No profiling session")
+    return session.status()
+
+
+@app.post("/api/v1/harmonize/stream")
+async def harmonize_stream(request: HarmonizeStreamRequest):
+    """
+    Generate a harmonized MIDI file for a long session (up to an hour)
+    The file is encoded while it is sent, so memory does not grow with its length
+    """
+    if len(request.events) > config.STREAM_MAX_EVENTS:
+        raise ValueError(f"Too many events: at most {config.STREAM_MAX_EVENTS} per stream")
+    
+    logger.info(f"Processing harmonize stream with {len(request.events)} events over {request.duration_sec}s")
+    
+    # The sizing pass walks every event once; keep it off the event loop
+    size, chunks = await run_in_threadpool(
+        midi_generator.stream_harmonized_midi,
+        request.events,
+        request.duration_sec,
+        config.STREAM_CHUNK_BYTES,
+        request.key,
+        request.harmony_mode
+    )
+    return StreamingResponse(
+        chunks,
+        media_type="application/octet-stream",
+        headers={
+            "Content-Disposition": "attachment; filename=harmony.mid",
+            "Content-Length": str(size)
+        }
+    )
+
+
+@app.post("/api/v1/harmonize/stream/packed")
+@metrics.inline_validation
+async def harmonize_stream_packed(http_request: Request):
+    """Streaming harmonize with the events sent as packed columns instead of JSON"""
+    request = await read_packed_request(
+        http_request, HarmonizeStreamRequest, HarmonizeStreamSettings,
+        event_cls=LongMusicEvent, max_onset_ms=MAX_STREAM_ONSET_MS
+    )
+    return await harmonize_stream(request)
+
+
+@app.post("/api/v1/harmonize/batch")
+async def harmonize_batch(request: HarmonizeBatchRequest):
+    """
+    Generate many harmonized MIDI files in one request
+    Invalid items are reported individually; the rest run on the batch process pool
+    """
+    if len(request.items) > config.BATCH_MAX_ITEMS:
+        raise ValueError(f"Batch too large: at most {config.BATCH_MAX_ITEMS} items")
+    
+    logger.info(f"Processing harmonize batch with {len(request.items)} items")
+    
+    # Validate every item up front so bad items never reach the pool
+    jobs, errors = [], []
+    for index, item in enumerate(request.items):
+        try:
+            item_request = HarmonizeRequest.model_validate(item)
+        except ValidationError as exc:
+            error_details = exc.errors()[0] if exc.errors() else {}
+            errors.append(item_error(
+                index,
+                validation_error_code(error_details),
+                error_details.get('msg', 'Validation error')
+            ))
+            continue
+        jobs.append((index, NoteSequence.from_events(item_request.events), item_request.duration_sec,
+                     item_request.key, item_request.harmony_mode))
+    
+    results = batch_runner.run(jobs)
+    if request.format == BatchFormatEnum.ZIP:
+        return StreamingResponse(
+            zip_stream(errors, results),
+            media_type="application/zip",
+            headers={"Content-Disposition": "attachment; filename=harmony_batch.zip"}
+        )
+    return StreamingResponse(ndjson_stream(errors, results), media_type="application/x-ndjson")
+
+
+@app.api_route("/api/v1/midi/{blob_id}", methods=["GET", "HEAD"], name="get_midi_blob")
+async def get_midi_blob(blob_id: str, http_request: Request):
+    """
+    Download a generated MIDI file (URL return mode)
+    Supports single byte ranges and long-lived caching of the immutable content
+    """
+    if not blob_store.is_valid_id(blob_id):
+        raise HTTPException(status_code=404, detail="MIDI file not found")
+    path = blob_store.path_for(blob_id)
+    try:
+        size = (await run_in_threadpool(os.stat, path)).st_size
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="MIDI file not found")
+    
+    etag = f'"{blob_id}"'
+    headers = {
+        "ETag": etag,
+        "Cache-Control": "public, max-age=31536000, immutable",
+        "Accept-Ranges": "bytes",
+        "Content-Disposition": "attachment; filename=harmony.mid"
+    }
+    if etag_matches(http_request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    
+    # A stale If-Range means the client must get the whole file again
+    if_range = http_request.headers.get("if-range")
+    byte_range = None
+    if if_range is None or if_range == etag:
+        byte_range = parse_range(http_request.headers.get("range"), size)
+    
+    if byte_range is None:
+        return RangeFileResponse(path, 0, size, headers=headers, method=http_request.method)
+    if byte_range == UNSATISFIABLE:
+        return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+    
+    start, end = byte_range
+    headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    return RangeFileResponse(path, start, end - start + 1, status_code=206,
+                             headers=headers, method=http_request.method)
+
+
 @app.post("/api/v1/evaluate", response_model=EvaluateResponse)
-async def evaluate(request: EvaluateRequest):
+async def evaluate(request: EvaluateRequest, http_request: Request):
     """
     Evaluate the recorded performance
+    The result is compressed when the client accepts it (response_encoding)
     """
     try:
         logger.info(f"Processing evaluate request with {len(request.events)} events")
@@ -144,24 +555,263 @@ async def evaluate(request: EvaluateRequest):
             raise ValueError("Invalid mode")
         
     # Run the evaluation
-        evaluation_result = music_evaluator.evaluate_performance(
-            events=request.events,
-            reference_id=request.reference_id,
-            duration_sec=request.duration_sec
-        )
+        if request.evaluation_mode == EvaluationModeEnum.POLYPHONIC:
+            evaluation_result = await work_pool.run(offload.evaluate_task, "evaluate_polyphonic", dict(
+                events=NoteSequence.from_events(request.events, durations=True),
+                reference_id=request.reference_id,
+                duration_sec=request.duration_sec,
+                tolerance_ms=request.timing_tolerance_ms
+            ))
+        elif request.evaluation_mode == EvaluationModeEnum.ALIGNED:
+            evaluation_result = await work_pool.run(offload.evaluate_task, "evaluate_aligned", dict(
+                events=NoteSequence.from_events(request.events),
+                reference_id=request.reference_id,
+                duration_sec=request.duration_sec,
+                tolerance_ms=request.timing_tolerance_ms,
+                band=config.ALIGN_BAND
+            ))
+        else:
+            evaluation_result = await work_pool.run(offload.evaluate_task, "evaluate_performance", dict(
+                events=NoteSequence.from_events(request.events),
+                reference_id=request.reference_id,
+                duration_sec=request.duration_sec
+            ))
         
         logger.info(f"Evaluation complete. Score: {evaluation_result['score']}")
+        practice_history.record(request.user_id, request.reference_id, request.evaluation_mode.value,
+                                request.duration_sec, evaluation_result)
         
-        return EvaluateResponse(**evaluation_result)
+        return response_encoding.json_response(EvaluateResponse(**evaluation_result).model_dump(), http_request)
         
-    except ValueError as e:
-    # This will be caught by value_error_handler
+    except (ValueError, offload.Overloaded) as e:
+    # This will be caught by value_error_handler / overloaded_handler
         raise e
     except Exception as e:
         logger.error(f"Error in evaluate endpoint: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/api/v1/evaluate/packed", response_model=EvaluateResponse)
+@metrics.inline_validation
+async def evaluate_packed(http_request: Request):
+    """Evaluate with the events sent as packed columns instead of JSON"""
+    request = await read_packed_request(http_request, EvaluateRequest, EvaluateSettings)
+    return await evaluate(request, http_request)
+
+
+@app.post("/api/v1/evaluate/midi", response_model=EvaluateResponse)
+@metrics.inline_validation
+async def evaluate_midi(
+    http_request: Request,
+    file: UploadFile = File(..., description="Recorded performance (.mid)"),
+    settings: str = Form(..., description="EvaluateRequest fields except events, as JSON"),
+    time_base: MidiTimeBaseEnum = Form(MidiTimeBaseEnum.BEATS, description="How ticks map to time")
+):
+    """
+    Evaluate an uploaded MIDI recording
+    Note-ons are read by the streaming SMF reader and validated like JSON events
+    """
+    request = await run_in_threadpool(read_midi_request, file.file, settings, time_base)
+    metrics.validation_done()
+    return await evaluate(request, http_request)
+
+
+@app.post("/api/v1/evaluate/batch", response_model=EvaluateBatchResponse)
+async def evaluate_batch(request: EvaluateBatchRequest, http_request: Request):
+    """
+    Evaluate many performances of the same reference template in one pass
+    """
+    try:
+        logger.info(f"Processing evaluate batch with {len(request.submissions)} submissions")
+        
+        results = await work_pool.run(offload.evaluate_task, "evaluate_batch", dict(
+            submissions=[NoteSequence.from_events(submission.events) for submission in request.submissions],
+            reference_id=request.reference_id,
+            duration_sec=request.duration_sec
+        ))
+        
+        logger.info(f"Batch evaluation complete for {len(results)} submissions")
+        for submission, result in zip(request.submissions, results):
+            practice_history.record(submission.user_id, request.reference_id, EvaluationModeEnum.SLOT.value,
+                                    request.duration_sec, result)
+        
+        response = EvaluateBatchResponse(results=[EvaluateResponse(**result) for result in results])
+        return response_encoding.json_response(response.model_dump(), http_request)
+        
+    except (ValueError, offload.Overloaded) as e:
+    # This will be caught by value_error_handler / overloaded_handler
+        raise e
+    except Exception as e:
+        logger.error(f"Error in evaluate batch endpoint: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+def _live_error(exc: ValueError) -> Dict:
+    """Error message for WebSocket sessions, using the HTTP error codes"""
+    if isinstance(exc, ValidationError):
+        error_details = exc.errors()[0] if exc.errors() else {}
+        return {
+            "type": "error",
+            "error_code": validation_error_code(error_details),
+            "message": error_details.get('msg', 'Validation error')
+        }
+    return {"type": "error", "error_code": value_error_code(str(exc)), "message": str(exc)}
+
+
+async def _receive_json(websocket: WebSocket):
+    """
+    Next WebSocket message, parsed as JSON
+
+    Raises:
+        ValueError: "Invalid message" for binary frames and malformed JSON
+    """
+    message = await websocket.receive()
+    if message["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(message.get("code", 1000), message.get("reason"))
+    text = message.get("text")
+    if text is None:
+        raise ValueError("Invalid message: expected a JSON text frame")
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        raise ValueError("Invalid message: malformed JSON")
+
+
+@app.websocket("/api/v1/evaluate/live")
+async def evaluate_live(websocket: WebSocket):
+    """
+    Live evaluation over WebSocket
+    1. Client sends the session settings (EvaluateRequest fields without events)
+    2. Client sends one {"t_sec", "note", "vel"} message per note; each gets a verdict
+    3. Client sends {"type": "end"}; the server replies with the final result and closes
+    """
+    await websocket.accept()
+    try:
+        try:
+            start = LiveEvaluateStart.model_validate(await _receive_json(websocket))
+            session = LiveEvaluationSession(music_evaluator, start.reference_id, start.duration_sec)
+        except ValueError as e:
+            await websocket.send_json(_live_error(e))
+            await websocket.close(code=1008)
+            return
+        
+        logger.info(f"Live evaluation started for {start.reference_id}")
+        await websocket.send_json({"type": "started", "reference_id": start.reference_id})
+        
+        while True:
+            try:
+                message = await _receive_json(websocket)
+                if isinstance(message, dict) and message.get("type") == "end":
+                    evaluation_result = session.finish()
+                    result = EvaluateResponse(**evaluation_result)
+                    practice_history.record(start.user_id, start.reference_id, EvaluationModeEnum.SLOT.value,
+                                            start.duration_sec, evaluation_result)
+                    break
+                verdict = session.add_note(MusicEvent.model_validate(message))
+            except ValueError as e:
+                # Bad notes are reported and skipped; the session keeps going
+                await websocket.send_json(_live_error(e))
+                continue
+            await websocket.send_json(verdict)
+        
+        logger.info(f"Live evaluation complete. Score: {result.score}")
+        await websocket.send_json({"type": "result", **result.model_dump()})
+        await websocket.close()
+    except WebSocketDisconnect:
+        logger.info("Live evaluation client disconnected")
+
+
+@app.websocket("/api/v1/harmonize/live")
+async def harmonize_live(websocket: WebSocket):
+    """
+    Live accompaniment over WebSocket
+    1. Client sends the session settings (HarmonizeRequest fields without events, plus format)
+    2. Client sends one {"t_sec"/"t_ms", "note", "vel"} message per melody note, in onset order;
+       each gets its chord back as note-offs and note-ons (JSON, or a binary frame of MIDI bytes)
+    3. Client sends {"type": "end"}; the server releases the last chord and closes
+    """
+    await websocket.accept()
+    try:
+        try:
+            start = LiveHarmonizeStart.model_validate(await _receive_json(websocket))
+        except ValueError as e:
+            await websocket.send_json(_live_error(e))
+            await websocket.close(code=1008)
+            return
+        midi = start.format == AccompanimentFormatEnum.MIDI
+        session = LiveAccompanimentSession(midi_generator, start.key, start.harmony_mode, start.quantize, midi=midi)
+        send = websocket.send_bytes if midi else websocket.send_json
+        
+        logger.info(f"Live accompaniment started ({start.harmony_mode.value}, {start.format.value})")
+        await websocket.send_json({"type": "started", "harmony_mode": start.harmony_mode.value})
+        
+        while True:
+            try:
+                message = await _receive_json(websocket)
+                if isinstance(message, dict) and message.get("type") == "end":
+                    break
+                chord = session.add_note(MusicEvent.model_validate(message))
+            except ValueError as e:
+                # Bad notes are reported and skipped; the session keeps going
+                await websocket.send_json(_live_error(e))
+                continue
+            await send(chord)
+        
+        logger.info(f"Live accompaniment complete: {session.chord_count} chords")
+        release = session.finish()
+        if release:
+            await send(release)
+        await websocket.close()
+    except WebSocketDisconnect:
+        logger.info("Live accompaniment client disconnected")
+
+
+def history_progress(reference_id: str, user_id: str, days: int, slots: int, recent: int) -> Dict:
+    if not practice_history.enabled:
+        raise HTTPException(status_code=404, detail="Practice history is disabled")
+    return practice_history.progress(reference_id, user_id, days=days, slots=slots, recent=recent)
+
+
+@app.get("/api/v1/history/users/{user_id}")
+async def get_user_history(user_id: str):
+    """Per-reference totals for one student, most recently practised first"""
+    check_user_id(user_id)
+    if not practice_history.enabled:
+        raise HTTPException(status_code=404, detail="Practice history is disabled")
+    references = await run_in_threadpool(practice_history.user_summary, user_id)
+    return {"user_id": user_id, "references": references}
+
+
+@app.get("/api/v1/history/users/{user_id}/references/{reference_id}")
+async def get_user_reference_history(
+    user_id: str,
+    reference_id: str,
+    days: int = Query(30, ge=1, le=3660, description="Days covered by the trend"),
+    slots: int = Query(5, ge=0, le=100, description="Most-missed time slots returned"),
+    recent: int = Query(10, ge=0, le=100, description="Latest takes returned")
+):
+    """One student's progress on a reference: totals, daily trend, most-missed slots, latest takes"""
+    check_user_id(user_id)
+    progress = await run_in_threadpool(history_progress, reference_id, user_id, days, slots, recent)
+    return {"user_id": user_id, **progress}
+
+
+@app.get("/api/v1/history/references/{reference_id}")
+async def get_reference_history(
+    reference_id: str,
+    days: int = Query(30, ge=1, le=3660, description="Days covered by the trend"),
+    slots: int = Query(5, ge=0, le=100, description="Most-missed time slots returned")
+):
+    """Progress on a reference over all students (anonymous takes included)"""
+    return await run_in_threadpool(history_progress, reference_id, ALL_USERS, days, slots, 0)
+
+
+@app.get("/api/v1/history")
+async def get_history_stats():
+    """Practice history writer counters (recorded, dropped, failed, queued)"""
+    return practice_history.stats()
+
+
 @app.get("/")
 async def root():
     """API health check"""
@@ -175,17 +825,21 @@ async def root():
     }
 
 
+@app.get("/metrics")
+async def get_metrics():
+    """Latency histograms and error counters in Prometheus text format"""
+    return Response(content=metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+
 @app.get("/api/v1/references")
-async def get_references():
+async def get_references(
+    offset: int = 0,
+    limit: Optional[int] = Query(None, ge=1, le=1000, description="Templates returned (all if omitted)")
+):
     """Retrieve the list of available reference templates"""
     return {
-        "references": [
-            {
-                "id": "exercise_c_major_01",
-                "name": "C Major Exercise 01",
-                "description": "Basic C major scale exercise"
-            }
-        ]
+        "total": len(reference_index),
+        "references": reference_index.listing(offset=max(0, offset), limit=limit)
     }
 
 
@@ -0,0 +1,282 @@
+"""
+In-process latency metrics in Prometheus text format
+
+Stage timers (`with stage("melody"):`) record into a histogram labelled by
+endpoint and stage. The endpoint is taken from the ASGI scope of the request
+being served: MetricsMiddleware puts the scope in a context variable, which
+also follows the request into threadpool calls. Code running outside a
+request (batch worker processes, scripts) records under endpoint="none".
+
+A timer costs two perf_counter() calls plus one locked bucket increment.
+Everything is rendered by GET /metrics for scraping.
+"""
+import inspect
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from functools import wraps
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from fastapi.routing import APIRoute
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+import config
+
+# Starlette appends "; charset=utf-8" to text/* media types
+CONTENT_TYPE = "text/plain; version=0.0.4"
+
+# Seconds; stages range from microseconds (lookups) to seconds (long streams)
+LATENCY_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+    0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+
+_current_scope: ContextVar[Optional[Scope]] = ContextVar("metrics_scope", default=None)
+
+enabled = config.METRICS_ENABLED
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic counter with labels"""
+
+    def __init__(self, name: str, documentation: str, label_names: Iterable[str]):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._values: Dict[Tuple[str, ...], int] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values: str, amount: int = 1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for label_values, value in items:
+            lines.append(f"{self.name}{_format_labels(self.label_names, label_values)} {value}")
+        return lines
+
+
+class Gauge:
+    """Value that can go up and down, with labels"""
+
+    def __init__(self, name: str, documentation: str, label_names: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def set(self, value: float, *label_values: str):
+        with self._lock:
+            self._values[label_values] = value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for label_values, value in items:
+            lines.append(f"{self.name}{_format_labels(self.label_names, label_values)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    """Fixed-bucket histogram with labels"""
+
+    def __init__(self, name: str, documentation: str, label_names: Iterable[str],
+                 buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        # labels -> [per-bucket counts (last one is +Inf), sum]
+        self._series: Dict[Tuple[str, ...], list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values: str):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((labels, (list(counts), total)) for labels, (counts, total) in self._series.items())
+        for label_values, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                labels = _format_labels(self.label_names, label_values, f'le="{le}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.label_names, label_values)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+REQUEST_DURATION = Histogram(
+    "harmony_request_duration_seconds", "Time to serve a request, by endpoint.", ("endpoint",))
+REQUESTS = Counter(
+    "harmony_requests_total", "Requests served, by endpoint and status code.", ("endpoint", "status"))
+STAGE_DURATION = Histogram(
+    "harmony_stage_duration_seconds", "Time spent in a processing stage, by endpoint.", ("endpoint", "stage"))
+ERRORS = Counter(
+    "harmony_errors_total", "Error responses, by endpoint and API error code.", ("endpoint", "error_code"))
+OFFLOAD_QUEUE_DEPTH = Gauge(
+    "harmony_offload_queue_depth", "Calls waiting for a free offload worker.")
+OFFLOAD_RUNNING = Gauge(
+    "harmony_offload_running", "Calls running on offload workers.")
+OFFLOAD_WAIT = Histogram(
+    "harmony_offload_wait_seconds", "Time a call waited for a free offload worker, by endpoint.", ("endpoint",))
+OFFLOAD_REJECTED = Counter(
+    "harmony_offload_rejected_total", "Calls rejected by admission control, by endpoint and reason.",
+    ("endpoint", "reason"))
+
+_REGISTRY = (
+    REQUEST_DURATION, REQUESTS, STAGE_DURATION, ERRORS,
+    OFFLOAD_QUEUE_DEPTH, OFFLOAD_RUNNING, OFFLOAD_WAIT, OFFLOAD_REJECTED,
+)
+
+
+def endpoint_name(scope: Optional[Scope] = None) -> str:
+    """Name of the endpoint handling the current request"""
+    if scope is None:
+        scope = _current_scope.get()
+        if scope is None:
+            return "none"
+    endpoint = scope.get("endpoint")
+    return getattr(endpoint, "__name__", "unmatched")
+
+
+class stage:
+    """Context manager timing one processing stage of the current request"""
+
+    __slots__ = ("name", "_start")
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if enabled:
+            STAGE_DURATION.observe(time.perf_counter() - self._start, endpoint_name(), self.name)
+        return False
+
+
+def timed(stage_name: str):
+    """Decorator form of stage() for a whole function"""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(stage_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def count_error(error_code: str, scope: Optional[Scope] = None):
+    if enabled:
+        ERRORS.inc(endpoint_name(scope), error_code)
+
+
+def render() -> str:
+    lines = []
+    for metric in _REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording request latency and status per endpoint"""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not enabled:
+            await self.app(scope, receive, send)
+            return
+
+        scope["metrics.start"] = start = time.perf_counter()
+        token = _current_scope.set(scope)
+        status = 500
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current_scope.reset(token)
+            endpoint = endpoint_name(scope)
+            REQUEST_DURATION.observe(time.perf_counter() - start, endpoint)
+            REQUESTS.inc(endpoint, str(status))
+
+
+def inline_validation(endpoint):
+    """Mark an endpoint that reads and validates its own body; it calls validation_done() when finished"""
+    endpoint.inline_validation = True
+    return endpoint
+
+
+def validation_done():
+    """Record the time since the request arrived as "validation" (inline_validation endpoints)"""
+    scope = _current_scope.get()
+    if enabled and scope is not None and "metrics.start" in scope:
+        STAGE_DURATION.observe(time.perf_counter() - scope["metrics.start"], endpoint_name(scope), "validation")
+
+
+def _record_validation(endpoint):
+    """Wrap an endpoint so the time before it runs is recorded as "validation"."""
+    @wraps(endpoint)
+    async def wrapper(*args, **kwargs):
+        scope = _current_scope.get()
+        if enabled and scope is not None and "metrics.start" in scope:
+            STAGE_DURATION.observe(time.perf_counter() - scope["metrics.start"], endpoint.__name__, "validation")
+        return await endpoint(*args, **kwargs)
+    return wrapper
+
+
+class TimedRoute(APIRoute):
+    """
+    APIRoute that records request parsing and validation as a stage
+
+    FastAPI reads and validates the body before calling the endpoint, so the
+    time from the request's arrival until the endpoint starts is that stage.
+    Endpoints that decode their own body (packed events, MIDI uploads) are
+    marked with inline_validation and record it once decoding is done.
+    """
+
+    def __init__(self, path: str, endpoint, **kwargs):
+        if inspect.iscoroutinefunction(endpoint) and not getattr(endpoint, "inline_validation", False):
+            endpoint = _record_validation(endpoint)
+        super().__init__(path, endpoint, **kwargs)
@@ -0,0 +1,260 @@
+"""
+Background persistence of generated MIDI files
+
+Request handlers hand the already-encoded MIDI bytes to MidiStorage.submit(),
+which only enqueues them. A single writer thread drains the bounded queue in
+batches, fsyncs the whole batch at once and then applies the retention
+policy (max files, max bytes, max age) to the output directory.
+RetentionIndex holds that policy; the URL-mode blob store shares it.
+"""
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class RetentionIndex:
+    """Files of a directory tree, oldest first, evicted by count, total size and age"""
+
+    def __init__(self, max_files: int = 0, max_bytes: int = 0, max_age_sec: float = 0):
+        """0 disables a limit; callers serialize access"""
+        self.max_files = max_files
+        self.max_bytes = max_bytes
+        self.max_age_sec = max_age_sec
+        # path -> (size, mtime), oldest first
+        self._index = OrderedDict()
+        self.total_bytes = 0
+        self.evicted = 0
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def add(self, path: str, size: int, mtime: float):
+        """Record a file as the newest one (again, if it was already known)"""
+        previous = self._index.pop(path, None)
+        if previous is not None:
+            self.total_bytes -= previous[0]
+        self._index[path] = (size, mtime)
+        self.total_bytes += size
+
+    def discard(self, path: str):
+        previous = self._index.pop(path, None)
+        if previous is not None:
+            self.total_bytes -= previous[0]
+
+    def load(self, directories: Iterable[str], suffix: str = ".mid"):
+        """Pick up files left by earlier runs so retention covers them too"""
+        entries = []
+        for directory in directories:
+            with os.scandir(directory) as it:
+                for entry in it:
+                    if entry.is_file() and entry.name.endswith(suffix):
+                        stat = entry.stat()
+                        entries.append((stat.st_mtime, entry.path, stat.st_size))
+        for mtime, path, size in sorted(entries):
+            self.add(path, size, mtime)
+
+    def apply(self):
+        """Delete the oldest files until every limit holds"""
+        oldest_allowed = time.time() - self.max_age_sec if self.max_age_sec else None
+        while self._index:
+            path, (size, mtime) = next(iter(self._index.items()))
+            over_files = self.max_files and len(self._index) > self.max_files
+            over_bytes = self.max_bytes and self.total_bytes > self.max_bytes
+            too_old = oldest_allowed is not None and mtime < oldest_allowed
+            if not (over_files or over_bytes or too_old):
+                break
+
+            del self._index[path]
+            self.total_bytes -= size
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.error(f"Cannot evict MIDI file {path}: {str(e)}")
+                continue
+            self.evicted += 1
+
+
+class MidiStorage:
+    """Bounded, batched, non-blocking writer for the midi_output directory"""
+
+    def __init__(self, output_dir: str = "midi_output", enabled: bool = True,
+                 queue_size: int = 256, batch_size: int = 32, fsync: bool = True,
+                 max_files: int = 0, max_bytes: int = 0, max_age_sec: float = 0):
+        """
+        Args:
+            output_dir: Directory the files are written to
+            enabled: When False, submit() is a no-op
+            queue_size: Pending writes kept before new ones are dropped
+            batch_size: Maximum files written per fsync batch
+            fsync: fsync files and the directory after each batch
+            max_files / max_bytes / max_age_sec: Retention limits, 0 disables a limit
+        """
+        self.output_dir = output_dir
+        self.enabled = enabled
+        self.batch_size = max(1, batch_size)
+        self.fsync = fsync
+
+        self._queue = queue.Queue(maxsize=max(1, queue_size))
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+        # Only touched by the writer thread
+        self._retention = RetentionIndex(max_files, max_bytes, max_age_sec)
+
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+
+    def submit(self, midi_bytes: bytes, filename: str) -> Optional[str]:
+        """
+        Queue a file for writing without blocking
+
+        Returns:
+            Optional[str]: Path the file will be written to, None if disabled or dropped
+        """
+        if not self.enabled:
+            return None
+        self._ensure_started()
+
+        filepath = os.path.join(self.output_dir, self._unique_name(filename))
+        try:
+            self._queue.put_nowait((filepath, midi_bytes))
+        except queue.Full:
+            self.dropped += 1
+            logger.warning(f"MIDI output queue full, dropping {filepath}")
+            return None
+        return filepath
+
+    def flush(self):
+        """Block until every queued file has been written"""
+        if self._thread is not None:
+            self._queue.join()
+
+    def close(self, timeout: float = 5.0):
+        """Write out pending files and stop the writer thread"""
+        with self._start_lock:
+            thread, self._thread = self._thread, None
+        if thread is None:
+            return
+        self._queue.put(_STOP)
+        thread.join(timeout)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "queued": self._queue.qsize(),
+            "written": self.written,
+            "dropped": self.dropped,
+            "evicted": self._retention.evicted,
+            "failed": self.failed,
+            "files": len(self._retention),
+            "bytes": self._retention.total_bytes,
+        }
+
+    @staticmethod
+    def _unique_name(filename: str) -> str:
+        # Microsecond timestamp keeps names sortable; the random suffix makes
+        # them unique across concurrent requests and worker processes
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+        return f"{timestamp}_{uuid.uuid4().hex[:8]}_{filename}"
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="midi-storage", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        os.makedirs(self.output_dir, exist_ok=True)
+        self._retention.load([self.output_dir])
+        self._retention.apply()
+
+        running = True
+        while running:
+            item = self._queue.get()
+            if item is _STOP:
+                self._queue.task_done()
+                break
+
+            # Drain whatever else is already waiting, up to one batch
+            batch = [item]
+            while len(batch) < self.batch_size:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    self._queue.task_done()
+                    running = False
+                    break
+                batch.append(item)
+
+            try:
+                self._write_batch(batch)
+                self._retention.apply()
+            except Exception as e:
+                logger.error(f"MIDI output batch failed: {str(e)}")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _write_batch(self, batch):
+        opened = []
+        for filepath, midi_bytes in batch:
+            try:
+                f = open(filepath, "wb")
+            except OSError as e:
+                self.failed += 1
+                logger.error(f"Cannot write MIDI file {filepath}: {str(e)}")
+                continue
+            try:
+                f.write(midi_bytes)
+                f.flush()
+            except OSError as e:
+                f.close()
+                self.failed += 1
+                logger.error(f"Cannot write MIDI file {filepath}: {str(e)}")
+                continue
+            opened.append((filepath, len(midi_bytes), f))
+
+        now = time.time()
+        for filepath, size, f in opened:
+            try:
+                if self.fsync:
+                    os.fsync(f.fileno())
+            finally:
+                f.close()
+            self._retention.add(filepath, size, now)
+            self.written += 1
+            logger.debug(f"MIDI file saved to: {filepath}")
+
+        if opened and self.fsync:
+            self._fsync_directory()
+
+    def _fsync_directory(self):
+        # Makes the new directory entries durable; not supported on Windows
+        if not hasattr(os, "O_DIRECTORY"):
+            return
+        try:
+            fd = os.open(self.output_dir, os.O_RDONLY | os.O_DIRECTORY)
+        except OSError:
+            return
+        try:
+            os.fsync(fd)
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
@@ -1,15 +1,44 @@
-import mido
-from io import BytesIO
-from typing import List, Dict
-from models import MusicEvent
+from bisect import bisect_left
+from typing import Iterable, Iterator, List, Dict, Mapping, Optional, Sequence, Tuple, Union
+import numpy as np
+import config
+import metrics
+import harmony_engine
+from alignment import DELETE, MATCH, SUBSTITUTE, align
+from harmony_engine import Chord
+from interval_index import match_notes
+from models import HarmonyModeEnum, KeyEnum, MusicEvent
+from midi_storage import MidiStorage
+from note_sequence import NoteSequence
+from reference_index import CompiledReference, ReferenceIndex
+from smf_writer import ENCODER_DIRECT, ENCODERS, MidoWriter, SmfSizer, SmfStreamWriter, SmfWriter, create_writer
+
+# Either writer exposes the same start_track/note_on/note_off/... API
+TrackWriter = Union[SmfWriter, MidoWriter]
+
+# (is_on, channel, note, velocity, delta ticks)
+NoteMessage = Tuple[bool, int, int, int, int]
+
+# (channel, note, velocity, start tick, end tick)
+NoteSpan = Tuple[int, int, int, int, int]
+
+# Request events, or the same notes already sorted into a NoteSequence
+Events = Union[Sequence[MusicEvent], NoteSequence]
 
 
 class MidiGenerator:
     """MIDI file generator"""
     
-    def __init__(self):
+    def __init__(self, encoder: str = ENCODER_DIRECT, storage: Optional[MidiStorage] = None):
+        if encoder not in ENCODERS:
+            raise ValueError(f"Unknown MIDI encoder: {encoder}")
+        self.encoder = encoder  # "direct" byte writer or "mido" object graph
+        self.storage = storage  # Background writer for local copies, None skips saving
         self.ticks_per_beat = 480  # MIDI time resolution
         self.tempo = 500000  # 120 BPM (microseconds per beat)
+        self.melody_program = 0  # Piano (channel 0)
+        self.harmony_program = 48  # String Ensemble (channel 1)
+        self.harmony_velocity = 60  # Lower velocity keeps harmony balanced
         # Mapping from MIDI note numbers to note names (with simplified accidentals)
         self.note_names = {
             60: 'C', 61: 'C#', 62: 'D', 63: 'D#', 64: 'E', 65: 'F', 
@@ -18,151 +47,263 @@ class MidiGenerator:
             78: 'F#', 79: 'G', 80: 'G#', 81: 'A', 82: 'A#', 83: 'B'
         }
     
-    def create_harmonized_midi(self, events: List[MusicEvent], duration_sec: int) -> tuple:
+    def create_harmonized_midi(self, events: Events, duration_sec: int, encoder: Optional[str] = None,
+                               key: KeyEnum = KeyEnum.C_MAJOR,
+                               harmony_mode: HarmonyModeEnum = HarmonyModeEnum.DIATONIC) -> tuple:
         """
         Create a harmonized MIDI file
         - Track 1: Melody (Channel 1, Program 0 - Piano)
         - Track 2: Harmony (Channel 2, Program 48 - String Ensemble)
-        - Harmony pattern: Generate triads based on melody notes
+        - Harmony pattern: One triad per melody note (see _chord_plan)
+
+        Args:
+            encoder: Overrides the generator's encoder ("direct" or "mido") for A/B runs
+            key: Key the diatonic chords are taken from
+            harmony_mode: "diatonic" (key-aware, voice-led) or "major_triad" (original)
 
         Returns:
             tuple: (midi_bytes, chord_names_info)
         """
-        # Create a MIDI file (Type 1)
-        mid = mido.MidiFile(type=1)
+        # Sort once; both tracks read the same sequence
+        sequence = NoteSequence.of(events)
+        
+        # Create a MIDI file (Type 1); both writers produce identical bytes
+        writer = create_writer(encoder or self.encoder, self.ticks_per_beat, len(sequence))
         
         # Create the melody track
-        melody_track = mido.MidiTrack()
-        mid.tracks.append(melody_track)
+        writer.start_track()
         
         # Set tempo
-        melody_track.append(mido.MetaMessage('set_tempo', tempo=self.tempo))
-        melody_track.append(mido.Message('program_change', channel=0, program=0))
-        
-        # Create the harmony track
-        harmony_track = mido.MidiTrack()
-        mid.tracks.append(harmony_track)
-        harmony_track.append(mido.Message('program_change', channel=1, program=48))
+        writer.set_tempo(self.tempo)
+        writer.program_change(channel=0, program=self.melody_program)
         
         # Process melody events
-        self._add_melody_events(melody_track, events, duration_sec)
+        with metrics.stage("melody"):
+            self._add_melody_events(writer, sequence, duration_sec)
+        writer.end_track()
+        
+        # Create the harmony track
+        writer.start_track()
+        writer.program_change(channel=1, program=self.harmony_program)
         
         # Add harmony (triads based on melody notes) and collect chord names
-        chord_names_info = self._add_harmony_events(harmony_track, events, duration_sec)
+        with metrics.stage("harmony"):
+            chord_names_info = self._add_harmony_events(writer, sequence, duration_sec, key, harmony_mode)
+        writer.end_track()
         
         # Save the MIDI file locally
-        midi_bytes = self._midi_to_bytes(mid)
-        self._save_midi_file(mid, "harmony_output.mid")
+        with metrics.stage("to_bytes"):
+            midi_bytes = self._midi_to_bytes(writer)
+        with metrics.stage("save"):
+            self._save_midi_file(midi_bytes, "harmony_output.mid")
         
         return midi_bytes, chord_names_info
     
-    def _add_melody_events(self, track: mido.MidiTrack, events: List[MusicEvent], duration_sec: int):
+    def stream_harmonized_midi(self, events: Events, duration_sec: int,
+                               chunk_size: int = 64 * 1024, key: KeyEnum = KeyEnum.C_MAJOR,
+                               harmony_mode: HarmonyModeEnum = HarmonyModeEnum.DIATONIC) -> Tuple[int, Iterator[bytes]]:
+        """
+        Create a harmonized MIDI file as a stream of chunks
+        Same bytes as create_harmonized_midi(). A sizing pass computes the track
+        lengths first, then the file is encoded lazily, chunk_size bytes at a time.
+        No chord information is collected and no local copy is saved.
+    
+        Returns:
+            tuple: (total_size, chunk iterator)
+        """
+        sequence = NoteSequence.of(events)
+        # Both passes need the chords; choose them once
+        with metrics.stage("chords"):
+            chords = self._chord_plan(sequence, key, harmony_mode)
+    
+        sizer = SmfSizer()
+        with metrics.stage("stream_size"):
+            for _ in self._stream_tracks(sizer, sequence, chords, duration_sec, chunk_size):
+                pass
+    
+        writer = SmfStreamWriter(self.ticks_per_beat, sizer.track_lengths, capacity=chunk_size + 64)
+        return sizer.size, self._stream_tracks(writer, sequence, chords, duration_sec, chunk_size)
+    
+    def note_spans(self, events: Events, duration_sec: int, key: KeyEnum = KeyEnum.C_MAJOR,
+                   harmony_mode: HarmonyModeEnum = HarmonyModeEnum.DIATONIC) -> List[NoteSpan]:
+        """
+        The notes create_harmonized_midi() would write, as sounding intervals
+        Used for audio rendering; sorted by start tick.
+        """
+        sequence = NoteSequence.of(events)
+        chords = self._chord_plan(sequence, key, harmony_mode)
+        spans = []
+        for messages in (self._melody_messages(sequence, duration_sec),
+                         self._harmony_messages(sequence, chords, duration_sec)):
+            tick = 0
+            sounding = {}
+            for is_on, channel, note, velocity, delta in messages:
+                tick += delta
+                if is_on:
+                    sounding[(channel, note)] = (tick, velocity)
+                else:
+                    start, on_velocity = sounding.pop((channel, note))
+                    spans.append((channel, note, on_velocity, start, tick))
+        spans.sort(key=lambda span: span[3])
+        return spans
+    
+    def _stream_tracks(self, writer: Union[SmfSizer, SmfStreamWriter], sequence: NoteSequence,
+                       chords: Sequence[Chord], duration_sec: int, chunk_size: int) -> Iterator[bytes]:
+        """Write the create_harmonized_midi() track layout, yielding full chunks"""
+        writer.start_track()
+        writer.set_tempo(self.tempo)
+        writer.program_change(channel=0, program=self.melody_program)
+        messages = self._melody_messages(sequence, duration_sec)
+        yield from self._drain_messages(writer, messages, chunk_size)
+        writer.end_track()
+    
+        writer.start_track()
+        writer.program_change(channel=1, program=self.harmony_program)
+        messages = self._harmony_messages(sequence, chords, duration_sec)
+        yield from self._drain_messages(writer, messages, chunk_size)
+        writer.end_track()
+    
+        last = writer.take()
+        if last:
+            yield last
+    
+    @staticmethod
+    def _drain_messages(writer: Union[SmfSizer, SmfStreamWriter], messages: Iterable[NoteMessage],
+                        chunk_size: int) -> Iterator[bytes]:
+        """Write messages, handing out the buffer whenever it holds chunk_size bytes"""
+        note_on = writer.note_on
+        note_off = writer.note_off
+        for is_on, channel, note, velocity, delta in messages:
+            if is_on:
+                note_on(channel=channel, note=note, velocity=velocity, delta=delta)
+            else:
+                note_off(channel=channel, note=note, velocity=velocity, delta=delta)
+            if writer.pending >= chunk_size:
+                yield writer.take()
+    
+    def _add_melody_events(self, track: TrackWriter, sequence: NoteSequence, duration_sec: int):
         """Add melody events to the track"""
-        # Sort events by time
-        sorted_events = sorted(events, key=lambda x: x.t_sec)
-        
+        self._write_messages(track, self._melody_messages(sequence, duration_sec))
+    
+    def _add_harmony_events(self, track: TrackWriter, sequence: NoteSequence, duration_sec: int,
+                            key: KeyEnum = KeyEnum.C_MAJOR,
+                            harmony_mode: HarmonyModeEnum = HarmonyModeEnum.DIATONIC) -> List[Dict]:
+        """
+        Add harmony events
+        One triad per melody note, chosen by _chord_plan
+
+        Returns:
+            List[Dict]: List of chord information including time, root name, etc.
+        """
+        chords = self._chord_plan(sequence, key, harmony_mode)
+        chord_names_info = []
+        self._write_messages(track, self._harmony_messages(sequence, chords, duration_sec, chord_names_info))
+        return chord_names_info
+    
+    def _chord_plan(self, sequence: NoteSequence, key: KeyEnum,
+                    harmony_mode: HarmonyModeEnum) -> List[Chord]:
+        """
+        Chord for each onset-sorted melody note
+        - diatonic: triads of the key chosen for fit and voice leading (harmony_engine)
+        - major_triad: a root-position major triad on the melody note itself
+        """
+        if harmony_mode == HarmonyModeEnum.DIATONIC:
+            return harmony_engine.harmonize(sequence.notes, key)
+        return [self.major_triad(root_note) for root_note in sequence.notes]
+    
+    def major_triad(self, root_note: int) -> Chord:
+        """Root-position major triad on a melody note (major_triad harmony mode)"""
+        # Generate a new triad (root + third + fifth)
+        third = root_note + 4  # Major third
+        fifth = root_note + 7  # Perfect fifth
+        root_name = self.note_names.get(root_note, f'Unknown({root_note})')
+        return Chord(root_note, f'{root_name} Major', (root_note, third, fifth))
+    
+    @staticmethod
+    def _write_messages(track: TrackWriter, messages: Iterable[NoteMessage]):
+        """Write (is_on, channel, note, velocity, delta) messages to a track"""
+        note_on = track.note_on
+        note_off = track.note_off
+        for is_on, channel, note, velocity, delta in messages:
+            if is_on:
+                note_on(channel=channel, note=note, velocity=velocity, delta=delta)
+            else:
+                note_off(channel=channel, note=note, velocity=velocity, delta=delta)
+    
+    def _melody_messages(self, sequence: NoteSequence, duration_sec: int) -> Iterator[NoteMessage]:
+        """Melody note messages for a note sequence, produced lazily"""
         current_time = 0
         current_note = None
         
-        for event in sorted_events:
+        for event_time_ticks, note, velocity in zip(sequence.onset_ticks(self.ticks_per_beat),
+                                                     sequence.notes, sequence.velocities):
             # Calculate the time delta (in ticks) to reach this event
-            event_time_ticks = event.t_sec * self.ticks_per_beat
             delta_time = event_time_ticks - current_time
             
             # Stop the currently playing note if needed
             if current_note is not None:
-                track.append(mido.Message('note_off', 
-                                        channel=0, 
-                                        note=current_note, 
-                                        velocity=0, 
-                                        time=delta_time))
+                yield False, 0, current_note, 0, delta_time
                 current_time = event_time_ticks
                 delta_time = 0
             
             # Start a new note
-            track.append(mido.Message('note_on', 
-                                    channel=0, 
-                                    note=event.note, 
-                                    velocity=event.vel, 
-                                    time=delta_time))
-            current_note = event.note
+            yield True, 0, note, velocity, delta_time
+            current_note = note
             current_time = event_time_ticks
         
         # Ensure the last note stops at the end
         if current_note is not None:
             end_time_ticks = duration_sec * self.ticks_per_beat
             delta_time = end_time_ticks - current_time
-            track.append(mido.Message('note_off', 
-                                    channel=0, 
-                                    note=current_note, 
-                                    velocity=0, 
-                                    time=delta_time))
+            yield False, 0, current_note, 0, delta_time
     
-    def _add_harmony_events(self, track: mido.MidiTrack, events: List[MusicEvent], duration_sec: int) -> List[Dict]:
+    def _harmony_messages(self, sequence: NoteSequence, chords: Sequence[Chord], duration_sec: int,
+                          chord_names_info: Optional[List[Dict]] = None) -> Iterator[NoteMessage]:
         """
-        Add harmony events
-        Generate triads using each melody note as the root
-
-        Returns:
-            List[Dict]: List of chord information including time, root name, etc.
+        Harmony note messages for a note sequence and its chords, produced lazily
+        Chord details are appended to chord_names_info when a list is given
         """
-        # Sort events by time
-        sorted_events = sorted(events, key=lambda x: x.t_sec)
-        
-        # Generate a triad for each melody note
+        # Play each melody note's chord until the next melody note
         current_chord = None
         current_time = 0
-        chord_names_info = []
+        seconds = sequence.seconds()
+        onset_ticks = sequence.onset_ticks(self.ticks_per_beat)
+        last = len(seconds) - 1
         
-        for i, event in enumerate(sorted_events):
+        for i, start_time_ticks in enumerate(onset_ticks):
             # Calculate the duration of the current chord
-            if i < len(sorted_events) - 1:
-                chord_end_time = sorted_events[i + 1].t_sec
-            else:
-                chord_end_time = duration_sec
+            t_sec = seconds[i]
+            chord_end_time = seconds[i + 1] if i < last else duration_sec
             
             # End the current chord
             if current_chord is not None:
-                event_time_ticks = event.t_sec * self.ticks_per_beat
-                delta_time = event_time_ticks - current_time
+                delta_time = start_time_ticks - current_time
                 
                 for j, note in enumerate(current_chord):
                     note_off_time = delta_time if j == 0 else 0
-                    track.append(mido.Message('note_off', 
-                                            channel=1, 
-                                            note=note, 
-                                            velocity=0, 
-                                            time=note_off_time))
-                current_time = event_time_ticks
+                    yield False, 1, note, 0, note_off_time
+                current_time = start_time_ticks
             
-            # Generate a new triad (root + third + fifth)
-            root_note = event.note
-            third = root_note + 4  # Major third
-            fifth = root_note + 7  # Perfect fifth
-            current_chord = [root_note, third, fifth]
+            chord = chords[i]
+            current_chord = chord.notes
             
-            # Record chord details
-            root_name = self.note_names.get(root_note, f'Unknown({root_note})')
-            chord_names_info.append({
-                'time_sec': event.t_sec,
-                'duration_sec': chord_end_time - event.t_sec,
-                'root_note': root_note,
-                'chord_name': f'{root_name} Major',
-                'notes': current_chord,
-                'note_names': [self.note_names.get(note, f'Unknown({note})') for note in current_chord]
-            })
+            # Record chord details; the note tuples are shared between chords
+            if chord_names_info is not None:
+                chord_names_info.append({
+                    'time_sec': t_sec,
+                    'duration_sec': chord_end_time - t_sec,
+                    'root_note': chord.root_note,
+                    'chord_name': chord.name,
+                    'notes': current_chord,
+                    'note_names': harmony_engine.note_names(current_chord)
+                })
             
             # Start the new chord
-            start_time_ticks = event.t_sec * self.ticks_per_beat
             delta_time = start_time_ticks - current_time if current_time > 0 else start_time_ticks
             
             for j, note in enumerate(current_chord):
                 note_on_time = delta_time if j == 0 else 0
-                track.append(mido.Message('note_on', 
-                                        channel=1, 
-                                        note=note, 
-                                        velocity=60,  # Lower velocity keeps harmony balanced
-                                        time=note_on_time))
+                yield True, 1, note, self.harmony_velocity, note_on_time
             
             current_time = start_time_ticks
         
@@ -173,105 +314,73 @@ class MidiGenerator:
             
             for j, note in enumerate(current_chord):
                 note_off_time = delta_time if j == 0 else 0
-                track.append(mido.Message('note_off', 
-                                        channel=1, 
-                                        note=note, 
-                                        velocity=0, 
-                                        time=note_off_time))
-        
-        return chord_names_info
+                yield False, 1, note, 0, note_off_time
     
-    def _midi_to_bytes(self, mid: mido.MidiFile) -> bytes:
-        """Convert a MIDI object to bytes"""
-        bytes_io = BytesIO()
-        mid.save(file=bytes_io)
-        return bytes_io.getvalue()
+    def _midi_to_bytes(self, writer: TrackWriter) -> bytes:
+        """Convert the written MIDI file to bytes"""
+        return writer.getvalue()
     
-    def _save_midi_file(self, mid: mido.MidiFile, filename: str) -> str:
+    def _save_midi_file(self, midi_bytes: bytes, filename: str) -> Optional[str]:
         """
         Save the MIDI file locally
+        The write happens on the storage's background thread; this only enqueues it
 
         Args:
-            mid: MIDI file object
+            midi_bytes: Encoded MIDI file
             filename: Output filename
 
         Returns:
-            str: Path of the saved file
+            Optional[str]: Path the file will be saved to, None if not saved
         """
-        import os
-        # Ensure the output directory exists
-        output_dir = "midi_output"
-        os.makedirs(output_dir, exist_ok=True)
-        
-        # Generate a timestamped filename
-        from datetime import datetime
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        final_filename = f"{timestamp}_{filename}"
-        filepath = os.path.join(output_dir, final_filename)
-        
-        # Save the file
-        mid.save(filepath)
-        print(f"MIDI file saved to: {filepath}")
-        return filepath
+        if self.storage is None:
+            return None
+        return self.storage.submit(midi_bytes, filename)
 
 
 class ReferenceTemplates:
-    """Reference template manager"""
+    """Reference template manager backed by the compiled reference index"""
     
-    @staticmethod
-    def get_reference_template(reference_id: str) -> Dict[int, int]:
+    def __init__(self, index: Optional[ReferenceIndex] = None):
+        self.index = index if index is not None else ReferenceIndex(config.REFERENCE_DIR)
+    
+    def get_reference_template(self, reference_id: str) -> Mapping[int, int]:
         """
         Retrieve the reference template (seconds -> target note mapping)
         """
-        templates = {
-            "exercise_c_major_01": {
-                0: 60,  # C
-                1: 62,  # D
-                2: 64,  # E
-                3: 65,  # F
-                4: 67,  # G
-                5: 69,  # A
-                6: 71,  # B
-                7: 60,  # C (octave)
-                8: 62,  # D
-                9: 64   # E
-            }
-        }
-        
-        if reference_id not in templates:
-            raise ValueError("Reference not found")
-        
-        return templates[reference_id]
+        return self.index.get(reference_id).template
+    
+    def get_compiled_reference(self, reference_id: str) -> CompiledReference:
+        """Retrieve the reference as sorted time/note arrays"""
+        return self.index.get(reference_id)
 
 
 class MusicEvaluator:
     """Music evaluator"""
     
-    def __init__(self):
-        self.reference_templates = ReferenceTemplates()
+    def __init__(self, reference_index: Optional[ReferenceIndex] = None):
+        self.reference_templates = ReferenceTemplates(reference_index)
     
-    def evaluate_performance(self, events: List[MusicEvent], reference_id: str, duration_sec: int) -> Dict:
+    @metrics.timed("evaluate")
+    def evaluate_performance(self, events: Events, reference_id: str, duration_sec: int) -> Dict:
         """
         Evaluate performance - supports any number of notes
         """
         try:
-            reference = self.reference_templates.get_reference_template(reference_id)
+            compiled = self.reference_templates.get_compiled_reference(reference_id)
         except ValueError:
             raise ValueError("Reference not found")
+        reference = compiled.template
         
-        # Convert events to a time -> note map
-        played_notes = {}
-        for event in events:
-            if event.t_sec < duration_sec:
-                played_notes[event.t_sec] = event.note
+        # Convert events to a time -> note map (the last onset in a second wins)
+        played_notes = NoteSequence.of(events).slots(duration_sec)
         
         # Calculate the score - only check times present in the reference template
         total_points = 0
         correct_notes = 0
         mistakes = []
         
-        # Get the valid time range in the reference template
-        reference_times = [t for t in reference.keys() if t < duration_sec]
+        # Get the valid time range in the reference template (times are sorted)
+        reference_times = compiled.times[:compiled.count_before(duration_sec)]
         
         # Check each time point in the reference template
         for sec in reference_times:
@@ -298,10 +407,11 @@ class MusicEvaluator:
                 })
         
         # Check for extra notes - only consider notes not in the reference template
+        mistake_times = {m["time_sec"] for m in mistakes}
         for sec, note in played_notes.items():
             if sec not in reference or reference[sec] != note:
                 # Avoid duplicating errors already recorded
-                if not any(m.get("time_sec") == sec for m in mistakes):
+                if sec not in mistake_times:
                     mistakes.append({
                         "time_sec": sec,
                         "expected_note": reference.get(sec),
@@ -336,25 +446,321 @@ class MusicEvaluator:
             "advice": advice
         }
     
-    def _generate_advice(self, mistakes: List[Dict], correct_notes: int, total_points: int) -> str:
-        """Generate improvement advice - handles multiple situations"""
-        if not mistakes:
-            return "Perfect performance! Keep up the excellent work!"
+    @metrics.timed("evaluate_aligned")
+    def evaluate_aligned(self, events: Events, reference_id: str, duration_sec: int,
+                         tolerance_ms: int = 150, band: int = 32) -> Dict:
+        """
+        Evaluate performance by aligning played onsets to the reference
+        Notes are paired across slot boundaries, so a slightly early or late
+        note counts as a timing deviation instead of a missing + extra pair.
+        Timing is scored from the onset deviation of the paired notes.
+        """
+        try:
+            compiled = self.reference_templates.get_compiled_reference(reference_id)
+        except ValueError:
+            raise ValueError("Reference not found")
+
+        limit_ms = duration_sec * 1000
+        total_points = compiled.onsets_before(limit_ms)
+        ref_onsets = compiled.onsets_ms[:total_points]
+        ref_notes = compiled.onset_notes[:total_points]
+
+        sequence = NoteSequence.of(events)
+        played_count = bisect_left(sequence.onsets_ms, limit_ms)
+        played_onsets = sequence.onsets_ms[:played_count].tolist()
+        played_notes = sequence.notes[:played_count].tolist()
+
+        steps = align(ref_onsets, ref_notes, played_onsets, played_notes, tolerance_ms, band)
+
+        correct_notes = wrong_notes = missing_notes = extra_notes = 0
+        deviations = []
+        mistakes = []
+        for op, ref_idx, perf_idx in steps:
+            if op == MATCH or op == SUBSTITUTE:
+                offset_ms = played_onsets[perf_idx] - ref_onsets[ref_idx]
+                deviations.append(abs(offset_ms))
+                if op == MATCH:
+                    correct_notes += 1
+                    continue
+                wrong_notes += 1
+                mistakes.append({
+                    "time_sec": ref_onsets[ref_idx] // 1000,
+                    "time_ms": ref_onsets[ref_idx],
+                    "expected_note": ref_notes[ref_idx],
+                    "played_note": played_notes[perf_idx],
+                    "offset_ms": offset_ms,
+                    "error_type": "wrong_note"
+                })
+            elif op == DELETE:
+                missing_notes += 1
+                mistakes.append({
+                    "time_sec": ref_onsets[ref_idx] // 1000,
+                    "time_ms": ref_onsets[ref_idx],
+                    "expected_note": ref_notes[ref_idx],
+                    "played_note": None,
+                    "error_type": "missing_note"
+                })
+            else:
+                extra_notes += 1
+                mistakes.append({
+                    "time_sec": played_onsets[perf_idx] // 1000,
+                    "time_ms": played_onsets[perf_idx],
+                    "expected_note": None,
+                    "played_note": played_notes[perf_idx],
+                    "error_type": "extra_note"
+                })
+
+        if total_points > 0:
+            accuracy_score = (correct_notes / total_points) * 100
+        else:
+            accuracy_score = 50.0 if played_count else 100.0
+
+        # Onset score: full marks on time, falling linearly to 0 at the tolerance
+        if deviations:
+            onset_score = 100 * sum(max(0.0, 1 - d / tolerance_ms) for d in deviations) / len(deviations)
+            mean_deviation = sum(deviations) / len(deviations)
+        else:
+            onset_score = 100.0
+            mean_deviation = 0.0
+        timing_score = max(0, onset_score - (missing_notes + extra_notes) * 10)
+
+        overall_score = (accuracy_score * 0.7 + timing_score * 0.3)
+
+        advice = self._advice_from_counts(wrong_notes, missing_notes, extra_notes, correct_notes, total_points)
+
+        return {
+            "score": round(overall_score, 1),
+            "subscores": {
+                "accuracy": round(accuracy_score, 1),
+                "timing": round(timing_score, 1),
+                "onset_deviation_ms": round(mean_deviation, 1)
+            },
+            "mistakes": mistakes,
+            "advice": advice
+        }
+
+    @metrics.timed("evaluate_polyphonic")
+    def evaluate_polyphonic(self, events: Events, reference_id: str, duration_sec: int,
+                            tolerance_ms: int = 150) -> Dict:
+        """
+        Evaluate a performance that may contain chords and held notes
+        Every reference note (not only the first per onset) is a target.
+        Played notes are matched through the reference's interval index:
+        same pitch within tolerance_ms first, then leftover notes in the
+        window as wrong notes. Accuracy and timing are scored as in aligned
+        mode; held lengths (dur_ms) of correct notes are compared with the
+        reference's and reported as the duration subscore when both are known.
+        """
+        try:
+            compiled = self.reference_templates.get_compiled_reference(reference_id)
+        except ValueError:
+            raise ValueError("Reference not found")
+
+        limit_ms = duration_sec * 1000
+        intervals = compiled.intervals
+        total_points = intervals.count_before(limit_ms)
+        ref_starts, ref_ends, ref_notes = intervals.starts, intervals.ends, intervals.pitches
+
+        sequence = events if isinstance(events, NoteSequence) else NoteSequence.from_events(events, durations=True)
+        played_count = bisect_left(sequence.onsets_ms, limit_ms)
+        played_onsets = sequence.onsets_ms[:played_count].tolist()
+        played_notes = sequence.notes[:played_count].tolist()
+        played_durations = sequence.durations_ms[:played_count].tolist() if sequence.durations_ms is not None else None
+
+        steps = match_notes(intervals, total_points, played_onsets, played_notes, tolerance_ms)
+
+        correct_notes = wrong_notes = missing_notes = extra_notes = 0
+        deviations = []
+        length_ratios = []
+        mistakes = []
+        for op, ref_idx, perf_idx in steps:
+            if op == MATCH:
+                correct_notes += 1
+                deviations.append(abs(played_onsets[perf_idx] - ref_starts[ref_idx]))
+                ref_length = ref_ends[ref_idx] - ref_starts[ref_idx]
+                played_length = played_durations[perf_idx] if played_durations else 0
+                if ref_length and played_length:
+                    length_ratios.append(min(ref_length, played_length) / max(ref_length, played_length))
+            elif op == SUBSTITUTE:
+                wrong_notes += 1
+                offset_ms = played_onsets[perf_idx] - ref_starts[ref_idx]
+                deviations.append(abs(offset_ms))
+                mistakes.append({
+                    "time_sec": ref_starts[ref_idx] // 1000,
+                    "time_ms": ref_starts[ref_idx],
+                    "expected_note": ref_notes[ref_idx],
+                    "played_note": played_notes[perf_idx],
+                    "offset_ms": offset_ms,
+                    "error_type": "wrong_note"
+                })
+            elif op == DELETE:
+                missing_notes += 1
+                mistakes.append({
+                    "time_sec": ref_starts[ref_idx] // 1000,
+                    "time_ms": ref_starts[ref_idx],
+                    "expected_note": ref_notes[ref_idx],
+                    "played_note": None,
+                    "error_type": "missing_note"
+                })
+            else:
+                extra_notes += 1
+                mistakes.append({
+                    "time_sec": played_onsets[perf_idx] // 1000,
+                    "time_ms": played_onsets[perf_idx],
+                    "expected_note": None,
+                    "played_note": played_notes[perf_idx],
+                    "error_type": "extra_note"
+                })
+        mistakes.sort(key=lambda mistake: (mistake["time_ms"], mistake["expected_note"] or mistake["played_note"]))
+
+        if total_points > 0:
+            accuracy_score = (correct_notes / total_points) * 100
+        else:
+            accuracy_score = 50.0 if played_count else 100.0
+
+        # Onset score: full marks on time, falling linearly to 0 at the tolerance
+        if deviations:
+            onset_score = 100 * sum(max(0.0, 1 - d / tolerance_ms) for d in deviations) / len(deviations)
+            mean_deviation = sum(deviations) / len(deviations)
+        else:
+            onset_score = 100.0
+            mean_deviation = 0.0
+        timing_score = max(0, onset_score - (missing_notes + extra_notes) * 10)
+
+        overall_score = (accuracy_score * 0.7 + timing_score * 0.3)
+
+        subscores = {
+            "accuracy": round(accuracy_score, 1),
+            "timing": round(timing_score, 1),
+            "onset_deviation_ms": round(mean_deviation, 1)
+        }
+        if length_ratios:
+            subscores["duration"] = round(100 * sum(length_ratios) / len(length_ratios), 1)
+
+        return {
+            "score": round(overall_score, 1),
+            "subscores": subscores,
+            "mistakes": mistakes,
+            "advice": self._advice_from_counts(wrong_notes, missing_notes, extra_notes, correct_notes, total_points)
+        }
+
+    @metrics.timed("evaluate_batch")
+    def evaluate_batch(self, submissions: List[Events], reference_id: str, duration_sec: int) -> List[Dict]:
+        """
+        Evaluate many performances of the same reference at once
+        Submissions are packed into an (N, duration_sec) note matrix and the
+        wrong/missing/extra masks and scores are computed with NumPy.
+        Each result matches evaluate_performance() for the same submission.
+        """
+        try:
+            compiled = self.reference_templates.get_compiled_reference(reference_id)
+        except ValueError:
+            raise ValueError("Reference not found")
         
-        advice_parts = []
+        # Reference row: expected note per second, -1 where nothing is expected
+        total_points = compiled.count_before(duration_sec)
+        ref_row = np.full(duration_sec, -1, dtype=np.int16)
+        ref_row[np.asarray(compiled.times[:total_points])] = np.asarray(compiled.notes[:total_points])
+        has_ref = ref_row >= 0
+        
+        # Played matrix: one row per submission, -1 where nothing was played
+        count = len(submissions)
+        rows, times, notes = [], [], []
+        for row, events in enumerate(submissions):
+            # Same slot semantics as evaluate_performance: the last onset in a second wins
+            slots = NoteSequence.of(events).slots(duration_sec)
+            rows.extend([row] * len(slots))
+            times.extend(slots.keys())
+            notes.extend(slots.values())
+        played = np.full((count, duration_sec), -1, dtype=np.int16)
+        played[rows, times] = notes
+        has_played = played >= 0
+        
+        correct_mask = has_ref & (played == ref_row)
+        wrong_mask = has_ref & has_played & (played != ref_row)
+        missing_mask = has_ref & ~has_played
+        extra_mask = ~has_ref & has_played
+        
+        correct = correct_mask.sum(axis=1)
+        wrong = wrong_mask.sum(axis=1)
+        missing = missing_mask.sum(axis=1)
+        extra = extra_mask.sum(axis=1)
+        
+        if total_points > 0:
+            accuracy = (correct / total_points) * 100
+        else:
+            accuracy = np.where(has_played.any(axis=1), 50.0, 100.0)
+        timing = np.maximum(0, 100 - (missing + extra) * 10)
+        overall = accuracy * 0.7 + timing * 0.3
+        
+        # Reference-time mistakes: np.nonzero walks row by row in time order
+        mistakes_by_row = [[] for _ in range(count)]
+        ref_notes = ref_row.tolist()
+        mistake_rows, mistake_secs = np.nonzero(wrong_mask | missing_mask)
+        mistake_played = played[mistake_rows, mistake_secs]
+        for row, sec, played_note in zip(mistake_rows.tolist(), mistake_secs.tolist(), mistake_played.tolist()):
+            mistakes_by_row[row].append({
+                "time_sec": sec,
+                "expected_note": ref_notes[sec],
+                "played_note": played_note if played_note >= 0 else None,
+                "error_type": "wrong_note" if played_note >= 0 else "missing_note"
+            })
+        
+        # Extra notes follow, in the order they were played
+        if rows:
+            is_extra = extra_mask[rows, times]
+            for i in np.flatnonzero(is_extra).tolist():
+                mistakes_by_row[rows[i]].append({
+                    "time_sec": times[i],
+                    "expected_note": None,
+                    "played_note": notes[i],
+                    "error_type": "extra_note"
+                })
         
+        results = []
+        for row, (score, accuracy_score, timing_score) in enumerate(
+                zip(overall.tolist(), accuracy.tolist(), timing.tolist())):
+            advice = self._advice_from_counts(
+                int(wrong[row]), int(missing[row]), int(extra[row]), int(correct[row]), total_points
+            )
+            results.append({
+                "score": round(score, 1),
+                "subscores": {
+                    "accuracy": round(accuracy_score, 1),
+                    "timing": round(timing_score, 1)
+                },
+                "mistakes": mistakes_by_row[row],
+                "advice": advice
+            })
+        
+        return results
+    
+    def _generate_advice(self, mistakes: List[Dict], correct_notes: int, total_points: int) -> str:
+        """Generate improvement advice - handles multiple situations"""
         wrong_notes = [m for m in mistakes if m["error_type"] == "wrong_note"]
         missing_notes = [m for m in mistakes if m["error_type"] == "missing_note"]
         extra_notes = [m for m in mistakes if m["error_type"] == "extra_note"]
         
+        return self._advice_from_counts(
+            len(wrong_notes), len(missing_notes), len(extra_notes), correct_notes, total_points
+        )
+    
+    def _advice_from_counts(self, wrong_notes: int, missing_notes: int, extra_notes: int,
+                            correct_notes: int, total_points: int) -> str:
+        """Build the advice text from mistake counts"""
+        if not (wrong_notes or missing_notes or extra_notes):
+            return "Perfect performance! Keep up the excellent work!"
+        
+        advice_parts = []
+        
         if wrong_notes:
-            advice_parts.append(f"Focus on accuracy - you played {len(wrong_notes)} wrong notes.")
+            advice_parts.append(f"Focus on accuracy - you played {wrong_notes} wrong notes.")
         
         if missing_notes:
-            advice_parts.append(f"Don't miss notes - you missed {len(missing_notes)} notes.")
+            advice_parts.append(f"Don't miss notes - you missed {missing_notes} notes.")
         
         if extra_notes:
-            advice_parts.append(f"Avoid extra notes - you played {len(extra_notes)} additional notes.")
+            advice_parts.append(f"Avoid extra notes - you played {extra_notes} additional notes.")
         
         # Handle the case with zero reference points
         if total_points == 0:
@@ -366,4 +772,4 @@ class MusicEvaluator:
         else:
             advice_parts.append("Focus on learning the basic melody pattern first.")
         
-        return " ".join(advice_parts) if advice_parts else "Keep practicing!"
\ No newline at end of file
+        return " ".join(advice_parts) if advice_parts else "Keep practicing!"
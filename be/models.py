@@ -1,6 +1,7 @@
-from typing import List, Optional, Dict, Union
-from pydantic import BaseModel, Field, validator
+from typing import Any, List, Optional, Dict, Union
+from pydantic import BaseModel, Field, root_validator, validator
 from enum import Enum
+import re
 
 
 class ModeEnum(str, Enum):
@@ -11,76 +12,287 @@ class ModeEnum(str, Enum):
 class ReturnModeEnum(str, Enum):
     BYTES = "bytes"
     URL = "url"
+    WAV = "wav"  # Rendered audio instead of MIDI
+    BUNDLE = "bundle"  # MIDI and chord information in one binary body
+
+
+class ChordFormatEnum(str, Enum):
+    FULL = "full"        # chord_details with chord and note names
+    COMPACT = "compact"  # chord_details with note numbers only; names derived by the client
+
+
+class BatchFormatEnum(str, Enum):
+    NDJSON = "ndjson"
+    ZIP = "zip"
 
 
 class QuantizeEnum(str, Enum):
     ONE_SECOND = "1s"
+    HALF_SECOND = "500ms"
+    QUARTER_SECOND = "250ms"
+    TENTH_SECOND = "100ms"
+    TEN_MS = "10ms"
+    ONE_MS = "1ms"
+
+
+# Grid size in milliseconds for each quantize setting
+QUANTIZE_MS = {
+    QuantizeEnum.ONE_SECOND: 1000,
+    QuantizeEnum.HALF_SECOND: 500,
+    QuantizeEnum.QUARTER_SECOND: 250,
+    QuantizeEnum.TENTH_SECOND: 100,
+    QuantizeEnum.TEN_MS: 10,
+    QuantizeEnum.ONE_MS: 1,
+}
+
+
+class EvaluationModeEnum(str, Enum):
+    SLOT = "slot"        # Compare notes per one-second slot
+    ALIGNED = "aligned"  # Align onsets to the reference (banded DTW)
+    POLYPHONIC = "polyphonic"  # Chords allowed; notes matched through an interval index
+
+
+class MidiTimeBaseEnum(str, Enum):
+    BEATS = "beats"  # One beat per second, as harmonize writes files
+    TEMPO = "tempo"  # Real time from the file's tempo map
 
 
 class KeyEnum(str, Enum):
     C_MAJOR = "C major"
+    A_MINOR = "A minor"  # Same white keys, A as the tonic
+
+
+class HarmonyModeEnum(str, Enum):
+    DIATONIC = "diatonic"        # Key-aware chord choice with voice leading
+    MAJOR_TRIAD = "major_triad"  # Major triad on every melody note (original behavior)
+
+
+class AccompanimentFormatEnum(str, Enum):
+    JSON = "json"  # One JSON message per chord
+    MIDI = "midi"  # Raw MIDI note-off/note-on bytes per chord, as binary frames
 
 
 class OctaveBaseEnum(str, Enum):
     C4 = "C4"
 
 
+# C major white keys: C(60), D(62), E(64), F(65), G(67), A(69), B(71)
+WHITE_KEYS = {60, 62, 64, 65, 67, 69, 71}
+DEFAULT_VELOCITY = 96
+MAX_ONSET_MS = 60999
+MAX_DURATION_MS = 60000
+
+
 class MusicEvent(BaseModel):
     t_sec: int = Field(..., ge=0, le=60, description="Time in seconds (0-60)")  # Extended to 60 seconds
+    t_ms: Optional[int] = Field(None, ge=0, le=MAX_ONSET_MS, description="Onset in milliseconds; t_sec is derived from it if omitted")
     note: int = Field(..., description="MIDI note number")
-    vel: Optional[int] = Field(96, ge=1, le=127, description="Velocity (1-127), default 96")
+    vel: Optional[int] = Field(DEFAULT_VELOCITY, ge=1, le=127, description="Velocity (1-127), default 96")
+    dur_ms: Optional[int] = Field(None, ge=1, le=MAX_DURATION_MS, description="Held length in milliseconds (polyphonic evaluation)")
+
+    @root_validator(pre=True)
+    def derive_t_sec(cls, values):
+        if isinstance(values, dict) and values.get('t_sec') is None and isinstance(values.get('t_ms'), int):
+            values = {**values, 't_sec': values['t_ms'] // 1000}
+        return values
+
+    @validator('t_ms')
+    def validate_t_ms(cls, v, values):
+        if v is not None and 't_sec' in values and v // 1000 != values['t_sec']:
+            raise ValueError("t_ms does not match t_sec")
+        return v
+
+    @property
+    def onset_ms(self) -> int:
+        """Onset in milliseconds, from t_ms when given"""
+        return self.t_ms if self.t_ms is not None else self.t_sec * 1000
 
     @validator('note')
     def validate_note(cls, v):
-        # C major white keys: C(60), D(62), E(64), F(65), G(67), A(69), B(71)
-        white_keys = {60, 62, 64, 65, 67, 69, 71}
-        if v not in white_keys:
-            raise ValueError(f"Note must be one of C major white keys: {white_keys}")
+        if v not in WHITE_KEYS:
+            raise ValueError(f"Note must be one of C major white keys: {WHITE_KEYS}")
         return v
 
 
-class BaseRequest(BaseModel):
+# Longest session accepted by the streaming harmonize endpoint
+MAX_STREAM_DURATION_SEC = 3600
+MAX_STREAM_ONSET_MS = MAX_STREAM_DURATION_SEC * 1000 + 999
+
+
+class LongMusicEvent(MusicEvent):
+    """MusicEvent for long sessions (streaming harmonize)"""
+    t_sec: int = Field(..., ge=0, le=MAX_STREAM_DURATION_SEC, description=f"Time in seconds (0-{MAX_STREAM_DURATION_SEC})")
+    t_ms: Optional[int] = Field(None, ge=0, le=MAX_STREAM_ONSET_MS, description="Onset in milliseconds; t_sec is derived from it if omitted")
+
+
+def check_events(v, quantize: Optional[QuantizeEnum] = None, polyphonic: bool = False):
+    """Shared event list checks for every request carrying events"""
+    if not v:
+        raise ValueError("Empty sequence")
+    
+    # Check for duplicate timeslots on the quantize grid (one second by default);
+    # polyphonic takes may repeat a timeslot with different notes (chords)
+    grid_ms = QUANTIZE_MS.get(quantize, 1000)
+    if polyphonic:
+        time_slots = [(event.onset_ms // grid_ms, event.note) for event in v]
+    else:
+        time_slots = [event.onset_ms // grid_ms for event in v]
+    if len(time_slots) != len(set(time_slots)):
+        raise ValueError("Duplicate timeslot")
+    
+    return v
+
+
+# Student identifier for practice history; "*" is reserved for all-user aggregates
+USER_ID_PATTERN = re.compile(r"[A-Za-z0-9_.@-]{1,64}")
+
+
+def check_user_id(v):
+    if v is not None and not USER_ID_PATTERN.fullmatch(v):
+        raise ValueError("Invalid user_id: use 1-64 letters, digits or _.@-")
+    return v
+
+
+class BaseSessionRequest(BaseModel):
     version: str = Field(..., description="API version")
     mode: ModeEnum = Field(..., description="Operation mode")
     duration_sec: int = Field(..., ge=1, le=60, description="Duration in seconds (1-60)")
     quantize: QuantizeEnum = Field(..., description="Quantization setting")
     octave_base: OctaveBaseEnum = Field(..., description="Base octave")
     key: KeyEnum = Field(..., description="Musical key")
+
+    @validator('version')
+    def validate_version(cls, v):
+        if v != "1.0":
+            raise ValueError("Unsupported version")
+        return v
+
+
+class BaseRequest(BaseSessionRequest):
     events: List[MusicEvent] = Field(..., min_items=1, description="List of music events")
 
+    @validator('events')
+    def validate_events(cls, v, values):
+        return check_events(v, values.get('quantize'))
+
+
+class HarmonizeSettings(BaseSessionRequest):
+    """HarmonizeRequest without its events (packed request header)"""
+    mode: ModeEnum = Field(ModeEnum.HARMONIZE, description="Must be 'harmonize'")
+    return_mode: ReturnModeEnum = Field(ReturnModeEnum.BYTES, description="Return format")
+    harmony_mode: HarmonyModeEnum = Field(HarmonyModeEnum.DIATONIC, description="Chord selection")
+    chord_format: ChordFormatEnum = Field(ChordFormatEnum.FULL, description="chord_details schema (url and bundle modes)")
+
+    @validator('mode')
+    def validate_mode(cls, v):
+        if v != ModeEnum.HARMONIZE:
+            raise ValueError("Invalid mode")
+        return v
+
+
+class HarmonizeRequest(HarmonizeSettings, BaseRequest):
+    pass
+
+
+class HarmonizeStreamSettings(BaseSessionRequest):
+    """HarmonizeStreamRequest without its events (packed request header)"""
+    mode: ModeEnum = Field(ModeEnum.HARMONIZE, description="Must be 'harmonize'")
+    duration_sec: int = Field(..., ge=1, le=MAX_STREAM_DURATION_SEC, description=f"Duration in seconds (1-{MAX_STREAM_DURATION_SEC})")
+    harmony_mode: HarmonyModeEnum = Field(HarmonyModeEnum.DIATONIC, description="Chord selection")
+
+    @validator('mode')
+    def validate_mode(cls, v):
+        if v != ModeEnum.HARMONIZE:
+            raise ValueError("Invalid mode")
+        return v
+
+
+class HarmonizeStreamRequest(HarmonizeStreamSettings):
+    """Harmonize request for long sessions; the MIDI file is streamed back"""
+    events: List[LongMusicEvent] = Field(..., min_items=1, description="List of music events")
+
+    @validator('events')
+    def validate_events(cls, v, values):
+        return check_events(v, values.get('quantize'))
+
+
+class HarmonizeBatchRequest(BaseModel):
+    version: str = Field(..., description="API version")
+    format: BatchFormatEnum = Field(BatchFormatEnum.NDJSON, description="Streamed result format")
+    # Items are validated one by one so a bad item only fails itself
+    items: List[Dict[str, Any]] = Field(..., min_items=1, description="HarmonizeRequest payloads")
+
     @validator('version')
     def validate_version(cls, v):
         if v != "1.0":
             raise ValueError("Unsupported version")
         return v
 
+
+class EvaluateSettings(BaseSessionRequest):
+    """EvaluateRequest without its events (packed request header)"""
+    mode: ModeEnum = Field(ModeEnum.EVALUATE, description="Must be 'evaluate'")
+    reference_id: str = Field(..., description="Reference template ID")
+    evaluation_mode: EvaluationModeEnum = Field(EvaluationModeEnum.SLOT, description="Slot comparison or onset alignment")
+    timing_tolerance_ms: int = Field(150, ge=1, le=5000, description="Onset deviation scored as fully late (aligned and polyphonic modes)")
+    user_id: Optional[str] = Field(None, description="Student the result is recorded for in practice history")
+
+    @validator('mode')
+    def validate_mode(cls, v):
+        if v != ModeEnum.EVALUATE:
+            raise ValueError("Invalid mode")
+        return v
+
+    @validator('user_id')
+    def validate_user_id(cls, v):
+        return check_user_id(v)
+
+
+class EvaluateRequest(EvaluateSettings, BaseRequest):
     @validator('events')
-    def validate_events(cls, v):
+    def validate_events(cls, v, values):
+        # Timeslots are checked in validate_timeslots: evaluation_mode is declared after events
         if not v:
             raise ValueError("Empty sequence")
-        
-        # Check for duplicate timeslots
-        time_slots = [event.t_sec for event in v]
-        if len(time_slots) != len(set(time_slots)):
-            raise ValueError("Duplicate timeslot")
-        
         return v
 
+    @root_validator(skip_on_failure=True)
+    def validate_timeslots(cls, values):
+        polyphonic = values.get('evaluation_mode') == EvaluationModeEnum.POLYPHONIC
+        check_events(values['events'], values.get('quantize'), polyphonic)
+        return values
 
-class HarmonizeRequest(BaseRequest):
-    mode: ModeEnum = Field(ModeEnum.HARMONIZE, description="Must be 'harmonize'")
-    return_mode: ReturnModeEnum = Field(ReturnModeEnum.BYTES, description="Return format")
+
+class EvaluateSubmission(BaseModel):
+    events: List[MusicEvent] = Field(..., min_items=1, description="List of music events")
+    user_id: Optional[str] = Field(None, description="Student the result is recorded for in practice history")
+
+    @validator('events')
+    def validate_events(cls, v):
+        return check_events(v)
+
+    @validator('user_id')
+    def validate_user_id(cls, v):
+        return check_user_id(v)
+
+
+class EvaluateBatchRequest(BaseSessionRequest):
+    mode: ModeEnum = Field(ModeEnum.EVALUATE, description="Must be 'evaluate'")
+    reference_id: str = Field(..., description="Reference template ID shared by all submissions")
+    submissions: List[EvaluateSubmission] = Field(..., min_items=1, description="Performances to grade")
 
     @validator('mode')
     def validate_mode(cls, v):
-        if v != ModeEnum.HARMONIZE:
+        if v != ModeEnum.EVALUATE:
             raise ValueError("Invalid mode")
         return v
 
 
-class EvaluateRequest(BaseRequest):
+class LiveEvaluateStart(BaseSessionRequest):
+    """First message of a live evaluation session; notes follow one by one"""
     mode: ModeEnum = Field(ModeEnum.EVALUATE, description="Must be 'evaluate'")
     reference_id: str = Field(..., description="Reference template ID")
+    user_id: Optional[str] = Field(None, description="Student the result is recorded for in practice history")
 
     @validator('mode')
     def validate_mode(cls, v):
@@ -88,14 +300,73 @@ class EvaluateRequest(BaseRequest):
             raise ValueError("Invalid mode")
         return v
 
+    @validator('user_id')
+    def validate_user_id(cls, v):
+        return check_user_id(v)
+
+
+class LiveHarmonizeStart(BaseSessionRequest):
+    """First message of a live accompaniment session; melody notes follow one by one"""
+    mode: ModeEnum = Field(ModeEnum.HARMONIZE, description="Must be 'harmonize'")
+    harmony_mode: HarmonyModeEnum = Field(HarmonyModeEnum.DIATONIC, description="Chord selection")
+    format: AccompanimentFormatEnum = Field(AccompanimentFormatEnum.JSON, description="Chord message format")
+
+    @validator('mode')
+    def validate_mode(cls, v):
+        if v != ModeEnum.HARMONIZE:
+            raise ValueError("Invalid mode")
+        return v
+
 
 class EvaluateResponse(BaseModel):
     score: float = Field(..., ge=0, le=100, description="Overall score (0-100)")
     subscores: Dict[str, float] = Field(..., description="Detailed subscores")
-    mistakes: List[Dict[str, Union[int, str]]] = Field(..., description="List of mistakes")
+    # expected_note / played_note are None for extra / missing notes
+    mistakes: List[Dict[str, Optional[Union[int, str]]]] = Field(..., description="List of mistakes")
     advice: str = Field(..., description="Advice for improvement")
 
 
+class ChordDetail(BaseModel):
+    time_sec: int = Field(..., description="Onset of the chord (seconds)")
+    duration_sec: int = Field(..., description="Seconds until the next chord or the end")
+    root_note: int = Field(..., description="MIDI note of the chord root")
+    chord_name: str = Field(..., description="Root and quality, e.g. 'C Major'")
+    notes: List[int] = Field(..., description="MIDI notes of the voicing, low to high")
+    note_names: List[str] = Field(..., description="Pitch names of the notes")
+
+
+class CompactChordDetail(BaseModel):
+    """ChordDetail with note numbers only; names follow from root_note and the intervals of notes"""
+    time_sec: int = Field(..., description="Onset of the chord (seconds)")
+    duration_sec: int = Field(..., description="Seconds until the next chord or the end")
+    root_note: int = Field(..., description="MIDI note of the chord root")
+    notes: List[int] = Field(..., description="MIDI notes of the voicing, low to high")
+
+
+class HarmonizeUrlResponse(BaseModel):
+    """Harmonize URL mode with chord_format 'full'; bundle mode carries the same fields without url"""
+    url: str = Field(..., description="Download link of the MIDI file")
+    chord_names: List[str] = Field(..., description="Chord name of each melody note")
+    chord_details: List[ChordDetail] = Field(..., description="One entry per melody note")
+
+
+class CompactHarmonizeUrlResponse(BaseModel):
+    """Harmonize URL mode with chord_format 'compact'"""
+    url: str = Field(..., description="Download link of the MIDI file")
+    chord_details: List[CompactChordDetail] = Field(..., description="One entry per melody note")
+
+
+class EvaluateBatchResponse(BaseModel):
+    results: List[EvaluateResponse] = Field(..., description="One result per submission, in order")
+
+
+class ProfileRequest(BaseModel):
+    """Start of an admin profiling session; it ends at whichever limit comes first"""
+    duration_sec: float = Field(30.0, gt=0, le=600, description="Longest the session runs")
+    requests: Optional[int] = Field(None, ge=1, description="Harmonize/evaluate requests to profile")
+    interval_ms: float = Field(5.0, ge=1, le=1000, description="Sampling interval")
+
+
 class ErrorResponse(BaseModel):
     error_code: str = Field(..., description="Error code")
     message: str = Field(..., description="Error message")
@@ -0,0 +1,91 @@
+"""
+Compact melody note sequence
+
+Requests carry one MusicEvent model per note, in the order the client sent
+them. Generation and scoring only read three numbers from each event and
+need them by onset, so a NoteSequence is built once per request: the
+events sorted once and kept as parallel arrays. MidiGenerator and
+MusicEvaluator take either form and convert a plain event list at most
+once; a NoteSequence also pickles as flat buffers for process pools.
+Held lengths (dur_ms) are only read for polyphonic evaluation and are
+collected on request.
+"""
+from array import array
+from bisect import bisect_left
+from typing import Dict, List, Optional, Sequence, Union
+
+import numpy as np
+
+from models import DEFAULT_VELOCITY, MusicEvent
+
+
+class NoteSequence:
+    """Notes sorted by onset: onset (ms), MIDI note and velocity columns, optionally held lengths"""
+
+    __slots__ = ("onsets_ms", "notes", "velocities", "durations_ms")
+
+    def __init__(self, onsets_ms: array, notes: array, velocities: array, durations_ms: Optional[array] = None):
+        """Columns must already be in onset order; use from_events() for events"""
+        self.onsets_ms = onsets_ms    # array('q')
+        self.notes = notes            # array('B')
+        self.velocities = velocities  # array('B')
+        self.durations_ms = durations_ms  # array('I'), 0 where not given; None if not collected
+
+    @classmethod
+    def from_events(cls, events: Sequence[MusicEvent], durations: bool = False) -> "NoteSequence":
+        """Sort events by onset (stable) into a sequence; durations=True also collects dur_ms"""
+        if durations:
+            return cls._from_events_with_durations(events)
+        onsets, notes, velocities = [], [], []
+        add_onset, add_note, add_velocity = onsets.append, notes.append, velocities.append
+        for event in events:
+            # MusicEvent.onset_ms, inlined: this loop is the whole conversion cost
+            t_ms = event.t_ms
+            add_onset(t_ms if t_ms is not None else event.t_sec * 1000)
+            add_note(event.note)
+            velocity = event.vel
+            add_velocity(velocity if velocity is not None else DEFAULT_VELOCITY)
+        # Clients send takes in order, so this is usually one linear check
+        if onsets != sorted(onsets):
+            order = sorted(range(len(onsets)), key=onsets.__getitem__)
+            onsets = [onsets[i] for i in order]
+            notes = [notes[i] for i in order]
+            velocities = [velocities[i] for i in order]
+        # bytes() packs small ints in C, faster than array('B', list)
+        return cls(array('q', onsets), array('B', bytes(notes)), array('B', bytes(velocities)))
+
+    @classmethod
+    def _from_events_with_durations(cls, events: Sequence[MusicEvent]) -> "NoteSequence":
+        items = sorted(
+            ((event.onset_ms, event.note, event.vel or DEFAULT_VELOCITY, event.dur_ms or 0) for event in events),
+            key=lambda item: item[0]
+        )
+        return cls(array('q', (item[0] for item in items)), array('B', (item[1] for item in items)),
+                   array('B', (item[2] for item in items)), array('I', (item[3] for item in items)))
+
+    @classmethod
+    def of(cls, events: Union[Sequence[MusicEvent], "NoteSequence"]) -> "NoteSequence":
+        """The events as a sequence; a NoteSequence is returned as is"""
+        return events if isinstance(events, cls) else cls.from_events(events)
+
+    def __len__(self) -> int:
+        return len(self.onsets_ms)
+
+    def seconds(self) -> List[int]:
+        """Whole-second slot of each note (MusicEvent.t_sec)"""
+        return [onset // 1000 for onset in self.onsets_ms]
+
+    def slots(self, duration_sec: int) -> Dict[int, int]:
+        """Second -> note for the seconds before duration_sec; the last onset in a second wins"""
+        count = bisect_left(self.onsets_ms, duration_sec * 1000)
+        if not count:
+            return {}
+        seconds = np.frombuffer(self.onsets_ms, dtype=np.int64, count=count) // 1000
+        # Onsets are sorted, so a second's last note is the one before the second changes
+        last = np.flatnonzero(np.diff(seconds, append=duration_sec))
+        notes = np.frombuffer(self.notes, dtype=np.uint8, count=count)
+        return dict(zip(seconds[last].tolist(), notes[last].tolist()))
+
+    def onset_ticks(self, ticks_per_beat: int) -> List[int]:
+        """Absolute tick of each note, one beat per second"""
+        return [onset * ticks_per_beat // 1000 for onset in self.onsets_ms]
@@ -0,0 +1,272 @@
+"""
+CPU-bound work off the event loop, with admission control
+
+MIDI encoding and scoring run on a bounded pool of worker threads or
+processes instead of inline in the async endpoints, so one long request
+no longer stalls every other connection on the worker. Calls beyond the
+pool size wait in a FIFO queue:
+
+- queue full: rejected at once with 429 and a Retry-After estimate
+- waited longer than the queue timeout: rejected with 503
+
+Queue depth, running calls, wait times and rejections are reported on
+/metrics and by WorkPool.stats().
+
+Process pools cannot share the server's generator (its storage writer
+runs a thread) or the watched reference index, so each pool process
+builds its own: the generator does not save local copies (the caller
+does), and the index is re-checked for changes at most once per
+reload interval. Stage timings recorded inside pool processes do not
+reach /metrics.
+"""
+import asyncio
+import contextvars
+import functools
+import logging
+import math
+import multiprocessing
+import time
+from collections import deque
+from concurrent.futures import BrokenExecutor, Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+import config
+import metrics
+from midi_utils import Events, MidiGenerator, MusicEvaluator, NoteSpan
+from models import HarmonyModeEnum, KeyEnum
+from reference_index import ReferenceIndex
+
+logger = logging.getLogger(__name__)
+
+POOL_THREAD = "thread"
+POOL_PROCESS = "process"
+POOL_INLINE = "inline"  # Run on the event loop, as before; no admission control
+POOL_KINDS = (POOL_THREAD, POOL_PROCESS, POOL_INLINE)
+
+# Initial service time estimate for Retry-After, before any call has finished
+_INITIAL_SERVICE_SEC = 0.05
+_SERVICE_SMOOTHING = 0.2
+
+# Services used by the task functions. In the server process they are the
+# ones bound by the application; pool processes create their own.
+_generator: Optional[MidiGenerator] = None
+_evaluator: Optional[MusicEvaluator] = None
+_last_reload_check = 0.0
+
+
+def bind(generator: MidiGenerator, evaluator: MusicEvaluator):
+    """Use the server's generator and evaluator for thread and inline pools"""
+    global _generator, _evaluator
+    _generator, _evaluator = generator, evaluator
+
+
+def _get_generator() -> MidiGenerator:
+    global _generator
+    if _generator is None:
+        _generator = MidiGenerator(encoder=config.MIDI_ENCODER)
+    return _generator
+
+
+def _get_evaluator() -> MusicEvaluator:
+    global _evaluator, _last_reload_check
+    if _evaluator is None:
+        _evaluator = MusicEvaluator(reference_index=ReferenceIndex(config.REFERENCE_DIR))
+        _last_reload_check = time.monotonic()
+    elif config.REFERENCE_RELOAD_SEC > 0 and time.monotonic() - _last_reload_check >= config.REFERENCE_RELOAD_SEC:
+        _last_reload_check = time.monotonic()
+        _evaluator.reference_templates.index.reload_if_changed()
+    return _evaluator
+
+
+def harmonize_task(events: Events, duration_sec: int, key: KeyEnum,
+                   harmony_mode: HarmonyModeEnum) -> Tuple[bytes, List[Dict]]:
+    return _get_generator().create_harmonized_midi(
+        events=events, duration_sec=duration_sec, key=key, harmony_mode=harmony_mode
+    )
+
+
+def note_spans_task(events: Events, duration_sec: int, key: KeyEnum,
+                    harmony_mode: HarmonyModeEnum) -> List[NoteSpan]:
+    return _get_generator().note_spans(events, duration_sec, key=key, harmony_mode=harmony_mode)
+
+
+def evaluate_task(method: str, kwargs: Dict[str, Any]) -> Any:
+    """Call a MusicEvaluator method (evaluate_performance, evaluate_aligned, evaluate_polyphonic, evaluate_batch)"""
+    return getattr(_get_evaluator(), method)(**kwargs)
+
+
+class Overloaded(Exception):
+    """Raised when admission control turns a call away"""
+
+    def __init__(self, status_code: int, error_code: str, message: str, retry_after: int):
+        super().__init__(message)
+        self.status_code = status_code
+        self.error_code = error_code
+        self.retry_after = retry_after
+
+
+class WorkPool:
+    """Bounded executor with a FIFO admission queue"""
+
+    def __init__(self, kind: str = POOL_THREAD, workers: int = 4, queue_size: int = 64,
+                 queue_timeout: float = 5.0):
+        """
+        Args:
+            kind: "thread", "process" or "inline"
+            workers: Calls running at once
+            queue_size: Calls allowed to wait for a worker; more are rejected with 429
+            queue_timeout: Seconds a call may wait before it is rejected with 503
+        """
+        if kind not in POOL_KINDS:
+            raise ValueError(f"Unknown offload pool: {kind}")
+        self.kind = kind
+        self.workers = max(1, workers)
+        self.queue_size = max(0, queue_size)
+        self.queue_timeout = queue_timeout
+        self._executor: Optional[Executor] = None
+        self._running = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._service_sec = _INITIAL_SERVICE_SEC
+        self._counts = {"started": 0, "completed": 0, "rejected_full": 0, "rejected_timeout": 0}
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._report_depth()
+
+    @property
+    def isolated(self) -> bool:
+        """True when calls run in other processes, without the server's services"""
+        return self.kind == POOL_PROCESS
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            if self.kind == POOL_PROCESS:
+                # spawn keeps workers clean of the server's threads and sockets
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn")
+                )
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="offload")
+        return self._executor
+
+    def _report_depth(self):
+        if metrics.enabled:
+            metrics.OFFLOAD_QUEUE_DEPTH.set(len(self._waiters))
+            metrics.OFFLOAD_RUNNING.set(self._running)
+
+    def _retry_after(self) -> int:
+        """Seconds until the queue ahead of a new call should have drained"""
+        backlog = len(self._waiters) + self._running
+        return max(1, math.ceil(self._service_sec * backlog / self.workers))
+
+    def _reject(self, status_code: int, reason: str, message: str):
+        self._counts[f"rejected_{reason}"] += 1
+        if metrics.enabled:
+            metrics.OFFLOAD_REJECTED.inc(metrics.endpoint_name(), reason)
+        error_code = "server_busy" if reason == "full" else "queue_timeout"
+        raise Overloaded(status_code, error_code, message, self._retry_after())
+
+    async def _acquire(self):
+        """Take a worker slot, waiting in line if all are busy"""
+        if self._running < self.workers and not self._waiters:
+            self._running += 1
+            return
+        if len(self._waiters) >= self.queue_size:
+            self._reject(429, "full", "Server busy: work queue is full")
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self._report_depth()
+        try:
+            await asyncio.wait_for(waiter, self.queue_timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was handed over just as the wait ended; pass it on
+                self._release()
+            else:
+                try:
+                    self._waiters.remove(waiter)
+                except ValueError:
+                    pass
+                self._report_depth()
+            if isinstance(e, asyncio.TimeoutError):
+                self._reject(503, "timeout", "Server busy: timed out waiting for a worker")
+            raise
+
+    def _release(self):
+        """Hand the slot to the next waiter, or free it"""
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                self._report_depth()
+                return
+        self._running -= 1
+        self._report_depth()
+
+    async def run(self, func: Callable, *args) -> Any:
+        """
+        Run func(*args) on the pool
+
+        For process pools func and args must be picklable, so pass the
+        module-level task functions above.
+
+        Raises:
+            Overloaded: The queue is full, or the call waited too long
+        """
+        if self.kind == POOL_INLINE:
+            return func(*args)
+
+        enqueued = time.perf_counter()
+        await self._acquire()
+        try:
+            started = time.perf_counter()
+            wait = started - enqueued
+            self._counts["started"] += 1
+            self._wait_total += wait
+            self._wait_max = max(self._wait_max, wait)
+            if metrics.enabled:
+                metrics.OFFLOAD_WAIT.observe(wait, metrics.endpoint_name())
+
+            loop = asyncio.get_running_loop()
+            if self.kind == POOL_THREAD:
+                # Carry the request context (metrics endpoint) into the thread
+                call = functools.partial(contextvars.copy_context().run, func, *args)
+            else:
+                call = functools.partial(func, *args)
+            executor = self._get_executor()
+            try:
+                result = await loop.run_in_executor(executor, call)
+            except BrokenExecutor:
+                # A crashed process breaks the pool; start a fresh one for the next call
+                if self._executor is executor:
+                    executor.shutdown(wait=False, cancel_futures=True)
+                    self._executor = None
+                raise
+
+            elapsed = time.perf_counter() - started
+            self._service_sec += (elapsed - self._service_sec) * _SERVICE_SMOOTHING
+            self._counts["completed"] += 1
+            return result
+        finally:
+            self._release()
+
+    def stats(self) -> Dict:
+        started = self._counts["started"]
+        return {
+            "kind": self.kind,
+            "workers": self.workers,
+            "queue_size": self.queue_size,
+            "queue_timeout_sec": self.queue_timeout,
+            "running": self._running,
+            "queued": len(self._waiters),
+            **self._counts,
+            "avg_wait_ms": round(self._wait_total / started * 1000, 3) if started else 0.0,
+            "max_wait_ms": round(self._wait_max * 1000, 3),
+            "avg_service_ms": round(self._service_sec * 1000, 3),
+        }
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
@@ -0,0 +1,187 @@
+"""
+Packed binary request format
+
+For large takes, parsing one JSON object and one pydantic model per note
+costs more than generating the answer. A packed request carries the same
+fields in a compact body (Content-Type: application/vnd.harmony.events):
+
+    magic        4 bytes   b"HEV1"
+    header_len   uint32    length of the JSON header
+    header       JSON      every request field except "events"
+    count        uint32    number of events
+    onset_ms     uint32[count]
+    note         uint8[count]
+    vel          uint8[count]   0 selects the default velocity
+
+All integers are little-endian. The header is validated by the matching
+*Settings model, the columns are checked in bulk with NumPy (range, white
+keys, duplicate grid slots; in polyphonic evaluation a slot may repeat with
+different notes) and the events are then built without running
+per-note validators. Failures raise the same pydantic ValidationError the
+JSON body would, so error codes do not change.
+"""
+import json
+import struct
+from typing import List, Optional, Type
+
+import numpy as np
+from pydantic import BaseModel, ValidationError
+
+from models import (
+    DEFAULT_VELOCITY, MAX_DURATION_MS, MAX_ONSET_MS, QUANTIZE_MS, WHITE_KEYS, EvaluationModeEnum, MusicEvent
+)
+
+CONTENT_TYPE = "application/vnd.harmony.events"
+MAGIC = b"HEV1"
+
+_U32 = struct.Struct("<I")
+
+# Note number -> allowed, for all 256 uint8 values
+_WHITE_KEY_TABLE = np.zeros(256, dtype=bool)
+_WHITE_KEY_TABLE[sorted(WHITE_KEYS)] = True
+
+
+def _invalid(title: str, loc: tuple, error_type: str, value, **ctx) -> ValidationError:
+    """Build the ValidationError the JSON path raises for the same input"""
+    error = {"type": error_type, "loc": loc, "input": value}
+    if ctx:
+        error["ctx"] = ctx
+    return ValidationError.from_exception_data(title, [error])
+
+
+def _value_error(title: str, loc: tuple, value, message: str) -> ValidationError:
+    return _invalid(title, loc, "value_error", value, error=ValueError(message))
+
+
+def encode(header: dict, onsets_ms: List[int], notes: List[int], vels: List[int] = None) -> bytes:
+    """Pack a request (used by clients and tools)"""
+    header_bytes = json.dumps(header).encode()
+    count = len(onsets_ms)
+    if vels is None:
+        vels = [0] * count
+    return b"".join((
+        MAGIC,
+        _U32.pack(len(header_bytes)),
+        header_bytes,
+        _U32.pack(count),
+        np.asarray(onsets_ms, dtype="<u4").tobytes(),
+        np.asarray(notes, dtype=np.uint8).tobytes(),
+        np.asarray(vels, dtype=np.uint8).tobytes(),
+    ))
+
+
+def decode(body: bytes, request_cls: Type[BaseModel], settings_cls: Type[BaseModel],
+           event_cls: Type[MusicEvent] = MusicEvent, max_onset_ms: int = MAX_ONSET_MS) -> BaseModel:
+    """
+    Parse and validate a packed request into request_cls
+
+    Raises:
+        ValueError: Malformed body
+        ValidationError: Invalid header fields or events
+    """
+    view = memoryview(body)
+    if len(view) < 8 or view[:4] != MAGIC:
+        raise ValueError("Malformed packed events: bad magic")
+    (header_len,) = _U32.unpack_from(view, 4)
+    pos = 8 + header_len
+    if len(view) < pos + 4:
+        raise ValueError("Malformed packed events: truncated header")
+    try:
+        header = json.loads(bytes(view[8:pos]))
+    except ValueError:
+        raise ValueError("Malformed packed events: header is not JSON")
+    if not isinstance(header, dict):
+        raise ValueError("Malformed packed events: header is not an object")
+
+    settings = settings_cls.model_validate(header)
+
+    (count,) = _U32.unpack_from(view, pos)
+    pos += 4
+    if len(view) != pos + count * 6:
+        raise ValueError("Malformed packed events: column size mismatch")
+
+    onsets = np.frombuffer(view, dtype="<u4", count=count, offset=pos)
+    notes = np.frombuffer(view, dtype=np.uint8, count=count, offset=pos + count * 4)
+    vels = np.frombuffer(view, dtype=np.uint8, count=count, offset=pos + count * 5)
+    return build_request(request_cls, settings, onsets, notes, vels, event_cls, max_onset_ms)
+
+
+def build_request(request_cls: Type[BaseModel], settings: BaseModel, onsets: np.ndarray, notes: np.ndarray,
+                  vels: np.ndarray, event_cls: Type[MusicEvent] = MusicEvent,
+                  max_onset_ms: int = MAX_ONSET_MS, durations: Optional[np.ndarray] = None) -> BaseModel:
+    """
+    Validate event columns in bulk and combine them with validated settings
+    Also used for events read from uploaded MIDI files, which may add held
+    lengths (durations, ms, 0 = not given).
+
+    Raises:
+        ValidationError: Invalid events, reported like the JSON path
+    """
+    title = request_cls.__name__
+    count = len(onsets)
+    if count == 0:
+        raise _invalid(title, ("events",), "too_short", [], field_type="List", min_length=1, actual_length=0)
+
+    # Range checks report the first offending event, like the JSON path
+    bad = np.flatnonzero(onsets > max_onset_ms)
+    if bad.size:
+        i = int(bad[0])
+        raise _invalid(title, ("events", i, "t_ms"), "less_than_equal", int(onsets[i]), le=max_onset_ms)
+    bad = np.flatnonzero(~_WHITE_KEY_TABLE[notes])
+    if bad.size:
+        i = int(bad[0])
+        raise _value_error(title, ("events", i, "note"), int(notes[i]),
+                           f"Note must be one of C major white keys: {WHITE_KEYS}")
+    bad = np.flatnonzero(vels > 127)
+    if bad.size:
+        i = int(bad[0])
+        raise _invalid(title, ("events", i, "vel"), "less_than_equal", int(vels[i]), le=127)
+    if durations is not None:
+        bad = np.flatnonzero(durations > MAX_DURATION_MS)
+        if bad.size:
+            i = int(bad[0])
+            raise _invalid(title, ("events", i, "dur_ms"), "less_than_equal", int(durations[i]), le=MAX_DURATION_MS)
+
+    grid_ms = QUANTIZE_MS.get(getattr(settings, "quantize", None), 1000)
+    slots = onsets.astype(np.int64) // grid_ms
+    if getattr(settings, "evaluation_mode", None) == EvaluationModeEnum.POLYPHONIC:
+        # Chords share a slot; the same note twice in one slot is still a duplicate
+        slots = slots * 128 + notes
+    if np.unique(slots).size != count:
+        raise _value_error(title, ("events",), None, "Duplicate timeslot")
+
+    events = _build_events(event_cls, onsets.tolist(), notes.tolist(), vels.tolist(),
+                           durations.tolist() if durations is not None else None)
+    return request_cls.model_construct(**dict(settings), events=events)
+
+
+def _build_events(event_cls: Type[MusicEvent], onsets: List[int], notes: List[int], vels: List[int],
+                  durations: Optional[List[int]] = None) -> List[MusicEvent]:
+    """
+    Create already-validated events without running validators
+    Same result as event_cls.model_construct(...) per event, which costs more
+    than full validation for a model this small; this sets the pydantic 2
+    instance slots directly instead.
+    """
+    new = event_cls.__new__
+    set_attr = object.__setattr__
+    fields_set = {'t_sec', 't_ms', 'note', 'vel'}
+    if durations is None:
+        durations = [0] * len(onsets)
+    else:
+        fields_set.add('dur_ms')
+    events = []
+    for onset, note, vel, duration in zip(onsets, notes, vels, durations):
+        event = new(event_cls)
+        set_attr(event, '__dict__', {
+            't_sec': onset // 1000,
+            't_ms': onset,
+            'note': note,
+            'vel': vel or DEFAULT_VELOCITY,
+            'dur_ms': duration or None,
+        })
+        set_attr(event, '__pydantic_fields_set__', set(fields_set))
+        set_attr(event, '__pydantic_extra__', None)
+        set_attr(event, '__pydantic_private__', None)
+        events.append(event)
+    return events
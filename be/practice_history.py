@@ -0,0 +1,377 @@
+"""
+Practice history of evaluation results
+
+Evaluate endpoints hand every result to PracticeHistory.record(), which
+only enqueues it. A single writer thread drains the bounded queue in
+batches and commits each batch as one SQLite transaction (WAL journal,
+so the aggregate endpoints keep reading while it writes).
+
+Tables:
+- evaluations: one row per graded take (score, subscores, mistake count),
+  indexed by (user_id, reference_id, created_at) and (reference_id, created_at)
+- mistakes: the take's mistakes, indexed by evaluation_id
+- daily_scores / slot_mistakes: rollups kept up to date by the writer, per
+  (user_id, reference_id) and for all users together (user_id "*")
+
+Trend and most-missed-slot queries read only the rollups, so their cost
+grows with the days practised and the length of the exercise, not with
+the number of stored takes. Results become visible once their batch is
+committed, normally within milliseconds of the response.
+"""
+import logging
+import queue
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+ALL_USERS = "*"
+ERROR_TYPES = ("wrong_note", "missing_note", "extra_note")
+SECONDS_PER_DAY = 86400
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS evaluations (
+    id INTEGER PRIMARY KEY,
+    user_id TEXT,
+    reference_id TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    evaluation_mode TEXT NOT NULL,
+    duration_sec INTEGER NOT NULL,
+    score REAL NOT NULL,
+    accuracy REAL NOT NULL,
+    timing REAL NOT NULL,
+    mistake_count INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS evaluations_user
+    ON evaluations (user_id, reference_id, created_at, score);
+CREATE INDEX IF NOT EXISTS evaluations_reference
+    ON evaluations (reference_id, created_at, score);
+
+CREATE TABLE IF NOT EXISTS mistakes (
+    evaluation_id INTEGER NOT NULL REFERENCES evaluations (id),
+    time_sec INTEGER NOT NULL,
+    error_type TEXT NOT NULL,
+    expected_note INTEGER,
+    played_note INTEGER
+);
+CREATE INDEX IF NOT EXISTS mistakes_evaluation ON mistakes (evaluation_id);
+
+CREATE TABLE IF NOT EXISTS daily_scores (
+    user_id TEXT NOT NULL,
+    reference_id TEXT NOT NULL,
+    day INTEGER NOT NULL,
+    attempts INTEGER NOT NULL,
+    score_sum REAL NOT NULL,
+    best_score REAL NOT NULL,
+    PRIMARY KEY (user_id, reference_id, day)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS slot_mistakes (
+    user_id TEXT NOT NULL,
+    reference_id TEXT NOT NULL,
+    time_sec INTEGER NOT NULL,
+    wrong_note INTEGER NOT NULL,
+    missing_note INTEGER NOT NULL,
+    extra_note INTEGER NOT NULL,
+    PRIMARY KEY (user_id, reference_id, time_sec)
+) WITHOUT ROWID;
+"""
+
+_UPSERT_DAY = """
+INSERT INTO daily_scores (user_id, reference_id, day, attempts, score_sum, best_score)
+VALUES (?, ?, ?, ?, ?, ?)
+ON CONFLICT (user_id, reference_id, day) DO UPDATE SET
+    attempts = attempts + excluded.attempts,
+    score_sum = score_sum + excluded.score_sum,
+    best_score = max(best_score, excluded.best_score)
+"""
+
+_UPSERT_SLOT = """
+INSERT INTO slot_mistakes (user_id, reference_id, time_sec, wrong_note, missing_note, extra_note)
+VALUES (?, ?, ?, ?, ?, ?)
+ON CONFLICT (user_id, reference_id, time_sec) DO UPDATE SET
+    wrong_note = wrong_note + excluded.wrong_note,
+    missing_note = missing_note + excluded.missing_note,
+    extra_note = extra_note + excluded.extra_note
+"""
+
+
+def _date(day: int) -> str:
+    return datetime.fromtimestamp(day * SECONDS_PER_DAY, timezone.utc).date().isoformat()
+
+
+class PracticeHistory:
+    """Bounded, batched, non-blocking recorder of evaluation results, with aggregate queries"""
+
+    def __init__(self, path: str = "practice_history.sqlite3", enabled: bool = True,
+                 queue_size: int = 4096, batch_size: int = 256):
+        """
+        Args:
+            path: SQLite database file
+            enabled: When False, record() is a no-op and queries raise
+            queue_size: Pending results kept before new ones are dropped
+            batch_size: Maximum results committed per transaction
+        """
+        self.path = path
+        self.enabled = enabled
+        self.batch_size = max(1, batch_size)
+
+        self._queue = queue.Queue(maxsize=max(1, queue_size))
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._schema_lock = threading.Lock()
+        self._schema_ready = False
+        # One read connection per thread (sqlite3 connections are not shared)
+        self._readers = threading.local()
+
+        self.recorded = 0
+        self.dropped = 0
+        self.failed = 0
+
+    def record(self, user_id: Optional[str], reference_id: str, evaluation_mode: str,
+               duration_sec: int, result: Dict) -> bool:
+        """
+        Queue an evaluation result without blocking; user_id None records an anonymous take
+
+        Returns:
+            bool: False if disabled or dropped
+        """
+        if not self.enabled:
+            return False
+        self._ensure_started()
+        try:
+            self._queue.put_nowait((time.time(), user_id, reference_id, evaluation_mode, duration_sec, result))
+        except queue.Full:
+            self.dropped += 1
+            logger.warning(f"Practice history queue full, dropping result for {reference_id}")
+            return False
+        return True
+
+    def flush(self):
+        """Block until every queued result has been committed"""
+        if self._thread is not None:
+            self._queue.join()
+
+    def close(self, timeout: float = 5.0):
+        """Commit pending results and stop the writer thread"""
+        with self._start_lock:
+            thread, self._thread = self._thread, None
+        if thread is None:
+            return
+        self._queue.put(_STOP)
+        thread.join(timeout)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "queued": self._queue.qsize(),
+            "recorded": self.recorded,
+            "dropped": self.dropped,
+            "failed": self.failed,
+        }
+
+    # Queries (called from worker threads)
+
+    def progress(self, reference_id: str, user_id: str = ALL_USERS, days: int = 30,
+                 slots: int = 5, recent: int = 0) -> Dict:
+        """
+        Totals, daily trend over the last `days` days and the `slots` most-missed
+        time slots of one reference, for one user or all users (ALL_USERS)
+        """
+        db = self._reader()
+        attempts, score_sum, best_score = db.execute(
+            "SELECT coalesce(sum(attempts), 0), coalesce(sum(score_sum), 0), max(best_score) "
+            "FROM daily_scores WHERE user_id = ? AND reference_id = ?",
+            (user_id, reference_id)
+        ).fetchone()
+
+        first_day = int(time.time() // SECONDS_PER_DAY) - max(1, days) + 1
+        trend = [
+            {
+                "date": _date(day),
+                "attempts": day_attempts,
+                "average_score": round(day_sum / day_attempts, 1),
+                "best_score": day_best,
+            }
+            for day, day_attempts, day_sum, day_best in db.execute(
+                "SELECT day, attempts, score_sum, best_score FROM daily_scores "
+                "WHERE user_id = ? AND reference_id = ? AND day >= ? ORDER BY day",
+                (user_id, reference_id, first_day)
+            )
+        ]
+
+        most_missed = [
+            {"time_sec": time_sec, "wrong_note": wrong, "missing_note": missing,
+             "extra_note": extra, "total": wrong + missing + extra}
+            for time_sec, wrong, missing, extra in db.execute(
+                "SELECT time_sec, wrong_note, missing_note, extra_note FROM slot_mistakes "
+                "WHERE user_id = ? AND reference_id = ? "
+                "ORDER BY wrong_note + missing_note + extra_note DESC, time_sec LIMIT ?",
+                (user_id, reference_id, max(0, slots))
+            )
+        ]
+
+        progress = {
+            "reference_id": reference_id,
+            "attempts": attempts,
+            "average_score": round(score_sum / attempts, 1) if attempts else None,
+            "best_score": best_score,
+            "trend": trend,
+            "most_missed": most_missed,
+        }
+        if recent:
+            progress["recent"] = self._recent(db, user_id, reference_id, recent)
+        return progress
+
+    def user_summary(self, user_id: str) -> List[Dict]:
+        """One row per reference the user has practised, most recent first"""
+        rows = self._reader().execute(
+            "SELECT reference_id, sum(attempts), sum(score_sum), max(best_score), min(day), max(day) "
+            "FROM daily_scores WHERE user_id = ? GROUP BY reference_id ORDER BY max(day) DESC, reference_id",
+            (user_id,)
+        )
+        return [
+            {
+                "reference_id": reference_id,
+                "attempts": attempts,
+                "average_score": round(score_sum / attempts, 1),
+                "best_score": best_score,
+                "first_date": _date(first_day),
+                "last_date": _date(last_day),
+            }
+            for reference_id, attempts, score_sum, best_score, first_day, last_day in rows
+        ]
+
+    @staticmethod
+    def _recent(db: sqlite3.Connection, user_id: str, reference_id: str, limit: int) -> List[Dict]:
+        rows = db.execute(
+            "SELECT created_at, evaluation_mode, score, accuracy, timing, mistake_count FROM evaluations "
+            "WHERE user_id = ? AND reference_id = ? ORDER BY created_at DESC LIMIT ?",
+            (user_id, reference_id, limit)
+        )
+        return [
+            {
+                "created_at": datetime.fromtimestamp(created_at, timezone.utc).isoformat(timespec="seconds"),
+                "evaluation_mode": evaluation_mode,
+                "score": score,
+                "subscores": {"accuracy": accuracy, "timing": timing},
+                "mistakes": mistake_count,
+            }
+            for created_at, evaluation_mode, score, accuracy, timing, mistake_count in rows
+        ]
+
+    # Connections
+
+    def _connect(self) -> sqlite3.Connection:
+        db = sqlite3.connect(self.path, timeout=10.0, isolation_level=None)
+        db.execute("PRAGMA journal_mode=WAL")
+        # With WAL, NORMAL loses at most the last commits on power failure, never consistency
+        db.execute("PRAGMA synchronous=NORMAL")
+        with self._schema_lock:
+            if not self._schema_ready:
+                db.executescript(_SCHEMA)
+                self._schema_ready = True
+        return db
+
+    def _reader(self) -> sqlite3.Connection:
+        if not self.enabled:
+            raise RuntimeError("Practice history is disabled")
+        db = getattr(self._readers, "db", None)
+        if db is None:
+            db = self._readers.db = self._connect()
+            db.execute("PRAGMA query_only=ON")
+        return db
+
+    # Writer thread
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="practice-history", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        db = self._connect()
+        running = True
+        while running:
+            item = self._queue.get()
+            if item is _STOP:
+                self._queue.task_done()
+                break
+
+            # Drain whatever else is already waiting, up to one batch
+            batch = [item]
+            while len(batch) < self.batch_size:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    self._queue.task_done()
+                    running = False
+                    break
+                batch.append(item)
+
+            try:
+                self._write_batch(db, batch)
+                self.recorded += len(batch)
+            except Exception as e:
+                self.failed += len(batch)
+                logger.error(f"Practice history batch failed: {str(e)}")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+        db.close()
+
+    def _write_batch(self, db: sqlite3.Connection, batch):
+        mistake_rows = []
+        # Rollup deltas for the batch, merged before touching the tables
+        days = defaultdict(lambda: [0, 0.0, 0.0])
+        slot_counts = defaultdict(lambda: [0, 0, 0])
+
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            for created_at, user_id, reference_id, evaluation_mode, duration_sec, result in batch:
+                subscores = result["subscores"]
+                mistakes = result["mistakes"]
+                evaluation_id = db.execute(
+                    "INSERT INTO evaluations (user_id, reference_id, created_at, evaluation_mode, duration_sec, "
+                    "score, accuracy, timing, mistake_count) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (user_id, reference_id, created_at, evaluation_mode, duration_sec,
+                     result["score"], subscores["accuracy"], subscores["timing"], len(mistakes))
+                ).lastrowid
+
+                day = int(created_at // SECONDS_PER_DAY)
+                scopes = (ALL_USERS, user_id) if user_id else (ALL_USERS,)
+                for scope in scopes:
+                    totals = days[scope, reference_id, day]
+                    totals[0] += 1
+                    totals[1] += result["score"]
+                    totals[2] = max(totals[2], result["score"])
+
+                for mistake in mistakes:
+                    error_type = mistake["error_type"]
+                    mistake_rows.append((evaluation_id, mistake["time_sec"], error_type,
+                                         mistake["expected_note"], mistake["played_note"]))
+                    column = ERROR_TYPES.index(error_type)
+                    for scope in scopes:
+                        slot_counts[scope, reference_id, mistake["time_sec"]][column] += 1
+
+            db.executemany(
+                "INSERT INTO mistakes (evaluation_id, time_sec, error_type, expected_note, played_note) "
+                "VALUES (?, ?, ?, ?, ?)",
+                mistake_rows
+            )
+            db.executemany(_UPSERT_DAY, [(*key, *totals) for key, totals in days.items()])
+            db.executemany(_UPSERT_SLOT, [(*key, *counts) for key, counts in slot_counts.items()])
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
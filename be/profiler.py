@@ -0,0 +1,209 @@
+"""
+On-demand sampling profiler
+
+An admin starts a session that covers the next N harmonize/evaluate
+requests or T seconds, whichever ends first. While at least one of those
+requests is in flight, a sampler thread reads the Python stack of every
+thread with sys._current_frames() once per interval and counts it; threads
+parked in a wait (event loop polling, idle pool workers) are skipped.
+Stacks from all profiled requests are merged and returned collapsed, one
+line per distinct stack, root first:
+
+    offload;main.py:harmonize;midi_utils.py:MidiGenerator.create_harmonized_midi 42
+
+flamegraph.pl, speedscope and inferno read this as is.
+
+While no session runs the cost is one attribute check per request in
+ProfilerMiddleware. Work in other processes (process offload pool, batch
+workers) is not sampled.
+"""
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from types import CodeType
+from typing import Dict, Optional
+
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+logger = logging.getLogger(__name__)
+
+PROFILED_PREFIXES = ("/api/v1/harmonize", "/api/v1/evaluate")
+
+# Leaf frames of threads that are waiting, not running: (file, function)
+_IDLE_LEAVES = {
+    ("selectors.py", "select"),  # Event loop polling
+    ("threading.py", "wait"),    # Condition/Event waits (AnyIO workers, storage writer)
+    ("thread.py", "_worker"),    # ThreadPoolExecutor worker blocked on its queue
+}
+
+_code_labels: Dict[CodeType, str] = {}
+
+
+def _frame_label(code: CodeType) -> str:
+    label = _code_labels.get(code)
+    if label is None:
+        # co_qualname is new in Python 3.11
+        name = getattr(code, "co_qualname", code.co_name)
+        label = _code_labels[code] = f"{os.path.basename(code.co_filename)}:{name}"
+    return label
+
+
+def _thread_labels() -> Dict[int, str]:
+    # Pool threads are numbered (offload_0, offload_1); merge them into one root
+    return {thread.ident: re.sub(r"[_-]\d+$", "", thread.name) for thread in threading.enumerate()}
+
+
+class ProfileSession:
+    """One profiling run and the stacks it collected"""
+
+    def __init__(self, duration_sec: float, max_requests: Optional[int] = None, interval_sec: float = 0.005):
+        self.duration_sec = duration_sec
+        self.max_requests = max_requests
+        self.interval_sec = interval_sec
+        self.started = time.monotonic()
+        self.ended: Optional[float] = None
+        self.end_reason: Optional[str] = None
+        self.requests_started = 0
+        self.requests_done = 0
+        self.in_flight = 0
+        self.samples = 0
+        self._stacks: Counter = Counter()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample_loop, name="profiler", daemon=True)
+        self._thread.start()
+
+    @property
+    def running(self) -> bool:
+        return self.ended is None
+
+    def admit(self) -> bool:
+        """Count a request into the session; False once it is full or over"""
+        with self._lock:
+            if not self.running:
+                return False
+            if self.max_requests is not None and self.requests_started >= self.max_requests:
+                return False
+            self.requests_started += 1
+            self.in_flight += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self.in_flight -= 1
+            self.requests_done += 1
+            full = self.max_requests is not None and self.requests_done >= self.max_requests
+        if full:
+            self.finish("requests")
+
+    def finish(self, reason: str = "stopped"):
+        with self._lock:
+            if self.ended is not None:
+                return
+            self.ended = time.monotonic()
+            self.end_reason = reason
+        self._stop.set()
+
+    def _sample_loop(self):
+        deadline = self.started + self.duration_sec
+        try:
+            while not self._stop.wait(self.interval_sec):
+                if time.monotonic() >= deadline:
+                    self.finish("duration")
+                    return
+                if self.in_flight:
+                    self._sample()
+        except Exception as e:
+            # End the session so a new one can start
+            logger.error(f"Profiler sampling failed: {str(e)}")
+            self.finish("error")
+
+    def _sample(self):
+        own = threading.get_ident()
+        thread_labels = None
+        stacks = []
+        for ident, frame in sys._current_frames().items():
+            code = frame.f_code
+            if ident == own or (os.path.basename(code.co_filename), code.co_name) in _IDLE_LEAVES:
+                continue
+            labels = []
+            while frame is not None:
+                labels.append(_frame_label(frame.f_code))
+                frame = frame.f_back
+            if thread_labels is None:
+                thread_labels = _thread_labels()
+            labels.append(thread_labels.get(ident, "thread"))
+            labels.reverse()
+            stacks.append(";".join(labels))
+        with self._lock:
+            self._stacks.update(stacks)
+            self.samples += 1
+
+    def collapsed(self) -> str:
+        """Collapsed stacks ("frame;frame;frame count" per line)"""
+        with self._lock:
+            stacks = sorted(self._stacks.items())
+        return "".join(f"{stack} {count}\n" for stack, count in stacks)
+
+    def status(self) -> Dict:
+        end = self.ended if self.ended is not None else time.monotonic()
+        with self._lock:
+            distinct_stacks = len(self._stacks)
+        return {
+            "state": "running" if self.running else "finished",
+            "end_reason": self.end_reason,
+            "elapsed_sec": round(end - self.started, 3),
+            "duration_sec": self.duration_sec,
+            "max_requests": self.max_requests,
+            "requests": self.requests_done,
+            "in_flight": self.in_flight,
+            "interval_ms": self.interval_sec * 1000,
+            "samples": self.samples,
+            "distinct_stacks": distinct_stacks,
+        }
+
+
+# The running session, or the last one until a new one starts
+session: Optional[ProfileSession] = None
+
+
+def start(duration_sec: float, max_requests: Optional[int] = None, interval_ms: float = 5.0) -> ProfileSession:
+    """
+    Start a profiling session
+
+    Raises:
+        RuntimeError: A session is already running
+    """
+    global session
+    if session is not None and session.running:
+        raise RuntimeError("A profiling session is already running")
+    session = ProfileSession(duration_sec, max_requests, interval_ms / 1000)
+    return session
+
+
+def stop() -> Optional[ProfileSession]:
+    if session is not None:
+        session.finish()
+    return session
+
+
+class ProfilerMiddleware:
+    """ASGI middleware counting harmonize/evaluate requests into the running session"""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        active = session
+        if (active is None or not active.running or scope["type"] != "http"
+                or not scope["path"].startswith(PROFILED_PREFIXES) or not active.admit()):
+            await self.app(scope, receive, send)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            active.release()
@@ -0,0 +1,239 @@
+"""
+Reference template index
+
+Exercises live as files in a reference directory:
+- <id>.json: {"id", "name", "description", "notes": [{"t_sec": 0, "note": 60}, ...]}
+  (a note may give "t_ms" instead of "t_sec" for sub-second onsets and
+  "dur_ms" for its held length; notes sharing an onset form a chord)
+- <id>.mid: notes of a MIDI file, one beat per second (as generated here),
+  with lengths from their note-offs
+
+At startup every file is compiled into a CompiledReference holding sorted
+onset/note arrays (milliseconds, first note of each onset), a one-second
+slot view and an interval index over every note for polyphonic
+evaluation, and the index
+maps ids to them for O(1) lookup. A watcher thread polls the directory and
+swaps in a freshly compiled index when files change, so workers pick up new
+exercises without restarting.
+"""
+import json
+import logging
+import os
+import threading
+from array import array
+from bisect import bisect_left
+from types import MappingProxyType
+from typing import Dict, List, Mapping, Optional, Tuple
+
+import mido
+
+from interval_index import IntervalIndex
+
+logger = logging.getLogger(__name__)
+
+
+class CompiledReference:
+    """One exercise: sorted onsets (ms) with their target notes, a per-second slot view and an interval index"""
+
+    __slots__ = ('id', 'name', 'description', 'onsets_ms', 'onset_notes', 'times', 'notes', 'template', 'intervals')
+
+    def __init__(self, reference_id: str, name: str, description: str, notes: List[Tuple[int, int, int]]):
+        """
+        Args:
+            notes: (onset ms, note, length ms or 0 if unknown) in file order;
+                   the first note at an onset is its melody note
+        """
+        # Stable sort: notes sharing an onset keep their file order
+        notes = sorted(notes, key=lambda item: item[0])
+        self.id = reference_id
+        self.name = name
+        self.description = description
+        self.intervals = IntervalIndex(
+            array('I', (t for t, _, _ in notes)),
+            array('I', (t + length for t, _, length in notes)),
+            array('B', (n for _, n, _ in notes))
+        )
+
+        # Onset view used by aligned evaluation: first note at each onset
+        onsets = {}
+        for onset_ms, note, _ in notes:
+            onsets.setdefault(onset_ms, note)
+        onsets = sorted(onsets.items())
+        self.onsets_ms = array('I', (t for t, _ in onsets))
+        self.onset_notes = array('B', (n for _, n in onsets))
+
+        # Slot view used by slot evaluation: first note in each second
+        slots = {}
+        for onset_ms, note in onsets:
+            slots.setdefault(onset_ms // 1000, note)
+        self.times = array('H', slots.keys())
+        self.notes = array('B', slots.values())
+        # Read-only seconds -> note view for per-slot lookups
+        self.template: Mapping[int, int] = MappingProxyType(slots)
+
+    def count_before(self, duration_sec: int) -> int:
+        """Number of reference slots starting before duration_sec"""
+        return bisect_left(self.times, duration_sec)
+
+    def onsets_before(self, limit_ms: int) -> int:
+        """Number of reference notes with an onset before limit_ms"""
+        return bisect_left(self.onsets_ms, limit_ms)
+
+    def summary(self) -> Dict:
+        return {
+            "id": self.id,
+            "name": self.name,
+            "description": self.description,
+            "note_count": len(self.intervals),
+            "polyphonic": len(self.intervals) > len(self.onsets_ms),
+        }
+
+
+def _check_notes(notes: List[Tuple[int, int, int]]):
+    seen = set()
+    for onset_ms, note, length_ms in notes:
+        if not (isinstance(onset_ms, int) and 0 <= onset_ms <= 0xFFFF * 1000):
+            raise ValueError(f"invalid onset {onset_ms!r}")
+        if not (isinstance(note, int) and 0 <= note <= 127):
+            raise ValueError(f"invalid note {note!r}")
+        if not (isinstance(length_ms, int) and 0 <= length_ms <= 0xFFFF * 1000):
+            raise ValueError(f"invalid length {length_ms!r}")
+        if (onset_ms, note) in seen:
+            raise ValueError(f"duplicate note {note} at {onset_ms} ms")
+        seen.add((onset_ms, note))
+
+
+def compile_json(path: str) -> CompiledReference:
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    reference_id = data.get("id") or os.path.splitext(os.path.basename(path))[0]
+    notes = [
+        (item["t_ms"] if "t_ms" in item else item["t_sec"] * 1000, item["note"], item.get("dur_ms", 0))
+        for item in data["notes"]
+    ]
+    _check_notes(notes)
+    return CompiledReference(reference_id, data.get("name", reference_id), data.get("description", ""), notes)
+
+
+def compile_midi(path: str) -> CompiledReference:
+    mid = mido.MidiFile(path)
+    reference_id = os.path.splitext(os.path.basename(path))[0]
+    name = reference_id
+    # One beat per second, matching MidiGenerator's timeline
+    to_ms = lambda ticks: round(ticks * 1000 / mid.ticks_per_beat)
+    notes = {}  # (onset ms, note) -> [onset tick, end tick or None]; first of a pair wins
+    for track in mid.tracks:
+        ticks = 0
+        sounding = {}  # (channel, note) -> entry in notes
+        for msg in track:
+            ticks += msg.time
+            if msg.type == 'track_name' and name == reference_id:
+                name = msg.name
+            elif msg.type in ('note_on', 'note_off'):
+                # A note-on also ends the key's previous note (re-strike)
+                held = sounding.pop((msg.channel, msg.note), None)
+                if held is not None and held[1] is None:
+                    held[1] = ticks
+                if msg.type == 'note_on' and msg.velocity > 0:
+                    entry = notes.setdefault((to_ms(ticks), msg.note), [ticks, None])
+                    sounding[(msg.channel, msg.note)] = entry
+    notes = [
+        (onset_ms, note, to_ms(end) - onset_ms if end is not None else 0)
+        for (onset_ms, note), (_, end) in notes.items()
+    ]
+    _check_notes(notes)
+    return CompiledReference(reference_id, name, "", notes)
+
+
+_COMPILERS = {".json": compile_json, ".mid": compile_midi, ".midi": compile_midi}
+
+
+class ReferenceIndex:
+    """Id -> CompiledReference map built from a directory, optionally hot-reloaded"""
+
+    def __init__(self, directory: str, reload_interval: float = 0.0):
+        """
+        Args:
+            directory: Directory holding the exercise files
+            reload_interval: Seconds between change checks; 0 disables reloading
+        """
+        self.directory = directory
+        self.reload_interval = reload_interval
+        self._references: Dict[str, CompiledReference] = {}
+        self._listing: List[Dict] = []
+        self._signature = None
+        self._stop = threading.Event()
+        self._thread = None
+        self.load()
+
+    def _scan(self) -> Tuple:
+        """Cheap directory fingerprint: (name, mtime, size) of every exercise file"""
+        try:
+            with os.scandir(self.directory) as it:
+                return tuple(sorted(
+                    (entry.name, entry.stat().st_mtime_ns, entry.stat().st_size)
+                    for entry in it
+                    if entry.is_file() and os.path.splitext(entry.name)[1].lower() in _COMPILERS
+                ))
+        except FileNotFoundError:
+            return ()
+
+    def load(self):
+        """Compile every file and atomically replace the current index"""
+        signature = self._scan()
+        references = {}
+        for name, _, _ in signature:
+            path = os.path.join(self.directory, name)
+            try:
+                reference = _COMPILERS[os.path.splitext(name)[1].lower()](path)
+            except Exception as e:
+                logger.error(f"Skipping reference file {path}: {str(e)}")
+                continue
+            if reference.id in references:
+                logger.warning(f"Duplicate reference id {reference.id} in {path}, replacing")
+            references[reference.id] = reference
+
+        listing = [references[reference_id].summary() for reference_id in sorted(references)]
+        # Single assignments are atomic; readers see either the old or new index
+        self._references, self._listing, self._signature = references, listing, signature
+        logger.info(f"Loaded {len(references)} reference templates from {self.directory}")
+
+    def reload_if_changed(self) -> bool:
+        if self._scan() == self._signature:
+            return False
+        self.load()
+        return True
+
+    def get(self, reference_id: str) -> CompiledReference:
+        reference = self._references.get(reference_id)
+        if reference is None:
+            raise ValueError("Reference not found")
+        return reference
+
+    def listing(self, offset: int = 0, limit: Optional[int] = None) -> List[Dict]:
+        listing = self._listing
+        end = None if limit is None else offset + limit
+        return listing[offset:end]
+
+    def __len__(self) -> int:
+        return len(self._references)
+
+    def start_watching(self):
+        if self.reload_interval <= 0 or self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._watch, name="reference-watcher", daemon=True)
+        self._thread.start()
+
+    def stop_watching(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.reload_interval + 1)
+            self._thread = None
+
+    def _watch(self):
+        while not self._stop.wait(self.reload_interval):
+            try:
+                self.reload_if_changed()
+            except Exception as e:
+                logger.error(f"Reference reload failed: {str(e)}")
@@ -0,0 +1,77 @@
+"""
+Bundled harmonize response
+
+With "return_mode": "bundle", harmonize answers with the MIDI file and its
+chord information in one body (Content-Type: application/vnd.harmony.bundle),
+so a client gets both in a single round trip with nothing to parse from
+headers:
+
+    magic        4 bytes   b"HRB1"
+    info_len     uint32    length of the JSON chord information
+    info         JSON      {"chord_names": [...], "chord_details": [...]}, as in URL mode
+                           (chord_format "compact": {"chord_details": [...]} only)
+    midi_len     uint32    length of the MIDI file
+    midi         bytes     the Standard MIDI File, as in bytes mode
+
+All integers are little-endian. The MIDI bytes are copied into the body as
+they are; decode() hands them back as a slice of the body.
+"""
+import json
+import struct
+from typing import Dict, List, Tuple
+
+from response_encoding import dumps
+
+CONTENT_TYPE = "application/vnd.harmony.bundle"
+MAGIC = b"HRB1"
+
+_U32 = struct.Struct("<I")
+
+
+def chord_info(chord_names_info: List[Dict], compact: bool = False) -> Dict:
+    """
+    Chord information as returned in URL and bundle mode
+    compact sends note numbers only: no chord_names list, and no chord_name or
+    note_names in the details (models.CompactChordDetail)
+    """
+    if compact:
+        return {
+            "chord_details": [
+                {
+                    'time_sec': chord['time_sec'],
+                    'duration_sec': chord['duration_sec'],
+                    'root_note': chord['root_note'],
+                    'notes': chord['notes']
+                }
+                for chord in chord_names_info
+            ]
+        }
+    return {
+        "chord_names": [chord['chord_name'] for chord in chord_names_info],
+        "chord_details": chord_names_info
+    }
+
+
+def encode(midi_bytes: bytes, chord_names_info: List[Dict], compact: bool = False) -> bytes:
+    info = dumps(chord_info(chord_names_info, compact))
+    return b"".join((MAGIC, _U32.pack(len(info)), info, _U32.pack(len(midi_bytes)), midi_bytes))
+
+
+def decode(body: bytes) -> Tuple[memoryview, Dict]:
+    """
+    Split a bundle into (MIDI bytes, chord information) (used by clients and tools)
+
+    Raises:
+        ValueError: Malformed bundle
+    """
+    view = memoryview(body)
+    if len(view) < 8 or view[:4] != MAGIC:
+        raise ValueError("Malformed bundle: bad magic")
+    info_end = 8 + _U32.unpack_from(view, 4)[0]
+    if info_end + 4 > len(view):
+        raise ValueError("Malformed bundle: truncated chord information")
+    info = json.loads(bytes(view[8:info_end]))
+    midi_end = info_end + 4 + _U32.unpack_from(view, info_end)[0]
+    if midi_end != len(view):
+        raise ValueError("Malformed bundle: MIDI length mismatch")
+    return view[info_end + 4:midi_end], info
@@ -0,0 +1,105 @@
+"""
+Negotiated encoding of JSON responses
+
+evaluate results and harmonize URL-mode chord information are the JSON
+bodies mobile clients wait for. json_response() serializes them once to
+bytes, with orjson when it is installed (the json module otherwise, same
+compact output as JSONResponse), and compresses the body when it is at
+least HARMONY_COMPRESS_MIN_BYTES and the request's Accept-Encoding allows
+it: brotli when the brotli package is installed and the client prefers
+it or ranks it equal, gzip otherwise. Compressed responses get a weak
+ETag, since their bytes differ per encoding; every response carries
+Vary: Accept-Encoding. not_modified() gives a 304 the headers of the
+representation it validates.
+"""
+import gzip
+import json
+from functools import lru_cache
+from typing import Any, Dict, Optional, Tuple
+
+from fastapi import Request, Response
+
+import config
+
+try:
+    import orjson
+except ImportError:  # Optional; json gives the same bytes, slower
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # Optional; without it only gzip is offered
+    brotli = None
+
+# Supported codings, most preferred first
+ENCODINGS = ("br", "gzip") if brotli is not None else ("gzip",)
+
+
+def dumps(content: Any) -> bytes:
+    """Compact UTF-8 JSON"""
+    if orjson is not None:
+        return orjson.dumps(content)
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+@lru_cache(maxsize=256)
+def negotiate(accept_encoding: str) -> Optional[str]:
+    """Coding to use for an Accept-Encoding header; None sends the body as it is"""
+    weights: Dict[str, float] = {}
+    for item in accept_encoding.split(","):
+        coding, *params = item.split(";")
+        weight = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        weights[coding.strip().lower()] = weight
+
+    best, best_weight = None, 0.0
+    for coding in ENCODINGS:
+        # An explicit entry overrides "*"
+        weight = weights.get(coding, weights.get("*", 0.0))
+        if weight > best_weight:
+            best, best_weight = coding, weight
+    return best
+
+
+def compress(body: bytes, coding: str) -> bytes:
+    if coding == "br":
+        return brotli.compress(body, quality=config.BROTLI_QUALITY)
+    # mtime=0 keeps the output identical for identical bodies
+    return gzip.compress(body, compresslevel=config.GZIP_LEVEL, mtime=0)
+
+
+def _representation_headers(size: int, request: Request,
+                            headers: Optional[Dict[str, str]]) -> Tuple[Optional[str], Dict[str, str]]:
+    """Coding for a body of size bytes, and the headers of its representation"""
+    headers = {**(headers or {}), "Vary": "Accept-Encoding"}
+    coding = None
+    if size >= config.COMPRESS_MIN_BYTES:
+        coding = negotiate(request.headers.get("accept-encoding", ""))
+        if coding is not None:
+            etag = headers.get("ETag")
+            if etag is not None and not etag.startswith("W/"):
+                headers["ETag"] = f"W/{etag}"
+    return coding, headers
+
+
+def json_response(content: Any, request: Request, status_code: int = 200,
+                  headers: Optional[Dict[str, str]] = None) -> Response:
+    """JSON response, compressed when worthwhile and accepted"""
+    body = dumps(content)
+    coding, headers = _representation_headers(len(body), request, headers)
+    if coding is not None:
+        body = compress(body, coding)
+        headers["Content-Encoding"] = coding
+    return Response(content=body, status_code=status_code, headers=headers, media_type="application/json")
+
+
+def not_modified(content: Any, request: Request, headers: Optional[Dict[str, str]] = None) -> Response:
+    """304 for the json_response() of content, with the same Vary and ETag form"""
+    _, headers = _representation_headers(len(dumps(content)), request, headers)
+    return Response(status_code=304, headers=headers)
@@ -0,0 +1,134 @@
+"""
+Content-addressed result cache for harmonize
+
+Results are keyed by a SHA-256 over the canonical form of the inputs that
+determine the output (events sorted by onset, duration_sec, key,
+harmony_mode, return_mode and chord_format). Entries hold the MIDI bytes together with chord_names_info
+and are evicted least-recently-used once the byte budget is exceeded.
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from models import HarmonizeRequest
+from note_sequence import NoteSequence
+
+# Rough per-chord footprint of a chord_names_info entry (dict + lists)
+CHORD_INFO_SIZE = 256
+
+
+class CacheEntry:
+    """Cached harmonization result"""
+
+    __slots__ = ('midi_bytes', 'chord_names_info', 'etag', 'size', 'blob_id')
+
+    def __init__(self, midi_bytes: bytes, chord_names_info: List[Dict], etag: str):
+        self.midi_bytes = midi_bytes
+        self.chord_names_info = chord_names_info
+        self.etag = etag
+        self.size = len(midi_bytes) + len(chord_names_info) * CHORD_INFO_SIZE
+        self.blob_id = None  # Set once the bytes are in the blob store (URL mode)
+
+
+class HarmonizeCache:
+    """Thread-safe LRU cache with a byte budget"""
+
+    def __init__(self, max_bytes: int = 32 * 1024 * 1024):
+        """
+        Args:
+            max_bytes: Total size budget; 0 disables storing (ETags still work)
+        """
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(request: HarmonizeRequest, sequence: Optional[NoteSequence] = None) -> str:
+        """
+        Canonical hash of everything that influences the generated output
+        Pass the request's NoteSequence when it is already built, to avoid sorting twice
+        """
+        if sequence is None:
+            sequence = NoteSequence.from_events(request.events)
+        canonical = "|".join((
+            str(request.duration_sec),
+            request.key.value,
+            request.harmony_mode.value,
+            request.return_mode.value,
+            request.chord_format.value,
+            ";".join(f"{onset},{note},{vel}" for onset, note, vel in
+                     zip(sequence.onsets_ms, sequence.notes, sequence.velocities)),
+        ))
+        return hashlib.sha256(canonical.encode()).hexdigest()
+
+    @staticmethod
+    def make_etag(key: str, midi_bytes: bytes) -> str:
+        # Covers both the request and the produced bytes, so an ETag changes
+        # whenever a deployment changes the generator output for the same input
+        digest = hashlib.sha256(key.encode() + midi_bytes).hexdigest()
+        return f'"{digest[:32]}"'
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key: str, midi_bytes: bytes, chord_names_info: List[Dict]) -> CacheEntry:
+        """Store a result and return its entry; oversized results are not stored"""
+        entry = CacheEntry(midi_bytes, chord_names_info, self.make_etag(key, midi_bytes))
+        if entry.size > self.max_bytes:
+            return entry
+
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.current_bytes -= previous.size
+            self._entries[key] = entry
+            self.current_bytes += entry.size
+
+            while self.current_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.current_bytes -= evicted.size
+                self.evictions += 1
+        return entry
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Weak comparison of an If-None-Match header against an ETag"""
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*":
+            return True
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
@@ -0,0 +1,296 @@
+"""
+Streaming Standard MIDI File reader
+
+Extracts note-on events from an SMF without building a mido.MidiFile.
+Tracks are read from the file object in fixed-size blocks and decoded in
+one pass (variable-length deltas, running status, meta and sysex events
+skipped by length), so memory is the read block plus four compact
+columns for the notes found, however many tracks or events the file has.
+With durations=True each note's end is also taken from the matching
+note-off (or note-on with velocity 0) on the same channel and key, for
+held lengths; the pairing costs about half again the read time, so it is
+only done when asked.
+
+Onsets can be read two ways:
+- beats: one beat per second, the timeline MidiGenerator writes and the
+  reference index uses
+- tempo: real time, following the file's tempo changes
+"""
+from array import array
+from typing import BinaryIO, List, Tuple
+
+import numpy as np
+
+TIME_BASE_BEATS = "beats"
+TIME_BASE_TEMPO = "tempo"
+
+DEFAULT_TEMPO = 500000  # Microseconds per beat when a file sets none
+READ_BLOCK = 64 * 1024
+# Refill the buffer before an event when fewer bytes than this are left;
+# covers the longest channel event (4-byte delta + status + 2 data bytes)
+_MIN_EVENT_BYTES = 16
+
+# Data bytes after a channel status, by high nibble
+_DATA_LENGTHS = {0x80: 2, 0x90: 2, 0xA0: 2, 0xB0: 2, 0xC0: 1, 0xD0: 1, 0xE0: 2}
+
+
+class SmfFormatError(ValueError):
+    """Raised for input that is not a readable MIDI file"""
+
+    def __init__(self, reason: str):
+        super().__init__(f"Invalid MIDI file: {reason}")
+
+
+class SmfNotes:
+    """Note-on events of a file, in onset order"""
+
+    def __init__(self, ticks_per_beat: int, ticks: np.ndarray, notes: np.ndarray, velocities: np.ndarray,
+                 end_ticks: np.ndarray, tempo_changes: List[Tuple[int, int]], track_names: List[str]):
+        self.ticks_per_beat = ticks_per_beat
+        self.ticks = ticks
+        self.notes = notes
+        self.velocities = velocities
+        self.end_ticks = end_ticks  # -1 where the note is never released (or ends were not read)
+        self.tempo_changes = tempo_changes  # (tick, microseconds per beat), in tick order
+        self.track_names = track_names
+
+    def __len__(self) -> int:
+        return len(self.ticks)
+
+    def onsets_ms(self, time_base: str = TIME_BASE_BEATS) -> np.ndarray:
+        """Onsets in milliseconds (int64)"""
+        return self._to_ms(self.ticks, time_base)
+
+    def durations_ms(self, time_base: str = TIME_BASE_BEATS) -> np.ndarray:
+        """Held lengths in milliseconds (int64), 0 for notes that are never released"""
+        released = self.end_ticks >= 0
+        ends = self._to_ms(np.where(released, self.end_ticks, self.ticks), time_base)
+        return np.where(released, ends - self.onsets_ms(time_base), 0)
+
+    def _to_ms(self, ticks: np.ndarray, time_base: str) -> np.ndarray:
+        ticks = ticks.astype(np.float64)
+        if time_base == TIME_BASE_BEATS:
+            return np.rint(ticks * 1000 / self.ticks_per_beat).astype(np.int64)
+        if time_base != TIME_BASE_TEMPO:
+            raise ValueError(f"Unknown time base: {time_base}")
+
+        # Piecewise linear tick -> microsecond map, one segment per tempo change
+        changes = [(0, DEFAULT_TEMPO)] + [change for change in self.tempo_changes if change[0] > 0]
+        if self.tempo_changes and self.tempo_changes[0][0] == 0:
+            changes[0] = (0, self.tempo_changes[0][1])
+        change_ticks = np.array([tick for tick, _ in changes], dtype=np.float64)
+        tempos = np.array([tempo for _, tempo in changes], dtype=np.float64)
+        starts_us = np.concatenate(([0.0], np.cumsum(np.diff(change_ticks) * tempos[:-1] / self.ticks_per_beat)))
+        segment = np.searchsorted(change_ticks, ticks, side="right") - 1
+        micros = starts_us[segment] + (ticks - change_ticks[segment]) * tempos[segment] / self.ticks_per_beat
+        return np.rint(micros / 1000).astype(np.int64)
+
+
+def _read_exact(stream: BinaryIO, size: int, what: str) -> bytes:
+    data = stream.read(size)
+    if len(data) != size:
+        raise SmfFormatError(f"truncated {what}")
+    return data
+
+
+def read_notes(stream: BinaryIO, max_notes: int = 1 << 20, max_bytes: int = 0,
+               block_size: int = READ_BLOCK, durations: bool = False) -> SmfNotes:
+    """
+    Read every note-on (velocity > 0) of an SMF from a binary file object
+
+    Args:
+        max_notes: More note-ons raise ValueError("Too many events ...")
+        max_bytes: Larger files raise ValueError("MIDI file too large ..."); 0 = no limit
+        block_size: Bytes read from the stream at a time
+        durations: Pair note-offs with note-ons to fill end_ticks
+
+    Raises:
+        SmfFormatError: Malformed or unsupported file
+    """
+    header = stream.read(14)
+    if len(header) < 14 or header[:4] != b"MThd":
+        raise SmfFormatError("missing MThd header")
+    header_length = int.from_bytes(header[4:8], "big")
+    if header_length < 6:
+        raise SmfFormatError("short MThd header")
+    division = int.from_bytes(header[12:14], "big")
+    if division & 0x8000:
+        raise SmfFormatError("SMPTE time division is not supported")
+    if division == 0:
+        raise SmfFormatError("zero ticks per beat")
+    if header_length > 6:
+        _read_exact(stream, header_length - 6, "MThd header")
+    consumed = 8 + header_length
+
+    ticks = array('q')
+    notes = array('B')
+    velocities = array('B')
+    end_ticks = array('q')
+    tempo_changes: List[Tuple[int, int]] = []
+    track_names: List[str] = []
+
+    while True:
+        chunk_header = stream.read(8)
+        if not chunk_header:
+            break
+        if len(chunk_header) < 8:
+            raise SmfFormatError("truncated chunk header")
+        length = int.from_bytes(chunk_header[4:8], "big")
+        consumed += 8 + length
+        if max_bytes and consumed > max_bytes:
+            raise ValueError(f"MIDI file too large: at most {max_bytes} bytes")
+        if chunk_header[:4] != b"MTrk":
+            # Unknown chunk types are skipped, as the SMF spec asks
+            _skip(stream, length, block_size, "chunk")
+            continue
+        track_name = _read_track(stream, length, block_size, ticks, notes, velocities,
+                                 end_ticks, tempo_changes, durations)
+        track_names.append(track_name)
+        if len(ticks) > max_notes:
+            raise ValueError(f"Too many events: at most {max_notes} notes per file")
+
+    order = np.argsort(np.frombuffer(ticks, dtype=np.int64), kind="stable") if ticks else np.empty(0, dtype=np.intp)
+    tempo_changes.sort(key=lambda change: change[0])
+    return SmfNotes(
+        division,
+        np.frombuffer(ticks, dtype=np.int64)[order] if ticks else np.empty(0, dtype=np.int64),
+        np.frombuffer(notes, dtype=np.uint8)[order] if notes else np.empty(0, dtype=np.uint8),
+        np.frombuffer(velocities, dtype=np.uint8)[order] if velocities else np.empty(0, dtype=np.uint8),
+        np.frombuffer(end_ticks, dtype=np.int64)[order] if end_ticks else np.full(len(order), -1, dtype=np.int64),
+        tempo_changes,
+        track_names,
+    )
+
+
+def _skip(stream: BinaryIO, size: int, block_size: int, what: str):
+    while size > 0:
+        data = stream.read(min(size, block_size))
+        if not data:
+            raise SmfFormatError(f"truncated {what}")
+        size -= len(data)
+
+
+def _read_track(stream: BinaryIO, length: int, block_size: int, ticks: array, notes: array,
+                velocities: array, end_ticks: array, tempo_changes: List[Tuple[int, int]],
+                pair_ends: bool) -> str:
+    """Decode one MTrk chunk, appending its note-ons (and their ends); returns the track name"""
+    chunk_left = length   # Bytes of the chunk still in the stream
+    buf = b""
+    pos = 0
+    tick = 0
+    status = 0
+    name = ""
+    add_tick, add_note, add_velocity, add_end = ticks.append, notes.append, velocities.append, end_ticks.append
+    # (note << 4 | channel) -> index of the note-on still sounding
+    sounding = {}
+    release = sounding.pop
+    index = len(ticks)
+
+    while True:
+        end = len(buf)
+        if end - pos < _MIN_EVENT_BYTES and chunk_left:
+            data = _read_exact(stream, min(block_size, chunk_left), "track")
+            chunk_left -= len(data)
+            buf = buf[pos:] + data
+            pos, end = 0, len(buf)
+        if pos >= end:
+            break  # Chunk done without an end-of-track event
+
+        try:
+            # Delta time (variable-length quantity, at most 4 bytes)
+            byte = buf[pos]
+            pos += 1
+            delta = byte & 0x7F
+            count = 1
+            while byte & 0x80:
+                if count == 4:
+                    raise SmfFormatError("delta time longer than 4 bytes")
+                byte = buf[pos]
+                pos += 1
+                delta = (delta << 7) | (byte & 0x7F)
+                count += 1
+            tick += delta
+
+            byte = buf[pos]
+            if byte & 0x80:
+                pos += 1
+                if byte < 0xF0:
+                    status = byte
+            elif not status:
+                raise SmfFormatError("data byte without a running status")
+            else:
+                byte = status  # Running status: this byte is the first data byte
+
+            if byte < 0xF0:
+                kind = byte & 0xF0
+                if kind == 0x90 or kind == 0x80:
+                    note, velocity = buf[pos], buf[pos + 1]
+                    pos += 2
+                    if pair_ends:
+                        key = note << 4 | (byte & 0x0F)
+                        # A note-on ends the same key's previous note as well (re-strike)
+                        held = release(key, None)
+                        if held is not None:
+                            end_ticks[held] = tick
+                    if velocity and kind == 0x90:
+                        if pair_ends:
+                            sounding[key] = index
+                            index += 1
+                            add_end(-1)
+                        add_tick(tick)
+                        add_note(note)
+                        add_velocity(velocity)
+                else:
+                    pos += _DATA_LENGTHS[kind]
+                    if pos > end:
+                        raise IndexError
+                continue
+
+            # Meta (FF type len data) and sysex (F0/F7 len data)
+            if byte == 0xFF:
+                meta_type = buf[pos]
+                pos += 1
+            else:
+                meta_type = None
+            size = 0
+            for _ in range(4):
+                byte = buf[pos]
+                pos += 1
+                size = (size << 7) | (byte & 0x7F)
+                if not byte & 0x80:
+                    break
+            else:
+                raise SmfFormatError("event length longer than 4 bytes")
+        except IndexError:
+            raise SmfFormatError("truncated track")
+
+        if meta_type == 0x2F:
+            # End of track; anything after it in the chunk is ignored
+            _skip(stream, chunk_left, block_size, "track")
+            break
+        if meta_type in (0x51, 0x03):
+            # Small payloads worth reading: tempo and track name
+            while end - pos < size and chunk_left:
+                data = _read_exact(stream, min(block_size, chunk_left), "track")
+                chunk_left -= len(data)
+                buf = buf[pos:] + data
+                pos, end = 0, len(buf)
+            if end - pos < size:
+                raise SmfFormatError("truncated track")
+            payload = buf[pos:pos + size]
+            if meta_type == 0x51 and size == 3:
+                tempo_changes.append((tick, int.from_bytes(payload, "big")))
+            elif meta_type == 0x03 and not name:
+                name = payload.decode("latin-1")
+        # Skip the payload, reading past the buffer when it is longer
+        if size <= end - pos:
+            pos += size
+        else:
+            beyond = size - (end - pos)
+            if beyond > chunk_left:
+                raise SmfFormatError("truncated track")
+            _skip(stream, beyond, block_size, "track")
+            chunk_left -= beyond
+            buf, pos = b"", 0
+
+    return name
@@ -0,0 +1,271 @@
+"""
+Standard MIDI File writers used by MidiGenerator
+
+Two interchangeable writers share the same small event API
+(start_track / set_tempo / program_change / note_on / note_off /
+end_track / getvalue):
+
+- MidoWriter builds a mido MidiFile object graph and serializes it with
+  mido. It is the reference implementation.
+- SmfWriter writes SMF bytes straight into a single preallocated buffer,
+  using a precomputed variable-length delta table and running status.
+  Its output is byte-identical to mido's serializer.
+
+For long sequences the file is streamed in two passes: SmfSizer runs the
+same calls and only counts bytes, then SmfStreamWriter writes the track
+headers with the precomputed lengths and hands out the encoded bytes in
+chunks, so memory stays flat however long the file is.
+"""
+import struct
+from io import BytesIO
+from typing import List
+
+import mido
+
+ENCODER_MIDO = "mido"
+ENCODER_DIRECT = "direct"
+ENCODERS = (ENCODER_MIDO, ENCODER_DIRECT)
+
+# Deltas below this limit are looked up instead of encoded.
+# One minute at 480 ticks per second (28800 ticks) fits in the table.
+VLQ_TABLE_LIMIT = 1 << 15
+
+# Worst case bytes for one channel event: 4-byte delta + 3-byte message
+MAX_EVENT_SIZE = 7
+
+_END_OF_TRACK = b'\xff\x2f\x00'
+_SET_TEMPO = b'\xff\x51\x03'
+
+
+def encode_variable_int(value: int) -> bytes:
+    """Encode a delta time as a MIDI variable-length quantity"""
+    if value < 0:
+        raise ValueError('message time must be non-negative in MIDI file')
+
+    encoded = [value & 0x7F]
+    value >>= 7
+    while value:
+        encoded.append((value & 0x7F) | 0x80)
+        value >>= 7
+    return bytes(reversed(encoded))
+
+
+_VLQ_TABLE = tuple(encode_variable_int(value) for value in range(VLQ_TABLE_LIMIT))
+
+
+def _delta_bytes(delta: int) -> bytes:
+    if 0 <= delta < VLQ_TABLE_LIMIT:
+        return _VLQ_TABLE[delta]
+    return encode_variable_int(delta)
+
+
+class SmfWriter:
+    """Direct SMF encoder writing into one preallocated bytearray"""
+
+    __slots__ = ('_buf', '_pos', '_running_status', '_track_start')
+
+    def __init__(self, ticks_per_beat: int, track_count: int, capacity: int = 1024, smf_type: int = 1):
+        self._buf = bytearray(max(capacity, 64))
+        header = b'MThd' + struct.pack('>Lhhh', 6, smf_type, track_count, ticks_per_beat)
+        self._buf[0:len(header)] = header
+        self._pos = len(header)
+        self._running_status = None
+        self._track_start = None
+
+    @staticmethod
+    def estimate_capacity(event_count: int, track_count: int = 2) -> int:
+        """Buffer size that fits a melody + harmony file without growing"""
+        # Melody: on/off per note; harmony: three on/off pairs per note
+        return 64 + track_count * 16 + event_count * 8 * MAX_EVENT_SIZE
+
+    def _write(self, data: bytes):
+        end = self._pos + len(data)
+        if end > len(self._buf):
+            self._buf.extend(bytes(max(end, 2 * len(self._buf)) - len(self._buf)))
+        self._buf[self._pos:end] = data
+        self._pos = end
+
+    def _channel_message(self, delta: int, status: int, data: bytes):
+        self._write(_delta_bytes(delta))
+        if status != self._running_status:
+            self._write(bytes((status,)))
+            self._running_status = status
+        self._write(data)
+
+    def start_track(self):
+        """Open a new MTrk chunk; its length is patched in by end_track()"""
+        self._write(b'MTrk\x00\x00\x00\x00')
+        self._track_start = self._pos
+        self._running_status = None
+
+    def end_track(self, delta: int = 0):
+        """Append end_of_track and back-fill the chunk length"""
+        self._write(_delta_bytes(delta))
+        self._write(_END_OF_TRACK)
+        struct.pack_into('>L', self._buf, self._track_start - 4, self._pos - self._track_start)
+        self._track_start = None
+        self._running_status = None
+
+    def set_tempo(self, tempo: int, delta: int = 0):
+        self._write(_delta_bytes(delta))
+        self._write(_SET_TEMPO + tempo.to_bytes(3, 'big'))
+        self._running_status = None
+
+    def program_change(self, channel: int, program: int, delta: int = 0):
+        self._channel_message(delta, 0xC0 | channel, bytes((program,)))
+
+    def note_on(self, channel: int, note: int, velocity: int, delta: int = 0):
+        self._channel_message(delta, 0x90 | channel, bytes((note, velocity)))
+
+    def note_off(self, channel: int, note: int, velocity: int = 0, delta: int = 0):
+        self._channel_message(delta, 0x80 | channel, bytes((note, velocity)))
+
+    def getvalue(self) -> bytes:
+        return bytes(self._buf[:self._pos])
+
+
+class SmfSizer:
+    """First streaming pass: same API as SmfWriter, but only measures the output"""
+
+    __slots__ = ('size', 'track_lengths', '_running_status', '_track_start')
+
+    pending = 0  # Nothing is buffered, take() never has data
+
+    def __init__(self):
+        self.size = 14  # MThd chunk
+        self.track_lengths = []
+        self._running_status = None
+        self._track_start = None
+
+    def _channel_message(self, delta: int, status: int, data_size: int):
+        self.size += len(_delta_bytes(delta)) + data_size
+        if status != self._running_status:
+            self.size += 1
+            self._running_status = status
+
+    def start_track(self):
+        self.size += 8
+        self._track_start = self.size
+        self._running_status = None
+
+    def end_track(self, delta: int = 0):
+        self.size += len(_delta_bytes(delta)) + len(_END_OF_TRACK)
+        self.track_lengths.append(self.size - self._track_start)
+        self._track_start = None
+        self._running_status = None
+
+    def set_tempo(self, tempo: int, delta: int = 0):
+        self.size += len(_delta_bytes(delta)) + len(_SET_TEMPO) + 3
+        self._running_status = None
+
+    def program_change(self, channel: int, program: int, delta: int = 0):
+        self._channel_message(delta, 0xC0 | channel, 1)
+
+    def note_on(self, channel: int, note: int, velocity: int, delta: int = 0):
+        self._channel_message(delta, 0x90 | channel, 2)
+
+    def note_off(self, channel: int, note: int, velocity: int = 0, delta: int = 0):
+        self._channel_message(delta, 0x80 | channel, 2)
+
+    def take(self) -> bytes:
+        return b''
+
+
+class SmfStreamWriter(SmfWriter):
+    """
+    Second streaming pass: SmfWriter whose track lengths are known up front
+
+    Encoded bytes accumulate in the buffer until take() hands them out;
+    the buffer is then reused, so it never grows past one chunk plus one event.
+    """
+
+    __slots__ = ('_track_lengths', '_track_index', '_flushed')
+
+    def __init__(self, ticks_per_beat: int, track_lengths: List[int], capacity: int = 64 * 1024, smf_type: int = 1):
+        super().__init__(ticks_per_beat, len(track_lengths), capacity=capacity, smf_type=smf_type)
+        self._track_lengths = list(track_lengths)
+        self._track_index = 0
+        self._flushed = 0  # Bytes already handed out by take()
+
+    @property
+    def pending(self) -> int:
+        """Bytes buffered since the last take()"""
+        return self._pos
+
+    def start_track(self):
+        """Open a new MTrk chunk with its precomputed length"""
+        self._write(b'MTrk' + struct.pack('>L', self._track_lengths[self._track_index]))
+        self._track_start = self._flushed + self._pos
+        self._running_status = None
+
+    def end_track(self, delta: int = 0):
+        """Append end_of_track and check the chunk against its precomputed length"""
+        self._write(_delta_bytes(delta))
+        self._write(_END_OF_TRACK)
+        written = self._flushed + self._pos - self._track_start
+        if written != self._track_lengths[self._track_index]:
+            raise RuntimeError(
+                f"Track {self._track_index} wrote {written} bytes, "
+                f"expected {self._track_lengths[self._track_index]}"
+            )
+        self._track_index += 1
+        self._track_start = None
+        self._running_status = None
+
+    def take(self) -> bytes:
+        """Hand out the buffered bytes and start reusing the buffer"""
+        data = bytes(self._buf[:self._pos])
+        self._flushed += self._pos
+        self._pos = 0
+        return data
+
+
+class MidoWriter:
+    """Reference writer that builds mido objects and lets mido serialize them"""
+
+    def __init__(self, ticks_per_beat: int, track_count: int = 0, capacity: int = 0, smf_type: int = 1):
+        self.mid = mido.MidiFile(type=smf_type, ticks_per_beat=ticks_per_beat)
+        self._track = None
+
+    @staticmethod
+    def estimate_capacity(event_count: int, track_count: int = 2) -> int:
+        return 0
+
+    def start_track(self):
+        self._track = mido.MidiTrack()
+        self.mid.tracks.append(self._track)
+
+    def end_track(self, delta: int = 0):
+        # mido appends end_of_track itself when saving
+        if delta:
+            self._track.append(mido.MetaMessage('end_of_track', time=delta))
+        self._track = None
+
+    def set_tempo(self, tempo: int, delta: int = 0):
+        self._track.append(mido.MetaMessage('set_tempo', tempo=tempo, time=delta))
+
+    def program_change(self, channel: int, program: int, delta: int = 0):
+        self._track.append(mido.Message('program_change', channel=channel, program=program, time=delta))
+
+    def note_on(self, channel: int, note: int, velocity: int, delta: int = 0):
+        self._track.append(mido.Message('note_on', channel=channel, note=note, velocity=velocity, time=delta))
+
+    def note_off(self, channel: int, note: int, velocity: int = 0, delta: int = 0):
+        self._track.append(mido.Message('note_off', channel=channel, note=note, velocity=velocity, time=delta))
+
+    def getvalue(self) -> bytes:
+        bytes_io = BytesIO()
+        self.mid.save(file=bytes_io)
+        return bytes_io.getvalue()
+
+
+def create_writer(encoder: str, ticks_per_beat: int, event_count: int, track_count: int = 2):
+    """Create the writer selected by name ("mido" or "direct")"""
+    if encoder == ENCODER_DIRECT:
+        writer_cls = SmfWriter
+    elif encoder == ENCODER_MIDO:
+        writer_cls = MidoWriter
+    else:
+        raise ValueError(f"Unknown MIDI encoder: {encoder}")
+    capacity = writer_cls.estimate_capacity(event_count, track_count)
+    return writer_cls(ticks_per_beat, track_count, capacity=capacity)